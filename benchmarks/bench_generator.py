@@ -0,0 +1,185 @@
+"""Benchmark the generator over synthetic spec modules of increasing size
+
+Usage: python benchmarks/bench_generator.py [--sizes 10,100,1000,10000]
+                                            [--save-baseline [PATH]]
+                                            [--compare [PATH]]
+
+For each size, a spec module is synthesized (see synth.py) and the time
+taken by FuncProcessor.process, code_lines and docs_for_function across all
+of its functions is measured, along with the end-to-end time and peak
+traced memory of code_for_module.  Results can be stored as a baseline and
+later compared against it.
+
+The checked-in baseline.json holds the results for the current generator.
+Refresh it (with the default sizes) whenever a change to the generator is
+meant to change its performance, so that --compare keeps measuring against
+the tree as it is:
+
+    python benchmarks/bench_generator.py --save-baseline
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from gssapi_bindings_gen.processor import FuncProcessor
+from gssapi_bindings_gen.languages.cython import CythonCodeGenerator
+
+import synth
+
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+# (metric name, unit)
+METRICS = [
+    ('process', 's'),
+    ('code_lines', 's'),
+    ('docs_for_function', 's'),
+    ('code_for_module', 's'),
+    ('peak_memory', 'MiB'),
+]
+
+
+def _best_time(func, repeat):
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def bench_size(count, work_dir, repeat):
+    module = synth.import_module(synth.write_module(count, work_dir))
+
+    gen = CythonCodeGenerator(FuncProcessor)
+    funcs = gen.functions_for_module(module)
+    processor = gen.processor
+
+    processed = [processor.process(func) for func in funcs]
+    func_lines = [gen.generate_func_line(func) for func in funcs]
+
+    def run_process():
+        for func in funcs:
+            processor.process(func)
+
+    def run_code_lines():
+        for func, processed_func in zip(funcs, processed):
+            gen.code_lines(func, processed_func)
+
+    def run_docs():
+        for func, func_line, processed_func in zip(funcs, func_lines,
+                                                   processed):
+            gen.docs_for_function(func_line, processed_func.func_docs,
+                                  processed_func.input_docs, func)
+
+    def run_module():
+        gen.code_for_module(module)
+
+    results = {
+        'process': _best_time(run_process, repeat),
+        'code_lines': _best_time(run_code_lines, repeat),
+        'docs_for_function': _best_time(run_docs, repeat),
+        'code_for_module': _best_time(run_module, repeat),
+    }
+
+    gc.collect()
+    tracemalloc.start()
+    run_module()
+    results['peak_memory'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    return results
+
+
+def run(sizes, repeat):
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for count in sizes:
+            # keep the total amount of work per size roughly constant
+            size_repeat = max(1, repeat * 100 // max(count, 100))
+            results[str(count)] = bench_size(count, work_dir, size_repeat)
+            print('benchmarked %d functions' % count, file=sys.stderr)
+
+    return results
+
+
+def _format_value(value, unit):
+    if unit == 's':
+        return '%10.4f s' % value
+    else:
+        return '%8.2f %s' % (value, unit)
+
+
+def report(results, baseline=None):
+    header = '%-8s %-18s %13s' % ('funcs', 'metric', 'value')
+    if baseline is not None:
+        header += ' %13s %8s' % ('baseline', 'ratio')
+    print(header)
+
+    for count, size_results in sorted(results.items(),
+                                      key=lambda item: int(item[0])):
+        for metric, unit in METRICS:
+            value = size_results[metric]
+            line = '%-8s %-18s %13s' % (count, metric,
+                                        _format_value(value, unit))
+
+            base_value = (baseline or {}).get(count, {}).get(metric)
+            if base_value:
+                line += ' %13s %7.2fx' % (_format_value(base_value, unit),
+                                          value / base_value)
+            elif baseline is not None:
+                line += ' %13s %8s' % ('-', '-')
+
+            print(line)
+
+        per_func = size_results['code_for_module'] / int(count) * 1e6
+        print('%-8s %-18s %10.1f us' % (count, '(per function)', per_func))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes',
+                        default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated numbers of functions')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='repetitions for the 100-function module '
+                             '(scaled down for larger ones)')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        metavar='PATH', help='store the results as a baseline')
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE,
+                        metavar='PATH', help='compare against a baseline')
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes, args.repeat)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    report(results, baseline)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump({'python': sys.version.split()[0], 'results': results},
+                      baseline_file, indent=4, sort_keys=True)
+            baseline_file.write('\n')
+
+
+if __name__ == '__main__':
+    main()
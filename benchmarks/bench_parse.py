@@ -0,0 +1,234 @@
+"""Measure the per-function cost of parsing and processing specs
+
+Usage: python benchmarks/bench_parse.py [module ...]
+
+For every function in the given spec modules (sample_methods by default),
+this reports the best-of-N time taken by:
+
+    old parse   the docstring handling of the previous processor, which
+                located each section with repeated slicing, and matched
+                every line against regular expressions (kept below as
+                baseline_parse, since the processor no longer has it)
+    cold parse  parser.parse_spec, which FuncProcessor now uses, with its
+                caches of parsed lines and calls cleared first (less the
+                time taken to clear them), as for the first generation
+    warm parse  parser.parse_spec with its caches filled, as when the
+                same lines get parsed again (like with --watch, or for the
+                batched and async variants of a function)
+    process     FuncProcessor.process, which also covers resolving
+                transformers through the lookup
+
+The old parse path stops at the "Success On:" section, since it predates
+the "Options:" section, so it does slightly less work for specs with
+options.  It also does less work in general: it only splits out the
+arguments of calls with regular expressions, without handling nested
+calls, and leaves the rest of each line as strings, where the new
+parser builds the nodes which the processor needs anyway.  So on cold
+caches, the new parser is slower than the old path, and is only faster
+once the lines it has seen before come from its caches.
+"""
+
+import argparse
+import collections
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gssapi_bindings_gen import parser
+from gssapi_bindings_gen.processor import FuncProcessor
+from gssapi_bindings_gen.languages.cython import CythonCodeGenerator
+
+
+# the parsing done by the processor before the single-pass parser, without
+# the lookups (which both paths do the same way)
+
+_TRANSFORMER_RE = re.compile(r'^(?P<func>\w+)\((?P<args>.+?)\)'
+                             r'(; inplace\((?P<inline>.+)\))?'
+                             r'(; cleanup\((?P<cleanup>.+)\))?$')
+
+
+def _find_start(content, header, mandatory=False, offset=0):
+    full_header = '%s:\n' % header
+    content_partial = content[offset:]
+    if full_header in content:
+        return content_partial.index(full_header) + len(full_header) + offset
+    elif not mandatory:
+        return None
+    else:
+        raise ValueError('Expected to find "%s", but it was missing' % header)
+
+
+def _baseline_input_line(line):
+    if line.startswith('# '):
+        return (line[2:].strip(), None, None)
+
+    parts = line.split(' -> ')
+    if ' # ' in parts[-1]:
+        doc_index = parts[-1].index(' # ')
+        doc_str = parts[-1][doc_index + 3:].strip()
+        parts[-1] = parts[-1][:doc_index].rstrip()
+    else:
+        doc_str = None
+
+    if len(parts) == 1:
+        return (doc_str, parts[0], None)
+
+    trans_raw = parts[1]
+    if trans_raw.startswith('['):
+        temp_type_end = trans_raw.index(']')
+        dollar_expr = trans_raw[temp_type_end + 1:].strip()
+    else:
+        dollar_expr = trans_raw
+
+    func_match = _TRANSFORMER_RE.match(dollar_expr)
+    if func_match is not None:
+        func_params = [p.strip()
+                       for p in func_match.group('args').split(';')]
+    else:
+        func_params = None
+
+    return (doc_str, parts[0], func_params)
+
+
+def _baseline_output_line(line):
+    parts = line.split(' -> ')
+    name_spec = parts[0]
+
+    if name_spec.endswith(']'):
+        temp_type_start = name_spec.index('[')
+        annotation_parts = name_spec[temp_type_start + 1:-1].split('; ')
+        temporary_type = annotation_parts[0]
+        if ': ' in temporary_type:
+            tags_raw, temporary_type = temporary_type.split(': ', 1)
+            set(tags_raw.split(', '))
+
+    if len(parts) > 1 and not parts[1].startswith('; hook('):
+        func_match = _TRANSFORMER_RE.match(parts[1])
+        if func_match is not None:
+            [p.strip() for p in func_match.group('args').split(';')]
+
+    return parts
+
+
+def baseline_parse(doc_str):
+    input_args_start = _find_start(doc_str, 'Input Args', mandatory=True)
+    output_args_start = _find_start(doc_str, 'Output Args',
+                                    offset=input_args_start)
+    success_on_start = _find_start(doc_str, 'Success On',
+                                   offset=output_args_start or
+                                   input_args_start)
+
+    if output_args_start is not None:
+        input_args_end = output_args_start - 13
+    elif success_on_start is not None:
+        input_args_end = success_on_start - 12
+    else:
+        input_args_end = len(doc_str) + 1
+
+    if success_on_start is not None:
+        output_args_end = success_on_start - 12
+    else:
+        output_args_end = len(doc_str) + 1
+
+    input_args_raw = doc_str[input_args_start:input_args_end]
+    input_args = collections.OrderedDict()
+    for line in [line.strip() for line in input_args_raw.splitlines()
+                 if line and not line.isspace()]:
+        doc, arg_name, func_params = _baseline_input_line(line)
+        if arg_name is not None:
+            input_args[arg_name] = (doc, func_params)
+
+    output_args = []
+    if output_args_start is not None:
+        output_args_raw = doc_str[output_args_start:output_args_end]
+        output_args = [_baseline_output_line(line) for line
+                       in [line.strip() for line
+                           in output_args_raw.splitlines()
+                           if line and not line.isspace()]]
+
+    if success_on_start is not None:
+        success_on = [line.strip() for line
+                      in doc_str[success_on_start:].splitlines()
+                      if line and not line.isspace()]
+    else:
+        success_on = ['GSS_S_COMPLETE']
+
+    return (input_args, output_args, success_on,
+            doc_str[:input_args_start - 12])
+
+
+_PARSE_CACHES = (parser.parse_input_line, parser.parse_output_line,
+                 parser.parse_transform, parser.parse_call)
+
+
+def _clear_parse_caches():
+    for cached_func in _PARSE_CACHES:
+        cached_func.cache_clear()
+
+
+def cold_parse(doc_str):
+    _clear_parse_caches()
+    return parser.parse_spec(doc_str)
+
+
+def _best(func, number, repeat):
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def bench_module(gen, processor, module, number, repeat):
+    results = []
+    for func in gen.functions_for_module(module):
+        doc_str = func.__doc__
+        results.append((
+            func.__name__, len(doc_str),
+            _best(lambda: baseline_parse(doc_str), number, repeat),
+            (_best(lambda: cold_parse(doc_str), number, repeat) -
+             _best(_clear_parse_caches, number, repeat)),
+            _best(lambda: parser.parse_spec(doc_str), number, repeat),
+            _best(lambda: processor.process(func), number, repeat)))
+
+    return results
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0])
+    arg_parser.add_argument('modules', nargs='*', default=['sample_methods'])
+    arg_parser.add_argument('-n', '--number', type=int, default=2000)
+    arg_parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = arg_parser.parse_args(argv)
+
+    gen = CythonCodeGenerator(FuncProcessor)
+    processor = gen.processor
+
+    totals = [0.0, 0.0, 0.0, 0.0]
+    count = 0
+    print('%-32s %10s %12s %12s %12s %12s' % ('function', 'doc bytes',
+                                              'old parse', 'cold parse',
+                                              'warm parse', 'process'))
+    for module_name in args.modules:
+        __import__(module_name)
+        module = sys.modules[module_name]
+        for result in bench_module(gen, processor, module, args.number,
+                                   args.repeat):
+            func_name, doc_len = result[:2]
+            times = result[2:]
+            print('%-32s %10d %12.2f %12.2f %12.2f %12.2f' % (
+                (func_name, doc_len) + tuple(t * 1e6 for t in times)))
+
+            totals = [total + t for total, t in zip(totals, times)]
+            count += 1
+
+    if count:
+        print('%-32s %10s %12.2f %12.2f %12.2f %12.2f' % (
+            ('(mean)', '') + tuple(total / count * 1e6
+                                   for total in totals)))
+        print('(times in usec/call)')
+
+
+if __name__ == '__main__':
+    main()
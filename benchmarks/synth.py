@@ -0,0 +1,230 @@
+"""Synthesize large spec modules for benchmarking
+
+The generated functions cycle through a set of templates which together
+exercise the whole spec grammar: known wrapper types, explicit temporary
+types, default/default_assign/bytes_to_buffer transformers, inplace and
+cleanup clauses, doc continuation lines, hooks, optional and nullable
+outputs, inverse transformers, positional outputs, multi-code
+Success On sections and batched (many) variants.
+"""
+
+import importlib.util
+import os
+import sys
+
+
+_HEADER = '''from gssapi_bindings_gen.utils import NotNone
+
+'''
+
+_TEMPLATES = [
+    '''
+def init_context_{n}(target_name: NotNone('Name'), creds: 'Creds' = None,
+                     context: 'SecurityContext' = None, mech: 'OID' = None,
+                     flags=None, lifetime=None,
+                     channel_bindings: 'ChannelBindings' = None,
+                     input_token: 'bytes' = None) -> 'InitContext{n}Result':
+    """
+    Initiate security context number {n}.
+{filler}
+    Warning:
+        This changes the input context!
+
+    Raises:
+        InvalidTokenError
+        InvalidCredentialsError
+        BadChannelBindingsError
+
+    Input Args:
+        creds -> [gss_cred_id_t] default(GSS_C_NO_CREDENTIAL)
+            # the credentials to use, or None to use the defaults
+        context -> [SecurityContext] default_assign(SecurityContext()); inplace(&$.raw_ctx)
+            # the security context to update
+        target_name  # the target for the security context
+        mech -> [gss_OID] default(GSS_C_NO_OID; &$.raw_oid)
+            # the mechanism type for this security context
+        flags -> [OM_uint32] default(BLAH; IntEnumFlagSet(RequirementFlag, $))
+            # the requested flags
+        lifetime -> [OM_uint32] py_ttl_to_c($)
+            # the requested lifetime
+        channel_bindings
+            # the channel bindings
+        input_token
+            # the input token
+
+    Output Args:
+        context
+        actual_mech_type [gss_OID; &$]
+        ret_flags [OM_uint32; &$] -> IntEnumFlagSet(RequirementFlag, $)
+        output_token -> ; hook(output_token)
+        output_ttl [OM_uint32; &$] -> c_ttl_to_py($)
+        ; -> maj_stat == GSS_C_CONTINUE_NEEDED
+
+    Success On:
+        GSS_S_COMPLETE
+        GSS_S_CONTINUE_NEEDED
+    """
+''',
+    '''
+def accept_context_{n}(input_token: NotNone('bytes'),
+                       acceptor_creds: 'Creds' = None,
+                       context: 'SecurityContext' = None,
+                       channel_bindings: 'ChannelBindings' = None) -> 'AcceptContext{n}Result':
+    """
+    Accept security context number {n}.
+{filler}
+    Raises:
+        InvalidTokenError
+        MissingContextError
+
+    Input Args:
+        context -> [SecurityContext] default_assign(SecurityContext()); inplace(&$.raw_ctx)
+            # the security context to update
+        acceptor_creds -> default(GSS_C_NO_CREDENTIAL)
+            # the creds to use to accept the context
+        input_token
+            # the input token
+        channel_bindings -> [gss_channel_bindings_t] default(GSS_C_NO_CHANNEL_BINDINGS; $.__cvalue__()); cleanup(free_non_default)
+            # the channel bindings to use
+
+    Output Args:
+        context
+        initiator_name [gss_name_t; &$]
+        mech_type [nullable: gss_OID; &$]
+        output_token -> ; hook(output_token)
+        ret_flags [OM_uint32; &$] -> IntEnumFlagSet(RequirementFlag, $)
+        output_ttl [OM_uint32; &$] -> c_ttl_to_py($)
+        delegated_cred [nullable: gss_cred_id_t; &$]
+        ; -> maj_stat == GSS_S_CONTINUE_NEEDED
+
+    Success On:
+        GSS_S_COMPLETE
+        GSS_S_CONTINUE_NEEDED
+    """
+''',
+    '''
+def inquire_{n}(context: NotNone('SecurityContext'),
+                initiator_name: bool = True, target_name: bool = True,
+                lifetime: bool = True, mech: bool = True,
+                flags: bool = True) -> 'Inquire{n}Result':
+    """
+    Inquire about context number {n}.
+{filler}
+    Raises:
+        MissingContextError
+
+    Input Args:
+        context  # the context in question
+
+    Output Args:
+        initiator_name [optional: gss_name_t; &$]
+        target_name [nullable, optional: gss_name_t; &$]
+        lifetime [optional: OM_uint32; &$] -> c_ttl_to_py($)
+        mech [optional: gss_OID; &$]
+        flags [optional: OM_uint32; &$] -> IntEnumFlagSet(RequirementFlag, $)
+    """
+''',
+    '''
+def export_token_{n}(context: NotNone('SecurityContext'),
+                     message: NotNone('bytes')) -> bytes:
+    """
+    Export token number {n}.
+{filler}
+    Raises:
+        MissingContextError
+
+    Input Args:
+        context  # the context to use
+        message -> bytes_to_buffer($)
+            # the message to process
+
+    Output Args:
+        output_message [gss_buffer_desc; gss_buffer_desc(0, NULL); &$] -> buffer_to_bytes($)
+    """
+''',
+    '''
+def context_ttl_{n}(context: NotNone('SecurityContext')) -> int:
+    """
+    Get the lifetime of context number {n}.
+{filler}
+    Raises:
+        ExpiredContextError
+
+    Input Args:
+        context  # the context for which to get the time
+
+    Output Args:
+        ttl [OM_uint32; &$] -> c_ttl_to_py($)
+
+    Success On:
+        GSS_S_COMPLETE
+        GSS_S_CONTEXT_EXPIRED
+    """
+''',
+    '''
+def process_token_{n}(context: NotNone('SecurityContext'), token: 'bytes'):
+    """
+    Process token number {n}.
+{filler}
+    Raises:
+        InvalidTokenError
+
+    Input Args:
+        context  # the security context to update
+        token -> bytes_to_buffer($)  # the token to use
+    """
+''',
+    '''
+def wrap_{n}(context: NotNone('SecurityContext'), message: NotNone('bytes'),
+             confidential: bool = True) -> 'Wrap{n}Result':
+    """
+    Wrap message number {n}.
+{filler}
+    Input Args:
+        context  # the context to use
+        confidential -> [int] $  # whether to encrypt
+        message -> bytes_to_buffer($)  # the message to wrap
+
+    Output Args:
+        conf_state [int; &$] -> <bint>$
+        output_message [gss_buffer_desc; gss_buffer_desc(0, NULL); &$] -> buffer_to_bytes($)
+
+    Options:
+        many: message -> messages
+    """
+''',
+]
+
+_FILLER_LINE = ('    This is filler text describing the behaviour of the '
+                'function in detail.')
+
+
+def synthesize_source(count):
+    parts = [_HEADER]
+    for n in range(count):
+        template = _TEMPLATES[n % len(_TEMPLATES)]
+        filler = '\n'.join([''] + [_FILLER_LINE] * (n % 7) + [''])
+        parts.append(template.format(n=n, filler=filler))
+
+    return ''.join(parts)
+
+
+def write_module(count, directory):
+    """Write a spec module with count functions, returning its path"""
+
+    path = os.path.join(directory, 'synth_specs_%d.py' % count)
+    with open(path, 'w') as module_file:
+        module_file.write(synthesize_source(count))
+
+    return path
+
+
+def import_module(path):
+    module_name = os.path.splitext(os.path.basename(path))[0]
+
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
@@ -0,0 +1,184 @@
+import collections
+import concurrent.futures
+import fnmatch
+import io
+import json
+import os
+import sys
+
+from gssapi_bindings_gen import harness
+from gssapi_bindings_gen import loader
+from gssapi_bindings_gen.cache import ResultCache
+from gssapi_bindings_gen.emitter import atomic_output, CodeEmitter
+from gssapi_bindings_gen.splice import splice_file
+
+
+# manifests are JSON documents of the form:
+#
+#   {
+#       "modules": [
+#           {"module": "base_specs", "output": "raw/base.pyx"},
+#           {"module": "rfc5587_specs", "output": "raw/ext_rfc5587.pyx",
+#            "functions": ["indicate_mechs_by_attrs", "*_mech_attr*"],
+#            "splice": true, "harness": "bench/"}
+#       ]
+#   }
+#
+# Relative output paths are relative to the directory containing the
+# manifest.  The optional "functions" entry is a list of glob patterns
+# selecting which functions of the module to generate.  When "splice" is
+# true, the output file must already exist, and only its generated region
+# is replaced (see gssapi_bindings_gen.splice).  The optional "harness"
+# entry is a directory to write a benchmark harness for the generated
+# functions to (see gssapi_bindings_gen.harness).
+
+ManifestEntry = collections.namedtuple('ManifestEntry',
+                                       ['module', 'output', 'functions',
+                                        'splice', 'harness'])
+
+
+def load_manifest(path):
+    with open(path) as manifest_file:
+        raw_manifest = json.load(manifest_file)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    entries = []
+    for raw_entry in raw_manifest.get('modules', []):
+        try:
+            module_name = raw_entry['module']
+            output_path = raw_entry['output']
+        except KeyError as e:
+            raise ValueError('Manifest entries must specify %s (got entry '
+                             '%r)' % (e, raw_entry))
+
+        harness_dir = raw_entry.get('harness')
+        if harness_dir is not None:
+            harness_dir = os.path.join(base_dir, harness_dir)
+
+        entries.append(ManifestEntry(
+            module_name, os.path.join(base_dir, output_path),
+            raw_entry.get('functions'), raw_entry.get('splice', False),
+            harness_dir))
+
+    return entries
+
+
+def _select_functions(funcs, patterns):
+    if patterns is None:
+        return funcs
+
+    return [func for func in funcs
+            if any(fnmatch.fnmatchcase(func.__name__, pattern)
+                   for pattern in patterns)]
+
+
+def _import_module(module_name):
+    __import__(module_name)
+    return sys.modules[module_name]
+
+
+# statically loaded modules, by name (see gssapi_bindings_gen.loader)
+_static_modules = {}
+
+
+def _load_module(module_name, static):
+    if not static:
+        return _import_module(module_name)
+
+    try:
+        return _static_modules[module_name]
+    except KeyError:
+        module = _static_modules[module_name] = loader.load_module(
+            module_name)
+        return module
+
+
+# per-worker state, set up by _init_worker
+_worker_gen = None
+_worker_static = False
+
+
+def _init_worker(generator_cls, processor_cls, cache_dir, static,
+                 gen_options):
+    global _worker_gen, _worker_static
+
+    _worker_static = static
+
+    if cache_dir is not None:
+        cache = ResultCache(cache_dir)
+    else:
+        cache = None
+
+    _worker_gen = generator_cls(processor_cls, cache=cache, **gen_options)
+
+
+def _generate_function(task):
+    module_name, func_name = task
+    module = _load_module(module_name, _worker_static)
+    return _worker_gen.code_and_support_for_function(
+        getattr(module, func_name))
+
+
+def run_batch(entries, generator_cls, processor_cls, cache_dir=None,
+              jobs=None, static=False, **gen_options):
+    """Generate the code for each manifest entry
+
+    When static is True, spec modules are read with the static loader
+    instead of being imported.  Any other keyword arguments (like
+    free_threaded) are passed on to the generator.  Returns a list of
+    (output path, changed functions) pairs for the spliced entries, as
+    returned by splice_file.
+    """
+
+    # the generator here is only used to enumerate functions and to join
+    # the results -- the actual work happens in the workers
+    gen = generator_cls(processor_cls, **gen_options)
+
+    tasks = []
+    entry_funcs = []
+    for entry in entries:
+        funcs = _select_functions(
+            gen.functions_for_module(_load_module(entry.module, static)),
+            entry.functions)
+
+        tasks.extend((entry.module, func.__name__) for func in funcs)
+        entry_funcs.append(funcs)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    chunksize = max(1, len(tasks) // (jobs * 4))
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker,
+            initargs=(generator_cls, processor_cls, cache_dir,
+                      static, gen_options)) as executor:
+        # map preserves task order, so the output is deterministic
+        # regardless of which worker finishes first
+        results = iter(executor.map(_generate_function, tasks,
+                                    chunksize=chunksize))
+
+        splice_results = []
+        for entry, funcs in zip(entries, entry_funcs):
+            func_results = (next(results) for func in funcs)
+
+            if entry.splice:
+                code_buff = io.StringIO()
+                gen.write_module_code(func_results, CodeEmitter(code_buff))
+                splice_results.append(
+                    (entry.output,
+                     splice_file(entry.output, code_buff.getvalue())))
+            else:
+                with atomic_output(entry.output) as output_file:
+                    gen.write_module_code(func_results,
+                                          CodeEmitter(output_file))
+
+            if entry.harness is not None:
+                # the compiled module is named after the generated file
+                harness.write_harness(
+                    gen, entry.module, funcs, entry.harness,
+                    bindings_module=os.path.splitext(
+                        os.path.basename(entry.output))[0])
+
+    return splice_results
@@ -0,0 +1,105 @@
+import collections
+import hashlib
+import inspect
+import os
+import pickle
+import tempfile
+
+
+CachedFunction = collections.namedtuple('CachedFunction',
+                                        ['processed', 'code', 'support'])
+
+
+def cache_key(target_func, fingerprint):
+    """Compute the cache key for a function's spec and a generator fingerprint"""
+
+    hasher = hashlib.sha256(fingerprint.encode('utf-8'))
+    for part in (target_func.__module__ or '', target_func.__name__,
+                 str(inspect.signature(target_func)),
+                 target_func.__doc__ or ''):
+        hasher.update(b'\0')
+        hasher.update(part.encode('utf-8'))
+
+    return hasher.hexdigest()
+
+
+class ResultCache(object):
+    """An on-disk cache of generated functions
+
+    Entries are keyed by a hash of the function's module and name, its
+    signature and docstring, combined with a fingerprint of the generator (see
+    :meth:`CodeGenerator.fingerprint`), so an entry is only reused
+    when neither the spec nor the code that processes it has changed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, target_func, fingerprint):
+        return cache_key(target_func, fingerprint)
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, '%s.pickle' % key)
+
+    def get(self, key):
+        try:
+            with open(self._path_for(key), 'rb') as cache_file:
+                return pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, entry):
+        # write to a temporary file first so that concurrent generators
+        # never see a partially written entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir,
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as cache_file:
+                pickle.dump(entry, cache_file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path_for(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+class MemoryCache(object):
+    """An in-memory cache of generated functions, for long-lived generators
+
+    Misses fall back to an optional backing cache (such as a ResultCache),
+    and new entries are written through to it.  Entries which have not
+    been used since the last call to prune are dropped by it, so that
+    the cache does not grow with every edit of a spec.
+    """
+
+    def __init__(self, backing=None):
+        self._backing = backing
+        self._entries = {}
+        self._used = set()
+
+    def key_for(self, target_func, fingerprint):
+        return cache_key(target_func, fingerprint)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self._backing is not None:
+            entry = self._backing.get(key)
+            if entry is not None:
+                self._entries[key] = entry
+
+        if entry is not None:
+            self._used.add(key)
+
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._used.add(key)
+
+        if self._backing is not None:
+            self._backing.put(key, entry)
+
+    def prune(self):
+        self._entries = {key: entry for key, entry in self._entries.items()
+                         if key in self._used}
+        self._used = set()
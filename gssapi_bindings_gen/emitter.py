@@ -0,0 +1,75 @@
+import contextlib
+import os
+import shutil
+import tempfile
+
+
+class CodeEmitter(object):
+    """An indent-aware writer of generated code
+
+    Lines are written straight through to the underlying text stream,
+    so output is never accumulated in memory.
+    """
+
+    def __init__(self, stream, indent='    '):
+        self._stream = stream
+        self._indent = indent
+        self._prefix = ''
+
+    @contextlib.contextmanager
+    def indented(self):
+        old_prefix = self._prefix
+        self._prefix += self._indent
+        try:
+            yield self
+        finally:
+            self._prefix = old_prefix
+
+    def line(self, text=''):
+        self._stream.write(self._prefix)
+        self._stream.write(text)
+        self._stream.write('\n')
+
+    def lines(self, lines):
+        for line in lines:
+            self.line(line)
+
+    def write(self, text):
+        # raw, unindented output
+        self._stream.write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+
+def _copy_or_default_mode(tmp_path, path):
+    try:
+        shutil.copymode(path, tmp_path)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+
+
+@contextlib.contextmanager
+def atomic_output(path, mode='w'):
+    """Write to a temporary file, renaming it over path on success
+
+    Readers of path only ever see either the old or the complete new
+    contents.  If an exception is raised, path is left untouched.  Missing
+    parent directories of path are created.
+    """
+
+    dir_name, base_name = os.path.split(os.path.abspath(path))
+    os.makedirs(dir_name, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, prefix='.%s.' % base_name,
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as stream:
+            yield stream
+
+        _copy_or_default_mode(tmp_path, path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
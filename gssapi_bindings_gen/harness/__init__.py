@@ -0,0 +1,112 @@
+import os
+import re
+
+from gssapi_bindings_gen.emitter import atomic_output, CodeEmitter
+
+
+# Benchmark harnesses measure the overhead which generated bindings add
+# around each GSSAPI call, by running them against a stub GSSAPI library
+# (gssapi_stub.c) with tunable latency and canned outputs.  A harness is a
+# standalone script, bench_<module>.py, made of a table of calls to make
+# followed by a copy of runtime.py.  For each function, it measures the
+# time per call, the allocations per call (with tracemalloc) and the
+# throughput with several threads.
+
+HARNESS_DIR = os.path.dirname(os.path.abspath(__file__))
+STUB_SOURCE = os.path.join(HARNESS_DIR, 'gssapi_stub.c')
+RUNTIME_SOURCE = os.path.join(HARNESS_DIR, 'runtime.py')
+
+DEFAULT_TYPES_MODULE = 'gssapi.raw'
+
+_ROUTINE_RE = re.compile(r'^OM_uint32 (gss_\w+)\(', re.MULTILINE)
+
+
+def stubbed_routines():
+    with open(STUB_SOURCE) as stub_file:
+        return frozenset(_ROUTINE_RE.findall(stub_file.read()))
+
+
+def harness_calls(gen, funcs, routines):
+    # returns the calls to benchmark, as (function name, [(argument name,
+    # expression), ...]), and the skipped functions, as (name, reason)
+    calls = []
+    skipped = []
+    for func in funcs:
+        routine = 'gss_%s' % func.__name__
+        if routine not in routines:
+            skipped.append((func.__name__,
+                            'the stub library has no %s' % routine))
+            continue
+
+        try:
+            sample_args = gen.sample_arguments(func)
+        except ValueError as e:
+            skipped.append((func.__name__, str(e)))
+            continue
+
+        calls.append((func.__name__, list(sample_args.items())))
+
+    return (calls, skipped)
+
+
+def write_harness(gen, module_name, funcs, out_dir, bindings_module=None,
+                  types_module=DEFAULT_TYPES_MODULE):
+    """Write a benchmark harness for the given functions to out_dir
+
+    The stub library source is written alongside the harness script.
+    bindings_module is the name of the compiled module containing the
+    bindings (by default, the name of the spec module).  Returns the path
+    of the harness script.
+    """
+
+    if bindings_module is None:
+        bindings_module = module_name
+
+    calls, skipped = harness_calls(gen, funcs, stubbed_routines())
+
+    with open(STUB_SOURCE) as stub_file:
+        stub_source = stub_file.read()
+
+    with open(RUNTIME_SOURCE) as runtime_file:
+        runtime_source = runtime_file.read()
+
+    os.makedirs(out_dir, exist_ok=True)
+    with atomic_output(os.path.join(out_dir, 'gssapi_stub.c')) as stub_out:
+        stub_out.write(stub_source)
+
+    script_path = os.path.join(out_dir,
+                               'bench_%s.py' % module_name.rpartition('.')[2])
+    with atomic_output(script_path) as script_file:
+        out = CodeEmitter(script_file)
+        out.lines([
+            '"""Benchmarks for the bindings generated from %s' % module_name,
+            '',
+            'Build the stub GSSAPI library with',
+            '',
+            '    cc -O2 -shared -fPIC -o libgssapi_stub.so gssapi_stub.c',
+            '',
+            'and then run this script with the bindings either linked '
+            'against it, or',
+            'with LD_PRELOAD=./libgssapi_stub.so.',
+            '"""',
+            '',
+            'BINDINGS_MODULE = %r' % bindings_module,
+            'TYPES_MODULE = %r' % types_module,
+            '',
+            '# (function name, [(argument name, expression), ...])',
+            'CALLS = ['])
+
+        with out.indented():
+            out.lines('(%r, %r),' % call for call in calls)
+
+        out.lines([']', '', '# (function name, reason)', 'SKIPPED = ['])
+        with out.indented():
+            out.lines('(%r, %r),' % skip for skip in skipped)
+
+        out.lines([']', '', ''])
+        out.write(runtime_source)
+        out.lines(['', '',
+                   "if __name__ == '__main__':",
+                   '    main(CALLS, BINDINGS_MODULE, TYPES_MODULE, SKIPPED)'])
+
+    return script_path
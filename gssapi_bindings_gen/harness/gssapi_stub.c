@@ -0,0 +1,440 @@
+/* A stub GSSAPI library, for benchmarking generated bindings
+ *
+ * Every routine succeeds after a configurable latency (spent busy-waiting,
+ * so that it's deterministic), handing out canned handles, OIDs and tokens,
+ * so that benchmarks only measure the overhead of the bindings themselves.
+ *
+ * The types below are ABI-compatible with the RFC 2744 C bindings, so no
+ * GSSAPI headers are needed.  Build it as a shared library with
+ *
+ *   cc -O2 -shared -fPIC -o libgssapi_stub.so gssapi_stub.c
+ *
+ * and either link the bindings against it instead of the real library,
+ * or load it ahead of the real library with LD_PRELOAD.
+ *
+ * Routines are defined as "OM_uint32 gss_name(" at the start of a line,
+ * which is how the harness generator finds out which ones are stubbed.
+ */
+
+#include <stddef.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+typedef uint32_t OM_uint32;
+
+typedef struct {
+    size_t length;
+    void *value;
+} gss_buffer_desc, *gss_buffer_t;
+
+typedef struct {
+    OM_uint32 length;
+    void *elements;
+} gss_OID_desc, *gss_OID;
+
+typedef struct {
+    size_t count;
+    gss_OID elements;
+} gss_OID_set_desc, *gss_OID_set;
+
+/* handles are opaque to the bindings */
+typedef void *gss_name_t;
+typedef void *gss_cred_id_t;
+typedef void *gss_ctx_id_t;
+typedef void *gss_channel_bindings_t;
+typedef int gss_cred_usage_t;
+typedef OM_uint32 gss_qop_t;
+
+#define GSS_S_COMPLETE 0
+
+#define STUB_FLAGS 0x3f  /* deleg, mutual, replay, sequence, conf, integ */
+#define STUB_TTL 3600
+
+
+static unsigned long stub_latency_ns = 0;
+static unsigned long stub_calls = 0;
+
+static char stub_default_token[] = "gss-stub-token";
+static void *stub_token = stub_default_token;
+static size_t stub_token_length = sizeof(stub_default_token) - 1;
+
+static char stub_handle;
+static char stub_mech_elements[] = "\x2a\x86\x48\x86\xf7\x12\x01\x02\x02";
+static gss_OID_desc stub_mech = {9, stub_mech_elements};
+
+
+/* controls, for use through ctypes */
+
+void gss_stub_set_latency(unsigned long latency_ns)
+{
+    stub_latency_ns = latency_ns;
+}
+
+int gss_stub_set_token(const void *value, size_t length)
+{
+    void *token = malloc(length ? length : 1);
+    if (token == NULL)
+        return -1;
+
+    memcpy(token, value, length);
+    if (stub_token != stub_default_token)
+        free(stub_token);
+
+    stub_token = token;
+    stub_token_length = length;
+    return 0;
+}
+
+unsigned long gss_stub_call_count(void)
+{
+    return __atomic_load_n(&stub_calls, __ATOMIC_RELAXED);
+}
+
+
+static uint64_t stub_now_ns(void)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (uint64_t)now.tv_sec * 1000000000u + (uint64_t)now.tv_nsec;
+}
+
+static OM_uint32 stub_call(OM_uint32 *minor_status)
+{
+    __atomic_add_fetch(&stub_calls, 1, __ATOMIC_RELAXED);
+
+    if (minor_status != NULL)
+        *minor_status = 0;
+
+    if (stub_latency_ns) {
+        uint64_t deadline = stub_now_ns() + stub_latency_ns;
+        while (stub_now_ns() < deadline)
+            ;
+    }
+
+    return GSS_S_COMPLETE;
+}
+
+/* releasing things is part of the bindings' overhead, so it's not delayed */
+static OM_uint32 stub_release(OM_uint32 *minor_status)
+{
+    if (minor_status != NULL)
+        *minor_status = 0;
+
+    return GSS_S_COMPLETE;
+}
+
+static void stub_output_token(gss_buffer_t buffer)
+{
+    if (buffer == NULL)
+        return;
+
+    buffer->value = NULL;
+    buffer->length = 0;
+    if (stub_token_length) {
+        buffer->value = malloc(stub_token_length);
+        if (buffer->value != NULL) {
+            memcpy(buffer->value, stub_token, stub_token_length);
+            buffer->length = stub_token_length;
+        }
+    }
+}
+
+static void stub_output_mechs(gss_OID_set *mech_set)
+{
+    if (mech_set == NULL)
+        return;
+
+    *mech_set = malloc(sizeof(gss_OID_set_desc));
+    if (*mech_set == NULL)
+        return;
+
+    (*mech_set)->elements = malloc(sizeof(gss_OID_desc));
+    if ((*mech_set)->elements == NULL) {
+        (*mech_set)->count = 0;
+        return;
+    }
+
+    (*mech_set)->count = 1;
+    (*mech_set)->elements[0] = stub_mech;
+}
+
+#define STUB_SET(ptr, value) do { if ((ptr) != NULL) *(ptr) = (value); } while (0)
+
+
+/* credentials */
+
+OM_uint32 gss_acquire_cred(OM_uint32 *minor_status, gss_name_t desired_name,
+                           OM_uint32 time_req, gss_OID_set desired_mechs,
+                           gss_cred_usage_t cred_usage,
+                           gss_cred_id_t *output_cred_handle,
+                           gss_OID_set *actual_mechs, OM_uint32 *time_rec)
+{
+    STUB_SET(output_cred_handle, &stub_handle);
+    stub_output_mechs(actual_mechs);
+    STUB_SET(time_rec, STUB_TTL);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_release_cred(OM_uint32 *minor_status, gss_cred_id_t *cred_handle)
+{
+    STUB_SET(cred_handle, NULL);
+    return stub_release(minor_status);
+}
+
+OM_uint32 gss_inquire_cred(OM_uint32 *minor_status, gss_cred_id_t cred_handle,
+                           gss_name_t *name, OM_uint32 *lifetime,
+                           gss_cred_usage_t *cred_usage,
+                           gss_OID_set *mechanisms)
+{
+    STUB_SET(name, &stub_handle);
+    STUB_SET(lifetime, STUB_TTL);
+    STUB_SET(cred_usage, 0);
+    stub_output_mechs(mechanisms);
+    return stub_call(minor_status);
+}
+
+
+/* security contexts */
+
+OM_uint32 gss_init_sec_context(OM_uint32 *minor_status,
+                               gss_cred_id_t initiator_cred_handle,
+                               gss_ctx_id_t *context_handle,
+                               gss_name_t target_name, gss_OID mech_type,
+                               OM_uint32 req_flags, OM_uint32 time_req,
+                               gss_channel_bindings_t input_chan_bindings,
+                               gss_buffer_t input_token,
+                               gss_OID *actual_mech_type,
+                               gss_buffer_t output_token, OM_uint32 *ret_flags,
+                               OM_uint32 *time_rec)
+{
+    STUB_SET(context_handle, &stub_handle);
+    STUB_SET(actual_mech_type, &stub_mech);
+    stub_output_token(output_token);
+    STUB_SET(ret_flags, STUB_FLAGS);
+    STUB_SET(time_rec, STUB_TTL);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_accept_sec_context(OM_uint32 *minor_status,
+                                 gss_ctx_id_t *context_handle,
+                                 gss_cred_id_t acceptor_cred_handle,
+                                 gss_buffer_t input_token_buffer,
+                                 gss_channel_bindings_t input_chan_bindings,
+                                 gss_name_t *src_name, gss_OID *mech_type,
+                                 gss_buffer_t output_token,
+                                 OM_uint32 *ret_flags, OM_uint32 *time_rec,
+                                 gss_cred_id_t *delegated_cred_handle)
+{
+    STUB_SET(context_handle, &stub_handle);
+    STUB_SET(src_name, &stub_handle);
+    STUB_SET(mech_type, &stub_mech);
+    stub_output_token(output_token);
+    STUB_SET(ret_flags, STUB_FLAGS);
+    STUB_SET(time_rec, STUB_TTL);
+    STUB_SET(delegated_cred_handle, NULL);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_process_context_token(OM_uint32 *minor_status,
+                                    gss_ctx_id_t context_handle,
+                                    gss_buffer_t token_buffer)
+{
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_delete_sec_context(OM_uint32 *minor_status,
+                                 gss_ctx_id_t *context_handle,
+                                 gss_buffer_t output_token)
+{
+    STUB_SET(context_handle, NULL);
+    if (output_token != NULL) {
+        output_token->value = NULL;
+        output_token->length = 0;
+    }
+    return stub_release(minor_status);
+}
+
+OM_uint32 gss_context_time(OM_uint32 *minor_status,
+                           gss_ctx_id_t context_handle, OM_uint32 *time_rec)
+{
+    STUB_SET(time_rec, STUB_TTL);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_inquire_context(OM_uint32 *minor_status,
+                              gss_ctx_id_t context_handle,
+                              gss_name_t *src_name, gss_name_t *targ_name,
+                              OM_uint32 *lifetime_rec, gss_OID *mech_type,
+                              OM_uint32 *ctx_flags, int *locally_initiated,
+                              int *open_context)
+{
+    STUB_SET(src_name, &stub_handle);
+    STUB_SET(targ_name, &stub_handle);
+    STUB_SET(lifetime_rec, STUB_TTL);
+    STUB_SET(mech_type, &stub_mech);
+    STUB_SET(ctx_flags, STUB_FLAGS);
+    STUB_SET(locally_initiated, 1);
+    STUB_SET(open_context, 1);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_wrap_size_limit(OM_uint32 *minor_status,
+                              gss_ctx_id_t context_handle, int conf_req_flag,
+                              gss_qop_t qop_req, OM_uint32 req_output_size,
+                              OM_uint32 *max_input_size)
+{
+    STUB_SET(max_input_size, req_output_size);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_export_sec_context(OM_uint32 *minor_status,
+                                 gss_ctx_id_t *context_handle,
+                                 gss_buffer_t interprocess_token)
+{
+    STUB_SET(context_handle, NULL);
+    stub_output_token(interprocess_token);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_import_sec_context(OM_uint32 *minor_status,
+                                 gss_buffer_t interprocess_token,
+                                 gss_ctx_id_t *context_handle)
+{
+    STUB_SET(context_handle, &stub_handle);
+    return stub_call(minor_status);
+}
+
+
+/* per-message routines */
+
+OM_uint32 gss_get_mic(OM_uint32 *minor_status, gss_ctx_id_t context_handle,
+                      gss_qop_t qop_req, gss_buffer_t message_buffer,
+                      gss_buffer_t message_token)
+{
+    stub_output_token(message_token);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_verify_mic(OM_uint32 *minor_status, gss_ctx_id_t context_handle,
+                         gss_buffer_t message_buffer, gss_buffer_t token_buffer,
+                         gss_qop_t *qop_state)
+{
+    STUB_SET(qop_state, 0);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_wrap(OM_uint32 *minor_status, gss_ctx_id_t context_handle,
+                   int conf_req_flag, gss_qop_t qop_req,
+                   gss_buffer_t input_message_buffer, int *conf_state,
+                   gss_buffer_t output_message_buffer)
+{
+    STUB_SET(conf_state, conf_req_flag);
+    stub_output_token(output_message_buffer);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_unwrap(OM_uint32 *minor_status, gss_ctx_id_t context_handle,
+                     gss_buffer_t input_message_buffer,
+                     gss_buffer_t output_message_buffer, int *conf_state,
+                     gss_qop_t *qop_state)
+{
+    stub_output_token(output_message_buffer);
+    STUB_SET(conf_state, 1);
+    STUB_SET(qop_state, 0);
+    return stub_call(minor_status);
+}
+
+
+/* names */
+
+OM_uint32 gss_import_name(OM_uint32 *minor_status,
+                          gss_buffer_t input_name_buffer,
+                          gss_OID input_name_type, gss_name_t *output_name)
+{
+    STUB_SET(output_name, &stub_handle);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_display_name(OM_uint32 *minor_status, gss_name_t input_name,
+                           gss_buffer_t output_name_buffer,
+                           gss_OID *output_name_type)
+{
+    stub_output_token(output_name_buffer);
+    STUB_SET(output_name_type, &stub_mech);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_compare_name(OM_uint32 *minor_status, gss_name_t name1,
+                           gss_name_t name2, int *name_equal)
+{
+    STUB_SET(name_equal, name1 == name2);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_duplicate_name(OM_uint32 *minor_status, gss_name_t src_name,
+                             gss_name_t *dest_name)
+{
+    STUB_SET(dest_name, src_name);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_canonicalize_name(OM_uint32 *minor_status, gss_name_t input_name,
+                                gss_OID mech_type, gss_name_t *output_name)
+{
+    STUB_SET(output_name, &stub_handle);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_export_name(OM_uint32 *minor_status, gss_name_t input_name,
+                          gss_buffer_t exported_name)
+{
+    stub_output_token(exported_name);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_release_name(OM_uint32 *minor_status, gss_name_t *input_name)
+{
+    STUB_SET(input_name, NULL);
+    return stub_release(minor_status);
+}
+
+
+/* miscellaneous routines */
+
+OM_uint32 gss_display_status(OM_uint32 *minor_status, OM_uint32 status_value,
+                             int status_type, gss_OID mech_type,
+                             OM_uint32 *message_context,
+                             gss_buffer_t status_string)
+{
+    STUB_SET(message_context, 0);
+    stub_output_token(status_string);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_indicate_mechs(OM_uint32 *minor_status, gss_OID_set *mech_set)
+{
+    stub_output_mechs(mech_set);
+    return stub_call(minor_status);
+}
+
+OM_uint32 gss_release_buffer(OM_uint32 *minor_status, gss_buffer_t buffer)
+{
+    if (buffer != NULL) {
+        free(buffer->value);
+        buffer->value = NULL;
+        buffer->length = 0;
+    }
+    return stub_release(minor_status);
+}
+
+OM_uint32 gss_release_oid_set(OM_uint32 *minor_status, gss_OID_set *set)
+{
+    if (set != NULL && *set != NULL) {
+        free((*set)->elements);
+        free(*set);
+        *set = NULL;
+    }
+    return stub_release(minor_status);
+}
@@ -0,0 +1,208 @@
+# The runtime of benchmark harnesses (see gssapi_bindings_gen.harness),
+# which is copied into each of them, and so only uses the standard library.
+
+import argparse
+import ctypes
+import gc
+import importlib
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+
+DEFAULT_STUB = './libgssapi_stub.so'
+
+
+def load_stub(path):
+    try:
+        stub = ctypes.CDLL(path)
+        stub.gss_stub_set_latency
+    except (OSError, AttributeError) as e:
+        sys.exit('unable to load the stub GSSAPI library (%s)' % e)
+
+    stub.gss_stub_set_latency.argtypes = [ctypes.c_ulong]
+    stub.gss_stub_set_latency.restype = None
+    stub.gss_stub_set_token.argtypes = [ctypes.c_char_p, ctypes.c_size_t]
+    stub.gss_stub_set_token.restype = ctypes.c_int
+    stub.gss_stub_call_count.argtypes = []
+    stub.gss_stub_call_count.restype = ctypes.c_ulong
+
+    return stub
+
+
+def make_calls(calls, namespace, names=None):
+    # (name, function, kwargs), with the argument expressions evaluated
+    made_calls = []
+    for func_name, arg_exprs in calls:
+        if names is not None and func_name not in names:
+            continue
+
+        kwargs = dict((arg_name, eval(expr, namespace))
+                      for arg_name, expr in arg_exprs)
+        made_calls.append((func_name, namespace[func_name], kwargs))
+
+    return made_calls
+
+
+def check_stubbed(stub, func_name, func, kwargs):
+    before = stub.gss_stub_call_count()
+    func(**kwargs)
+    if stub.gss_stub_call_count() == before:
+        sys.exit('%s did not call into the stub GSSAPI library -- the '
+                 'bindings must be linked against it, or it must be '
+                 'loaded with LD_PRELOAD' % func_name)
+
+
+def measure_overhead(func, kwargs, number, repeat):
+    # the best time per call, in nanoseconds
+    best = None
+    for i in range(repeat):
+        gc.collect()
+        start = time.perf_counter_ns()
+        for j in range(number):
+            func(**kwargs)
+        elapsed = time.perf_counter_ns() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best / number
+
+
+def measure_allocations(func, kwargs, number):
+    # tracemalloc only sees allocations which are still alive when a
+    # snapshot is taken, so the results of the calls are kept around, and
+    # the allocations freed during each call are covered by the peak instead
+    results = [None] * number
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__),
+              tracemalloc.Filter(False, __file__)]
+
+    tracemalloc.start()
+    try:
+        before_size, before_peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(**kwargs)
+        after_size, peak = tracemalloc.get_traced_memory()
+        call_peak = peak - before_size
+
+        before = tracemalloc.take_snapshot().filter_traces(ignore)
+        for i in range(number):
+            results[i] = func(**kwargs)
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+
+    return {'blocks_per_call': blocks / number,
+            'bytes_per_call': size / number,
+            'peak_bytes': call_peak}
+
+
+def measure_throughput(func, kwargs, thread_count, duration):
+    # calls per second, across all of the threads
+    counts = [0] * thread_count
+    barrier = threading.Barrier(thread_count + 1)
+    deadline = [None]
+
+    def run(ind):
+        barrier.wait()
+        count = 0
+        while time.perf_counter() < deadline[0]:
+            func(**kwargs)
+            count += 1
+        counts[ind] = count
+
+    threads = [threading.Thread(target=run, args=(i,))
+               for i in range(thread_count)]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    deadline[0] = start + duration
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def main(calls, bindings_module, types_module, skipped=(), argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the bindings in %s against the stub GSSAPI '
+                    'library' % bindings_module)
+    parser.add_argument('functions', nargs='*',
+                        help='only benchmark these functions')
+    parser.add_argument('--module', default=bindings_module,
+                        help='the module containing the compiled bindings')
+    parser.add_argument('--types-module', default=types_module,
+                        help='the module containing the wrapper types '
+                             '(like Name) used for arguments')
+    parser.add_argument('--stub', default=DEFAULT_STUB,
+                        help='the path to the stub GSSAPI library')
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='the number of calls per timing run')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='the number of timing runs (the best is used)')
+    parser.add_argument('--latency-us', type=float, default=50,
+                        help='the latency of the stub library for the '
+                             'throughput runs (timing runs use none)')
+    parser.add_argument('--threads', default='1,2,4,8',
+                        help='the thread counts for the throughput runs')
+    parser.add_argument('--duration', type=float, default=1.0,
+                        help='the length of each throughput run, in seconds')
+    parser.add_argument('--token-size', type=int,
+                        help='make the stub library return tokens of this '
+                             'many bytes')
+    parser.add_argument('--json', metavar='FILE',
+                        help='also write the results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    thread_counts = [int(count) for count in args.threads.split(',')]
+
+    stub = load_stub(args.stub)
+    if args.token_size is not None:
+        token = b'\x00' * args.token_size
+        if stub.gss_stub_set_token(token, len(token)):
+            sys.exit('unable to set the stub token')
+
+    namespace = {}
+    namespace.update(vars(importlib.import_module(args.types_module)))
+    namespace.update(vars(importlib.import_module(args.module)))
+
+    for func_name, reason in skipped:
+        print('%s: skipped (%s)' % (func_name, reason), file=sys.stderr)
+
+    results = {}
+    for func_name, func, kwargs in make_calls(calls, namespace,
+                                              args.functions or None):
+        stub.gss_stub_set_latency(0)
+        check_stubbed(stub, func_name, func, kwargs)
+
+        res = measure_allocations(func, kwargs, args.number)
+        res['ns_per_call'] = measure_overhead(func, kwargs, args.number,
+                                              args.repeat)
+
+        stub.gss_stub_set_latency(int(args.latency_us * 1000))
+        res['calls_per_sec'] = dict(
+            (str(count), measure_throughput(func, kwargs, count,
+                                            args.duration))
+            for count in thread_counts)
+
+        results[func_name] = res
+
+        print('%s: %.0f ns/call, %.1f blocks/call (%.0f bytes), '
+              '%d bytes peak' % (func_name, res['ns_per_call'],
+                                 res['blocks_per_call'],
+                                 res['bytes_per_call'], res['peak_bytes']))
+        for count in thread_counts:
+            print('    %d thread(s): %.0f calls/s'
+                  % (count, res['calls_per_sec'][str(count)]))
+
+    if args.json is not None:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=4, sort_keys=True)
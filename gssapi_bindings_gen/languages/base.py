@@ -1,10 +1,21 @@
+import io
 import re
 import inspect
+import hashlib
 import collections
 
-from gssapi_bindings_gen.utils import NotNone
+from gssapi_bindings_gen import emitter
+from gssapi_bindings_gen import parser
+from gssapi_bindings_gen import utils
+from gssapi_bindings_gen.cache import CachedFunction
+from gssapi_bindings_gen.emitter import CodeEmitter
+from gssapi_bindings_gen.profiling import NULL_PROFILER
+from gssapi_bindings_gen.utils import NotNone, stub_function
 
 class BaseHook(object):
+    # names of the lookup's support code which the hook's code uses
+    SUPPORT = ()
+
     def __init__(self, arg_name):
         self.arg_name = arg_name
 
@@ -24,71 +35,504 @@ class BaseHook(object):
         return None
 
 
+# the code generated for a function's arguments (see
+# CodeGenerator.argument_code)
+ArgumentCode = collections.namedtuple(
+    'ArgumentCode', ['code', 'c_args', 'cleanup', 'initializers', 'success',
+                     'returns', 'error_args'])
+
+
+TransformerInfo = collections.namedtuple(
+    'TransformerInfo', ['func', 'arg_names', 'required_args', 'defaults',
+                        'varargs', 'nullable', 'support'])
+
+
+def needs_support(*names):
+    """Mark a transformer as using the lookup's support code of the given names
+
+    The generator writes out support code for the transformers (and hooks)
+    which are actually used, rather than looking for references to it in the
+    generated code.
+    """
+
+    def decorator(func):
+        func.support = names
+        return func
+
+    return decorator
+
+
+def transformer_info(func):
+    """Compute the arity information for a transformer function
+
+    Bound methods have their 'self' parameter skipped.  A 'nullable'
+    parameter is not counted as a normal argument -- instead, it marks
+    that the transformer can handle parameters which may be None.  The
+    support code the transformer uses comes from needs_support.
+    """
+
+    sig = inspect.signature(func)
+
+    arg_names = []
+    defaults = {}
+    varargs = False
+    nullable = False
+    for param_name, param in sig.parameters.items():
+        if param_name == 'nullable':
+            nullable = True
+        elif param.kind is inspect.Parameter.VAR_POSITIONAL:
+            varargs = True
+        elif param.kind in (inspect.Parameter.POSITIONAL_ONLY,
+                            inspect.Parameter.POSITIONAL_OR_KEYWORD):
+            arg_names.append(param_name)
+            if param.default is not inspect.Parameter.empty:
+                defaults[param_name] = param.default
+
+    return TransformerInfo(func, tuple(arg_names),
+                           len(arg_names) - len(defaults), defaults,
+                           varargs, nullable,
+                           tuple(getattr(func, 'support', ())))
+
+
+class TransformerRegistry(object):
+    """Transformer functions by name, along with their arity information
+
+    The registry starts out with the public methods (including static
+    methods and plain functions) of a transformers object, and may be
+    extended with register.
+    """
+
+    def __init__(self, transformers=None):
+        self._infos = {}
+        # name -> function, for functions added with register
+        self.registered = collections.OrderedDict()
+
+        if transformers is not None:
+            for name, method in inspect.getmembers(transformers,
+                                                   inspect.isroutine):
+                if not name.startswith('_'):
+                    self._infos[name] = transformer_info(method)
+
+    def register(self, name, func):
+        self._infos[name] = transformer_info(func)
+        self.registered[name] = func
+
+    def __contains__(self, name):
+        return name in self._infos
+
+    def __getitem__(self, name):
+        return self._infos[name]
+
+
 class CodeLookup(object):
+    # the tables below are filled in by each language's lookup
+    TRANSFORMERS = None
+    INVERSE_TRANSFORMERS = None
+    HOOKS = {}
+    # python type -> info about the type (c_type, input_transformer, ...)
+    TYPES = {}
+    # c type -> python type, for output args
+    INVERSE_TYPES = {}
+    CLEANUP_EXPRS = {}
+    # c type -> (empty value, release code), for output types allocated by
+    # GSSAPI
+    OUTPUT_RELEASES = {}
+    # calls which are cheaper than releasing the GIL
+    CHEAP_CALLS = frozenset()
+    # conversion helpers -> names of the support code for inline versions
+    INPUT_CONVERTERS = {}
+    OUTPUT_CONVERTERS = {}
+    # name -> module-level support code lines
+    SUPPORT_CODE = {}
+
+    # exception classes (as listed in "Raises:" sections) for routine errors,
+    # which are the same for every language
+    ROUTINE_ERRORS = {
+        'BadMechanismError': 'GSS_S_BAD_MECH',
+        'BadNameError': 'GSS_S_BAD_NAME',
+        'BadNameTypeError': 'GSS_S_BAD_NAMETYPE',
+        'BadChannelBindingsError': 'GSS_S_BAD_BINDINGS',
+        'BadStatusError': 'GSS_S_BAD_STATUS',
+        'BadMICError': 'GSS_S_BAD_MIC',
+        'MissingCredentialsError': 'GSS_S_NO_CRED',
+        'MissingContextError': 'GSS_S_NO_CONTEXT',
+        'InvalidTokenError': 'GSS_S_DEFECTIVE_TOKEN',
+        'InvalidCredentialsError': 'GSS_S_DEFECTIVE_CREDENTIAL',
+        'ExpiredCredentialsError': 'GSS_S_CREDENTIALS_EXPIRED',
+        'ExpiredContextError': 'GSS_S_CONTEXT_EXPIRED',
+        'BadQoPError': 'GSS_S_BAD_QOP',
+        'UnauthorizedError': 'GSS_S_UNAUTHORIZED',
+        'OperationUnavailableError': 'GSS_S_UNAVAILABLE',
+        'DuplicateCredentialsElementError': 'GSS_S_DUPLICATE_ELEMENT',
+        'MechanismNameRequiredError': 'GSS_S_NAME_NOT_MN',
+    }
+
+    @classmethod
+    def _registry(cls, attr_name, transformers_name):
+        # registries are built lazily per lookup class, and include any
+        # transformers registered on the lookup class or its base classes
+        registry = cls.__dict__.get(attr_name)
+        if registry is None:
+            registry = TransformerRegistry(getattr(cls, transformers_name))
+            for base in reversed(cls.__mro__):
+                registered = base.__dict__.get(attr_name + '_registered', {})
+                for name, func in registered.items():
+                    registry.register(name, func)
+
+            setattr(cls, attr_name, registry)
+
+        return registry
+
+    @classmethod
+    def _register(cls, attr_name, name, func):
+        registered = cls.__dict__.get(attr_name + '_registered')
+        if registered is None:
+            registered = collections.OrderedDict()
+            setattr(cls, attr_name + '_registered', registered)
+
+        registered[name] = func
+
+        # drop the registries already built for this class and its
+        # subclasses, so that they get rebuilt with the new transformer
+        # (lookup instances keep the registries they were created with)
+        pending = [cls]
+        while pending:
+            lookup_cls = pending.pop()
+            if attr_name in lookup_cls.__dict__:
+                delattr(lookup_cls, attr_name)
+            pending.extend(lookup_cls.__subclasses__())
+
+    @classmethod
+    def transformer_registry(cls):
+        return cls._registry('_transformer_registry', 'TRANSFORMERS')
+
+    @classmethod
+    def inverse_transformer_registry(cls):
+        return cls._registry('_inverse_transformer_registry',
+                             'INVERSE_TRANSFORMERS')
+
+    @classmethod
+    def register_transformer(cls, name, func):
+        cls._register('_transformer_registry', name, func)
+
+    @classmethod
+    def register_inverse_transformer(cls, name, func):
+        cls._register('_inverse_transformer_registry', name, func)
+
     # lookup
+    def __init__(self):
+        self._transformers = self.transformer_registry()
+        self._inverse_transformers = self.inverse_transformer_registry()
+
     def is_known_type(self, python_type):
-        pass
+        return python_type in self.TYPES
 
     def as_c_type(self, python_type):
-        pass
+        return self.TYPES[python_type]['c_type']
 
     def transformer_for_type(self, python_type):
-        pass
+        return self.TYPES[python_type]['input_transformer']
+
+    def param_type(self, python_type):
+        info = self.TYPES.get(python_type)
+        if info is None:
+            return python_type
+
+        return info.get('param_type', python_type)
+
+    def sample_value(self, python_type):
+        info = self.TYPES.get(python_type)
+        if info is None:
+            return None
+
+        return info.get('sample_value')
 
     def inverse_transformer_for_type(self, c_type):
-        pass
+        python_type = self.INVERSE_TYPES[c_type]
+        info = self.TYPES[python_type]
+
+        initval = info.get('output_initval',
+                           '%s.__new__(%s)' % (python_type, python_type))
+        initializer = info.get('output_initializer',
+                               'cdef %s $o = $initval' % python_type)
+        return_expr = info.get('return_expression', '$o')
+        transformer = info.get('output_transformer')
+
+        if isinstance(transformer, str):
+            # an inverse transformer call, like 'buffer_to_bytes($)'
+            call = parser.parse_call(transformer)
+            return self.inverse_transformer(call.func, *call.args)
+
+        return ((initval, initializer, transformer), return_expr)
 
     def transformer(self, func_name, *args, **kwargs):
-        pass
+        # (transformer, c_arg_expr, cleanup)
+        return self._transformers[func_name].func(*args, **kwargs)
 
     def make_transformer_args(self, func_name, args, param_type, can_be_none):
-        pass
+        info = self._transformers[func_name]
+
+        if info.nullable:
+            kwargs = {'nullable': can_be_none}
+        else:
+            kwargs = {}
+
+        type_info = self.TYPES.get(param_type)
+        if (not type_info or
+                not type_info['input_transformer'].startswith('inplace(')):
+            return (args, kwargs)
+
+        transformer_expr = type_info['input_transformer'][8:-1]
+
+        if info.varargs:
+            return (args, kwargs)
+
+        if info.required_args > len(args):
+            return (args + [transformer_expr], kwargs)
+        else:
+            return (args, kwargs)
 
     def has_transformer(self, func_name):
-        pass
+        return func_name in self._transformers
+
+    def transformer_support(self, func_name):
+        return self._transformers[func_name].support
 
     def inverse_transformer(self, func_name, *args):
-        pass
+        # ((initval, initializer, transformer), return_expr)
+        return self._inverse_transformers[func_name].func(*args)
 
     def has_inverse_transformer(self, func_name):
-        pass
+        return func_name in self._inverse_transformers
+
+    def inverse_transformer_support(self, func_name):
+        return self._inverse_transformers[func_name].support
+
+    def output_type_support(self, c_type):
+        transformer = self.TYPES[self.INVERSE_TYPES[c_type]].get(
+            'output_transformer')
+        if isinstance(transformer, str):
+            return self.inverse_transformer_support(
+                parser.parse_call(transformer).func)
+        else:
+            return ()
 
     def cleanup_expression(self, cleanup_type):
-        pass
+        return self.CLEANUP_EXPRS[cleanup_type]
 
-    def hook(self, hook_name):
-        pass
+    def output_release(self, c_type):
+        # (empty value, release code), or None if GSSAPI doesn't allocate it
+        return self.OUTPUT_RELEASES.get(c_type)
+
+    def hook(self, hook_name, arg_name):
+        return self.HOOKS[hook_name](arg_name)
+
+    def support_names(self):
+        return list(self.SUPPORT_CODE)
+
+    def is_cheap_call(self, func_name):
+        return func_name in self.CHEAP_CALLS
+
+    def is_mutable_type(self, python_type):
+        return self.TYPES.get(python_type, {}).get('mutable', False)
+
+    def inline_converter(self, func_name, is_input):
+        if is_input:
+            return self.INPUT_CONVERTERS.get(func_name)
+        else:
+            return self.OUTPUT_CONVERTERS.get(func_name)
+
+    def support_code(self, name):
+        return self.SUPPORT_CODE[name]
+
+    def routine_error(self, error_name):
+        return self.ROUTINE_ERRORS.get(error_name)
+
+    def fingerprint_tables(self):
+        """Get the lookup's tables (dicts or collections of names)
+
+        These get covered by the fingerprint, along with the code of the
+        transformers and hooks.
+        """
+
+        return [self.TYPES, self.CLEANUP_EXPRS, self.OUTPUT_RELEASES,
+                self.SUPPORT_CODE, self.ROUTINE_ERRORS, self.INPUT_CONVERTERS,
+                self.OUTPUT_CONVERTERS, self.CHEAP_CALLS]
+
+    def fingerprint(self):
+        hasher = hashlib.sha256()
+        for table in self.fingerprint_tables():
+            if isinstance(table, dict):
+                table = table.items()
+
+            hasher.update(repr(sorted(table)).encode('utf-8'))
+
+        code_objs = [type(self.TRANSFORMERS), type(self.INVERSE_TRANSFORMERS)]
+        for registry in (self._transformers, self._inverse_transformers):
+            for func_name, func in registry.registered.items():
+                hasher.update(func_name.encode('utf-8'))
+                code_objs.append(func)
+
+        for hook_name, hook_cls in sorted(self.HOOKS.items()):
+            hasher.update(hook_name.encode('utf-8'))
+            code_objs.append(hook_cls)
+
+        for code_obj in code_objs:
+            try:
+                source = inspect.getsource(code_obj)
+            except OSError:
+                # e.g. functions registered from an interactive session
+                source = repr(code_obj.__code__.co_code)
+
+            hasher.update(source.encode('utf-8'))
+
+        return hasher.hexdigest()
 
 
 class CodeGenerator(object):
     LOOKUP_CLS = None
 
-    def __init__(self, processor_cls):
-        self._processor = processor_cls(self.LOOKUP_CLS())
+    def __init__(self, processor_cls, cache=None, profiler=NULL_PROFILER,
+                 free_threaded=False, freelist_size=8, module_name=None,
+                 channel_bindings_module=None):
+        self.profiler = profiler
+        self.free_threaded = free_threaded
+        self.freelist_size = freelist_size
+        # the name of the module the generated code gets imported as (the
+        # spec module's name if None), which the types it defines live in
+        self.module_name = module_name
+        # the name of the module defining CachedChannelBindings, which the
+        # code generated for other modules imports instead of defining its
+        # own (None to define it alongside any code using it)
+        self.channel_bindings_module = channel_bindings_module
+        self._lookup = self.LOOKUP_CLS()
+        self._processor = processor_cls(self._lookup, profiler=profiler)
+        self._cache = cache
+        self._fingerprint = None
+        self._support_names = self._lookup.support_names()
+
+        self._replace_vars = profiler.wrap('template_substitution',
+                                           replace_vars)
+
+    @property
+    def processor(self):
+        # the processor used to parse specs, for callers (like the
+        # benchmarks) which need to process functions on their own
+        return self._processor
+
+    # modules used by the generator and processor classes, whose code
+    # affects the generated code as well
+    FINGERPRINT_MODULES = (parser, utils, emitter)
+
+    def fingerprint(self):
+        # covers the lookup tables as well as the code of the generator and
+        # processor (along with FINGERPRINT_MODULES), so that cached results
+        # get invalidated by any of them
+        if self._fingerprint is None:
+            hasher = hashlib.sha256(self._lookup.fingerprint().encode('utf-8'))
+            hasher.update(repr((self.free_threaded, self.freelist_size,
+                                self.module_name,
+                                self.channel_bindings_module)).encode('utf-8'))
+
+            classes = type(self).__mro__ + (type(self._processor),)
+            modules = set(inspect.getmodule(cls) for cls in classes
+                          if cls is not object)
+            modules.update(self.FINGERPRINT_MODULES)
+            for module in sorted(modules, key=lambda mod: mod.__name__):
+                hasher.update(inspect.getsource(module).encode('utf-8'))
+
+            self._fingerprint = hasher.hexdigest()
+
+        return self._fingerprint
+
+    BATCHED_DOCS = """
+    Call %(name)s once for each item.
+
+    Returns a list with one entry per item: either what %(name)s
+    would have returned for it, or the GSSError explaining why the
+    call failed for it.
+"""
+
+    ASYNC_DOCS = """
+    Call %(name)s from a coroutine, without blocking the event loop.
+
+    The arguments are converted in the calling thread, and the C call
+    is made on the executor set with set_gss_executor.  Cancelling the
+    coroutine does not stop the C call, whose results are then released.
+"""
 
     def code_lines(self, target_func, argspecs):
         pass
 
+    def batched_code_lines(self, target_func, argspecs, batched):
+        pass
+
+    def async_code_lines(self, target_func, argspecs):
+        # (lines to write before the function, function code lines)
+        pass
+
     def preamble(self):
         pass
 
     def postamble(self):
         pass
 
-    def generate_func_line(self, target_func):
+    def result_constructor(self, result_type):
+        # the name to call to make a result (of a type named by a return
+        # annotation)
         pass
 
+    def param_declaration(self, param_name, annotation):
+        # how a parameter is declared in the function line
+        return param_name
+
+    def _param_parts(self, target_func, sig, param_text):
+        # keyword-only parameters go after a bare '*' -- other kinds of
+        # parameters (like *args) can't be passed on by name (as batched and
+        # async variants do), so they aren't supported
+        param_parts = []
+        for param_name, param in sig.parameters.items():
+            if param.kind is inspect.Parameter.KEYWORD_ONLY:
+                if '*' not in param_parts:
+                    param_parts.append('*')
+            elif param.kind is not inspect.Parameter.POSITIONAL_OR_KEYWORD:
+                raise ValueError("Parameter '%s' of %s is %s, which is not "
+                                 "supported" % (param_name,
+                                                target_func.__name__,
+                                                param.kind.description))
+
+            param_parts.append(param_text(param_name, param))
+
+        return param_parts
+
+    def generate_func_line(self, target_func, is_async=False):
+        def param_text(param_name, param):
+            param_part = self.param_declaration(param_name, param.annotation)
+            if param.default is not inspect.Parameter.empty:
+                param_part += '=%s' % repr(param.default)
+
+            return param_part
+
+        sig = inspect.signature(target_func)
+        func_line = 'def %s(%s):' % (
+            target_func.__name__,
+            ', '.join(self._param_parts(target_func, sig, param_text)))
+        if is_async:
+            func_line = 'async ' + func_line
+
+        return func_line
+
     def wrap_doc_lines(self, lines):
         pass
 
     def docs_func_signature(self, func_line, target_func, sig):
-        func_params = []
-        for param_name, param in sig.parameters.items():
-            param_text = param_name
+        def param_text(param_name, param):
             if param.default is not inspect.Parameter.empty:
-                param_text += '=%s' % param.default
+                return '%s=%s' % (param_name, param.default)
+            else:
+                return param_name
 
-            func_params.append(param_text)
+        func_params = self._param_parts(target_func, sig, param_text)
 
         if isinstance(sig.return_annotation, str):
             ret_text = ' -> %s' % sig.return_annotation
@@ -100,6 +544,22 @@ class CodeGenerator(object):
         return 'def %s(%s)%s' % (target_func.__name__, ', '.join(func_params),
                                  ret_text)
 
+    def raised_errors(self, func_docs):
+        """Find the names of the errors listed in the "Raises:" section"""
+
+        doc_lines = [line.strip() for line in func_docs.splitlines()]
+        if 'Raises:' not in doc_lines:
+            return []
+
+        errors = []
+        for line in doc_lines[doc_lines.index('Raises:') + 1:]:
+            if not line:
+                break
+
+            errors.append(line)
+
+        return errors
+
     def docs_for_function(self, func_line, base_docs, input_docs, target_func):
         sig = inspect.signature(target_func)
 
@@ -115,7 +575,7 @@ class CodeGenerator(object):
 
         doc_lines = [line[base_indent:] for line in doc_lines]
 
-        raise_lines = None
+        raises_lines = None
         if 'Raises:' in doc_lines:
             raises_starts = doc_lines.index('Raises:')
             raises_lines = doc_lines[raises_starts:]
@@ -124,6 +584,8 @@ class CodeGenerator(object):
         lines.extend(doc_lines)
 
         if input_docs:
+            if lines[-1]:
+                lines.append('')
             lines.append('Args:')
 
             for arg_name in sig.parameters.keys():
@@ -159,53 +621,518 @@ class CodeGenerator(object):
 
         return self.wrap_doc_lines(lines)
 
-    def code_for_function(self, func):
-        func_name = func.__name__
-        processed_func = self._processor.process(func)
+    def _input_argspec_to_code(self, argname, argspec):
+        transformer = argspec['transformer']
+        c_arg_expr = argspec['c_arg_expr']
+
+        output_name = 'raw_%s' % argname
+        arg_replacements = {'i': argname, 'o': output_name}
+        if transformer is not None:
+            type_decl = 'cdef %s %s' % (argspec['temporary_type'], output_name)
+
+            transformer = self._replace_vars(transformer, typedecl=type_decl,
+                                             **arg_replacements)
+
+        c_arg_expr = self._replace_vars(c_arg_expr, **arg_replacements)
+
+        cleanup_code = argspec['cleanup']
+        if cleanup_code is not None:
+            cleanup_code = self._replace_vars(cleanup_code, **arg_replacements)
+
+        return (transformer, c_arg_expr, cleanup_code)
+
+    def _output_argspec_to_code(self, argname, argspec):
+        # (prep lines, c_arg_expr, initializer, transformer, return_expr,
+        # hook)
+        pass
+
+    def argument_code(self, argspecs):
+        """Generate the code converting the arguments of a function
+
+        This covers converting the input args to C values, declaring the
+        output args, and turning them into Python values (via their
+        transformers, or hooks) once the call succeeds.  Returns an
+        ArgumentCode, whose code goes before the C call.
+        """
+
+        code_lines = []
+        c_func_args = []
+        cleanup_lines = []
+
+        for argname, argspec in argspecs.input_args.items():
+            transformer_code, c_arg_code, cleanup_code = (
+                self._input_argspec_to_code(argname, argspec))
+
+            if transformer_code is not None:
+                code_lines.append('')
+                code_lines.append('# convert %s to a C value' % argname)
+                code_lines.extend(transformer_code)
+
+            if cleanup_code:
+                cleanup_lines.append('')
+                cleanup_lines.extend(cleanup_code)
+
+            c_func_args.append(c_arg_code)
+
+        initializer_lines = []
+        success_lines = []
+        return_args = []
+        error_args = []
+
+        code_lines.append('')
+
+        for argname, argspec in argspecs.output_args.items():
+            (prep_code, c_arg_code, initializer_code,
+             success_code, return_code, hook) = self._output_argspec_to_code(
+                argname, argspec)
+
+            if hook is not None:
+                prep_code = hook.before_call()
+
+                after_lines = hook.after_call()
+                if after_lines is not None:
+                    initializer_lines.extend(after_lines)
+
+                initializer_code = None
+
+                c_arg_code = hook.for_call()
+                success_code, return_code = hook.for_success()
+
+                err_args = hook.for_error()
+                if err_args is not None:
+                    error_args.extend(err_args)
+
+            if prep_code is not None:
+                code_lines.extend(prep_code)
+
+            if isinstance(initializer_code, str):
+                initializer_lines.append(initializer_code)
+            elif initializer_code is not None:
+                initializer_lines.extend(initializer_code)
+
+            if success_code is not None:
+                success_lines.extend(success_code)
+                success_lines.append('')
+
+            if c_arg_code is not None:
+                c_func_args.append(c_arg_code)
+
+            return_args.append(return_code)
+
+        return ArgumentCode(code_lines, c_func_args, cleanup_lines,
+                            initializer_lines, success_lines, return_args,
+                            error_args)
+
+    def status_check_lines(self, target_func, argspecs, arg_code,
+                           min_stat='min_stat'):
+        """Generate the code checking the status of the C call
+
+        On success, this returns the result (if any), and otherwise, it
+        raises the appropriate GSSError.
+        """
+
+        sig = inspect.signature(target_func)
+        if isinstance(sig.return_annotation, str):
+            return_line = '    return %s(%s)' % (
+                self.result_constructor(sig.return_annotation),
+                ', '.join(arg_code.returns))
+        elif sig.return_annotation is not inspect.Signature.empty:
+            return_line = '    return %s' % arg_code.returns[0]
+        else:
+            return_line = None
+
+        code_lines = []
+        success_on = argspecs.success_on
+        if return_line is not None:
+            if len(success_on) == 1:
+                code_lines.append('if maj_stat == %s:' % success_on[0])
+            else:
+                code_lines.append('if maj_stat in (%s):'
+                                  % ', '.join(success_on))
+
+            code_lines.extend(['    ' + line for line in arg_code.success])
+            code_lines.append(return_line)
+            code_lines.append('else:')
+        else:
+            if len(success_on) == 1:
+                code_lines.append('if maj_stat != %s:' % success_on[0])
+            else:
+                code_lines.append('if maj_stat not in (%s):'
+                                  % ', '.join(success_on))
+
+        code_lines.append(
+            '    raise gss_error_class(maj_stat)(maj_stat, %s%s)'
+            % (min_stat, ', '.join([''] + arg_code.error_args)))
+
+        return code_lines
+
+    def _write_function_code(self, func, out):
+        with self.profiler.phase('process'):
+            processed_func = self._processor.process(func)
 
         func_line = self.generate_func_line(func)
+        out.line(func_line)
 
-        code_lines_raw = self.code_lines(func, processed_func)
+        with out.indented():
+            with self.profiler.phase('render_docs'):
+                doc_lines = self.docs_for_function(
+                    func_line, processed_func.func_docs,
+                    processed_func.input_docs, func)
+            out.lines(doc_lines)
 
-        code_lines = ['    ' + line for line in code_lines_raw]
-        doc_lines = ['    ' + line for line in
-                     self.docs_for_function(
-                         func_line, processed_func.func_docs,
-                         processed_func.input_docs, func)]
+            with self.profiler.phase('code_lines'):
+                code_lines = self.code_lines(func, processed_func)
+            out.lines(code_lines)
 
-        return '\n'.join([func_line] + doc_lines + code_lines)
+        batched = processed_func.options.get('many')
+        if batched:
+            out.write('\n\n')
+            code_lines = code_lines + self._write_batched_function(
+                func, processed_func, batched, out)
 
-    def code_for_module(self, module):
+        if processed_func.options.get('async'):
+            out.write('\n\n')
+            code_lines = code_lines + self._write_async_function(
+                func, processed_func, out)
+
+        support_names = self.support_names_for_function(func, processed_func)
+
+        # when a single module defines CachedChannelBindings, the others
+        # have to import it, or instances of it would fail their isinstance
+        # checks
+        if (self.channel_bindings_module is not None and
+                'gss_cached_channel_bindings' in support_names):
+            support_names.discard('gss_cached_channel_bindings')
+            defining = (self.module_name_for(func) ==
+                        self.channel_bindings_module)
+        else:
+            defining = None
+
+        support = self.support_for_names(support_names)
+        if defining is not None:
+            support['gss_cached_channel_bindings'] = (
+                self.cached_channel_bindings_lines(defining))
+
+        self.merge_support(support, self.support_for_function(func,
+                                                              processed_func))
+
+        return (processed_func, support)
+
+    def batched_docs(self, target_func, argspecs):
+        """The docs of the batched (*_many) variant of a function"""
+
+        return self.BATCHED_DOCS % {'name': target_func.__name__}
+
+    def batched_function(self, target_func, batched):
+        """Make a stub for the batched (*_many) variant of a function
+
+        The parameters named in batched are renamed, and take one value
+        for each item instead.
+        """
+
+        sig = inspect.signature(target_func)
+
+        params = []
+        for param_name, param in sig.parameters.items():
+            if param_name in batched:
+                param = param.replace(name=batched[param_name],
+                                      annotation=inspect.Parameter.empty,
+                                      default=inspect.Parameter.empty)
+            params.append(param)
+
+        return stub_function('%s_many' % target_func.__name__,
+                             sig.replace(parameters=params,
+                                         return_annotation=list),
+                             module=target_func.__module__)
+
+    def _write_batched_function(self, func, processed_func, batched, out):
+        batched_func = self.batched_function(func, batched)
+
+        func_line = self.generate_func_line(batched_func)
+        out.line(func_line)
+
+        input_docs = {batched.get(arg_name, arg_name): doc
+                      for arg_name, doc in processed_func.input_docs.items()}
+
+        with out.indented():
+            with self.profiler.phase('render_docs'):
+                doc_lines = self.docs_for_function(
+                    func_line, self.batched_docs(func, processed_func),
+                    input_docs, batched_func)
+            out.lines(doc_lines)
+
+            with self.profiler.phase('code_lines'):
+                code_lines = self.batched_code_lines(func, processed_func,
+                                                     batched)
+            out.lines(code_lines)
+
+        return code_lines
+
+    def async_function(self, target_func):
+        """Make a stub for the async (*_async) variant of a function"""
+
+        return stub_function('%s_async' % target_func.__name__,
+                             inspect.signature(target_func),
+                             module=target_func.__module__)
+
+    def _write_async_function(self, func, processed_func, out):
+        async_func = self.async_function(func)
+
+        with self.profiler.phase('code_lines'):
+            pre_lines, code_lines = self.async_code_lines(func,
+                                                          processed_func)
+
+        if pre_lines:
+            out.lines(pre_lines)
+            out.write('\n\n')
+
+        func_line = self.generate_func_line(async_func, is_async=True)
+        out.line(func_line)
+
+        with out.indented():
+            with self.profiler.phase('render_docs'):
+                doc_lines = self.docs_for_function(
+                    func_line, self.ASYNC_DOCS % {'name': func.__name__},
+                    processed_func.input_docs, async_func)
+            out.lines(doc_lines)
+            out.lines(code_lines)
+
+        return pre_lines + code_lines
+
+    # the lookup's support code used by every generated function, and by
+    # the batched and async variants
+    FUNCTION_SUPPORT = ('gss_error_class',)
+    BATCHED_SUPPORT = ()
+    ASYNC_SUPPORT = ('gss_executor',)
+
+    def support_names_for_function(self, target_func, argspecs):
+        """Find the names of the lookup's support code used by a function
+
+        This covers the support code used by the transformers and hooks of
+        its arguments, and by the generated code around them (including the
+        batched and async variants).
+        """
+
+        names = set(self.FUNCTION_SUPPORT)
+        for args in (argspecs.input_args, argspecs.output_args):
+            for argspec in args.values():
+                names.update(argspec['support'])
+
+        if argspecs.options.get('many'):
+            names.update(self.BATCHED_SUPPORT)
+
+        if argspecs.options.get('async'):
+            names.update(self.ASYNC_SUPPORT)
+
+        return names
+
+    def support_for_names(self, names):
+        """Get the lookup's support code of the given names
+
+        Returns a dict of support code lines by name.
+        """
+
+        return collections.OrderedDict(
+            (name, self._lookup.support_code(name))
+            for name in self._support_names if name in names)
+
+    def module_name_for(self, target_func):
+        """Get the name of the module the code for a function is imported as"""
+
+        if self.module_name is not None:
+            return self.module_name
+        else:
+            return target_func.__module__
+
+    def cached_channel_bindings_lines(self, defining):
+        """Get the support code for CachedChannelBindings
+
+        This is used in place of the lookup's support code when
+        channel_bindings_module is set, and either defines the class
+        (when generating that module), or imports it from there.
+        """
+
+        pass
+
+    def support_for_function(self, target_func, argspecs):
+        """Generate any support code specific to a function
+
+        Returns a dict of support code lines by name, to be written once
+        per module (like the lookup's support code).
+        """
+
+        return collections.OrderedDict()
+
+    def merge_support(self, support, new_support):
+        for name, lines in new_support.items():
+            existing_lines = support.setdefault(name, lines)
+            if existing_lines != lines:
+                raise ValueError("Conflicting definitions for the support "
+                                 "code '%s'" % name)
+
+    def write_support(self, support, out):
+        # support code goes after the functions, with the lookup's support
+        # code first, in a fixed order
+        names = [name for name in self._support_names if name in support]
+        names.extend(sorted(name for name in support
+                            if name not in self._support_names))
+
+        # entries named "<group>.<member>" (like the entries of a table)
+        # are written together, without blank lines in between
+        for name, next_name in zip(names, names[1:] + [None]):
+            out.lines(support[name])
+
+            group = name.partition('.')[0]
+            if ('.' not in name or next_name is None or
+                    not next_name.startswith(group + '.')):
+                out.write('\n\n')
+
+    def write_function(self, func, out):
+        """Write the code for a function, returning the support it needs"""
+
+        with self.profiler.function(func.__name__):
+            return self._write_function(func, out)
+
+    def _write_function(self, func, out):
+        if self._cache is None:
+            processed_func, support = self._write_function_code(func, out)
+            return support
+
+        cache_key = self._cache.key_for(func, self.fingerprint())
+        cached = self._cache.get(cache_key)
+        if cached is None:
+            code_buff = io.StringIO()
+            processed_func, support = self._write_function_code(
+                func, CodeEmitter(code_buff))
+
+            cached = CachedFunction(processed_func, code_buff.getvalue(),
+                                    support)
+            self._cache.put(cache_key, cached)
+
+        out.write(cached.code)
+        return cached.support
+
+    def code_and_support_for_function(self, func):
+        code_buff = io.StringIO()
+        support = self.write_function(func, CodeEmitter(code_buff))
+
+        # strip the final newline
+        return (code_buff.getvalue()[:-1], support)
+
+    def code_for_function(self, func):
+        return self.code_and_support_for_function(func)[0]
+
+    def sample_arguments(self, target_func):
+        # expressions for the required arguments of target_func, for calling
+        # it from generated benchmarks (see gssapi_bindings_gen.harness)
+        sample_args = collections.OrderedDict()
+        for param in inspect.signature(target_func).parameters.values():
+            if param.default is not param.empty:
+                continue
+
+            param_type = param.annotation
+            if isinstance(param_type, NotNone):
+                param_type = param_type.type
+
+            value = None
+            if isinstance(param_type, str):
+                value = self._lookup.sample_value(param_type)
+
+            if value is None:
+                raise ValueError("No sample value is known for parameter "
+                                 "'%s' of %s" % (param.name,
+                                                 target_func.__name__))
+
+            sample_args[param.name] = value
+
+        return sample_args
+
+    def functions_for_module(self, module):
         funcs = inspect.getmembers(module, inspect.isfunction)
 
-        filtered_funcs = [func for func_name, func in funcs
-                          if func.__module__ == module.__name__]
+        return [func for func_name, func in funcs
+                if func.__module__ == module.__name__]
 
-        module_code = self.preamble();
-        for func in filtered_funcs:
-            code = self.code_for_function(func)
-            module_code += code
-            module_code += "\n\n\n"
+    def write_module(self, module, out):
+        out.write(self.preamble())
+        support = collections.OrderedDict()
+        for func in self.functions_for_module(module):
+            self.merge_support(support, self.write_function(func, out))
+            out.write('\n\n')
+            out.flush()
 
-        module_code += self.postamble()
+        self.write_support(support, out)
+        out.write(self.postamble())
+        out.flush()
 
-        return module_code
+    def write_module_code(self, func_results, out):
+        # like write_module, but for (code, support) pairs from
+        # code_and_support_for_function
+        out.write(self.preamble())
+        support = collections.OrderedDict()
+        for code, func_support in func_results:
+            self.merge_support(support, func_support)
+            out.write(code)
+            out.write('\n\n\n')
 
-def replace_vars(lines, **varspec):
-    if isinstance(lines, str):
-        lines = [lines]
-        was_str = True
-    else:
-        was_str = False
+        self.write_support(support, out)
+        out.write(self.postamble())
+
+    def code_for_module(self, module):
+        module_buff = io.StringIO()
+        self.write_module(module, CodeEmitter(module_buff))
+        return module_buff.getvalue()
 
-    def replace_func(m):
-        return varspec.get(m.group(2), m.group(0))
 
-    for varname, varval in varspec.items():
-        replace_re = r'\$({)?([a-z]+)(?(1)})'
-        lines = [re.sub(replace_re, replace_func, line) for line in lines]
+class Template(object):
+    """A $-template, split up front into literal and placeholder segments
 
-    if was_str:
-        return lines[0]
+    Placeholders take the form $name or ${name}, and are rendered in
+    a single pass.  Placeholders without a value are left as-is.
+    """
+
+    _VAR_RE = re.compile(r'\$({)?([a-z]+)(?(1)})')
+
+    def __init__(self, text):
+        self.text = text
+
+        # split gives [literal, brace, name, literal, brace, name, ...]
+        pieces = self._VAR_RE.split(text)
+        self._first_literal = pieces[0]
+        self._segments = tuple(
+            (name, '${%s}' % name if brace else '$' + name, literal)
+            for brace, name, literal
+            in zip(pieces[1::3], pieces[2::3], pieces[3::3]))
+
+    def render(self, varspec):
+        if not self._segments:
+            return self.text
+
+        parts = [self._first_literal]
+        for name, raw, literal in self._segments:
+            parts.append(varspec.get(name, raw))
+            parts.append(literal)
+
+        return ''.join(parts)
+
+
+_TEMPLATE_CACHE = {}
+_TEMPLATE_CACHE_MAX = 8192
+
+
+def compile_template(text):
+    try:
+        return _TEMPLATE_CACHE[text]
+    except KeyError:
+        if len(_TEMPLATE_CACHE) >= _TEMPLATE_CACHE_MAX:
+            _TEMPLATE_CACHE.clear()
+
+        template = _TEMPLATE_CACHE[text] = Template(text)
+        return template
+
+
+def replace_vars(lines, **varspec):
+    if isinstance(lines, str):
+        return compile_template(lines).render(varspec)
     else:
-        return lines
+        return [compile_template(line).render(varspec) for line in lines]
@@ -0,0 +1,909 @@
+import collections
+import inspect
+import re
+
+from gssapi_bindings_gen.languages.base import CodeLookup, BaseHook
+from gssapi_bindings_gen.languages.base import needs_support
+from gssapi_bindings_gen.languages.base import CodeGenerator
+from gssapi_bindings_gen.utils import NotNone
+
+# The CFFI backend generates plain Python, for out-of-line API-mode CFFI
+# bindings (which, unlike Cython extensions, run well on PyPy).  The
+# generated code expects the ffi and lib objects of the compiled module to
+# be in scope (see CffiCodeGenerator.builder_source for a script building
+# one), along with the wrapper types, which keep their C handles in
+# one-item arrays (like ffi.new('gss_name_t *')) set up in __new__.
+#
+# Transformers, hooks and specs are all written in the same C-flavored
+# syntax as for the Cython backend, which is then translated to Python:
+#
+#   cdef T name = value   ->  name = ffi.new('T *', value) (for C types)
+#   T(field, ...)         ->  [field, ...] (when initializing a T struct)
+#   &raw_x, &obj.raw_x    ->  raw_x, obj.raw_x (the array is the pointer)
+#   raw_x, obj.raw_x      ->  raw_x[0], obj.raw_x[0]
+#   NULL, GSS_C_NO_*      ->  ffi.NULL
+#   GSS_*                 ->  lib.GSS_*
+#   <bint>value           ->  bool(value) (other casts are dropped, since
+#                             CFFI already converts C values as needed)
+#
+# so names starting with raw_ always refer to such one-item arrays.
+
+
+class OutputTokenHook(BaseHook):
+    def before_call(self):
+        return ['cdef gss_buffer_desc raw_%s' % self.arg_name]
+
+    def for_call(self):
+        return '&raw_%s' % self.arg_name
+
+    def after_call(self):
+        return (line.format(self.arg_name) for line in [
+            '',
+            '{0} = None',
+            'if raw_{0}.length:',
+            "    {0} = ffi.unpack(ffi.cast('char *', raw_{0}.value), "
+            "raw_{0}.length)",
+            'cdef OM_uint32 tmp_min_stat',
+            'lib.gss_release_buffer(&tmp_min_stat, &raw_{0})',
+            ''
+        ])
+
+    def for_success(self):
+        return (None, self.arg_name)
+
+    def for_error(self):
+        return ['token={0}'.format(self.arg_name)]
+
+
+class OutputTokenViewHook(OutputTokenHook):
+    SUPPORT = ('gss_buffer_view',)
+
+    # like OutputTokenHook, but hands out the GSSAPI buffer itself (see
+    # gss_buffer_view) instead of copying it into a bytes object
+    def after_call(self):
+        return (line.format(self.arg_name) for line in [
+            '',
+            '{0} = None',
+            'if raw_{0}.length:',
+            '    {0} = gss_buffer_view(&raw_{0})',
+            'cdef OM_uint32 tmp_min_stat',
+            'lib.gss_release_buffer(&tmp_min_stat, &raw_{0})',
+            ''
+        ])
+
+
+class CffiTransformers(object):
+    def default(self, def_val, otherwise):
+        if isinstance(otherwise, str):
+            otherwise = ['$o = %s' % otherwise]
+
+        return ([
+            '$typedecl = %s' % def_val,
+            'if $i is not None:'] + ['    ' + line for line in otherwise],
+            '$o', None)
+
+    def bytes_to_buffer(self, input_expr, nullable=False):
+        # points the gss_buffer_desc at the object's own memory, which
+        # $i_data keeps alive until the function returns
+        buffer_lines = [
+            '$i_data = ffi.from_buffer(%s)' % input_expr,
+            '$o.length = len($i_data)',
+            '$o.value = $i_data'
+        ]
+
+        if nullable:
+            return (['cdef gss_buffer_desc $o', 'if $i is not None:'] +
+                    ['    ' + line for line in buffer_lines], '&$o', None)
+        else:
+            return (['cdef gss_buffer_desc $o'] + buffer_lines, '&$o', None)
+
+    def pybuffer_to_buffer(self, input_expr, nullable=False):
+        # any C-contiguous buffer (bytes, bytearray, memoryview, array, ...) is
+        # passed without copying, like bytes are -- the buffer is released
+        # in the cleanup, so that the object can be resized again
+        lines, c_arg_expr, cleanup = self.bytes_to_buffer(input_expr,
+                                                          nullable)
+        if nullable:
+            return (lines, c_arg_expr,
+                    ['if $i is not None:', '    ffi.release($i_data)'])
+        else:
+            return (lines, c_arg_expr, ['ffi.release($i_data)'])
+
+    @needs_support('gss_cached_channel_bindings',
+                   'gss_borrow_channel_bindings')
+    def borrow_channel_bindings(self, input_expr, nullable=False):
+        # CachedChannelBindings lend out the C value they keep (see
+        # gss_borrow_channel_bindings) -- $i_cvalue keeps it alive until the
+        # function returns, since the C value is owned by its cdata
+        borrow_lines = [
+            '$i_cvalue = gss_borrow_channel_bindings(%s)' % input_expr,
+            '$o = $i_cvalue'
+        ]
+
+        if nullable:
+            return (['$typedecl = GSS_C_NO_CHANNEL_BINDINGS',
+                     'if $i is not None:'] +
+                    ['    ' + line for line in borrow_lines], '$o', None)
+        else:
+            return (['$typedecl'] + borrow_lines, '$o', None)
+
+    def default_assign(self, def_val):
+        return ([
+            'if $i is None:',
+            '    $i = %s' % def_val
+        ], '$i', None)
+
+
+class CffiInverseTransformers(object):
+    # inverse transformers return ((initval, initializer, transformer),
+    # return_expr), just like CodeLookup.inverse_transformer_for_type
+
+    def buffer_to_bytes(self, input_expr):
+        return (('None', ['cdef bytes $o = $initval',
+                          'cdef OM_uint32 min_stat_$i'], [
+            "$o = ffi.unpack(ffi.cast('char *', $i.value), $i.length)",
+            'lib.gss_release_buffer(&min_stat_$i, &$i)'
+        ]), '$o')
+
+    @needs_support('gss_buffer_view')
+    def buffer_to_view(self, input_expr):
+        # zero-copy: the view takes ownership of the GSSAPI buffer
+        return (('None', '$o = $initval', [
+            '$o = gss_buffer_view(&$i)'
+        ]), '$o')
+
+    @needs_support('gss_intern_oid')
+    def oid_to_py(self, input_expr):
+        # OIDs are interned, so that known mechanisms aren't reallocated
+        return (('None', 'cdef OID $o = $initval', [
+            '$o = gss_intern_oid($i)'
+        ]), '$o')
+
+
+GSS_INTERN_OID_SUPPORT = [
+    '# OIDs returned by GSSAPI calls -- only a handful of mechanisms are',
+    '# ever in use, so each gets one shared OID object, found by its DER',
+    '# bytes',
+    'GSS_OID_CACHE_SIZE = 32',
+    '',
+    '_gss_oids = {}',
+    '',
+    '',
+    'def gss_intern_oid(oid):',
+    '    if oid == ffi.NULL:',
+    '        return None',
+    '',
+    "    elements = ffi.unpack(ffi.cast('char *', oid.elements), oid.length)",
+    '    result = _gss_oids.get(elements)',
+    '    if result is not None:',
+    '        return result',
+    '',
+    '    result = OID.__new__(OID)',
+    '    if len(_gss_oids) >= GSS_OID_CACHE_SIZE:',
+    '        result.raw_oid[0] = oid[0]',
+    '        return result',
+    '',
+    '    # interned OIDs are never freed, so they get their own copy of the',
+    "    # DER bytes, instead of pointing into GSSAPI's memory",
+    "    result._elements = ffi.new('char[]', elements)",
+    '    result.raw_oid.length = oid.length',
+    '    result.raw_oid.elements = result._elements',
+    '    _gss_oids[elements] = result',
+    '',
+    '    return result',
+]
+
+GSS_CACHED_CHANNEL_BINDINGS_SUPPORT = [
+    'class CachedChannelBindings(ChannelBindings):',
+    '    """Channel bindings which keep their C value between calls',
+    '',
+    '    When the same bindings are passed to several calls (like each step',
+    '    of a handshake), the C value is only built once.  Setting any',
+    '    attribute discards it, so it must not be done while a call using',
+    '    the bindings is in progress.',
+    '    """',
+    '',
+    '    _cached_cvalue = None',
+    '',
+    '    def __setattr__(self, name, value):',
+    '        setattr_ = super(CachedChannelBindings, self).__setattr__',
+    "        setattr_('_cached_cvalue', None)",
+    '        setattr_(name, value)',
+    '',
+    '    def borrow(self):',
+    '        cvalue = self._cached_cvalue',
+    '        if cvalue is None:',
+    '            cvalue = self.__cvalue__()',
+    '            super(CachedChannelBindings, self).__setattr__(',
+    "                '_cached_cvalue', cvalue)",
+    '',
+    '        return cvalue',
+]
+
+GSS_CHANNEL_BINDINGS_SUPPORT = [
+    'def gss_borrow_channel_bindings(bindings):',
+    '    # other channel bindings get a new C value, which is freed along',
+    '    # with the cdata owning it',
+    '    if isinstance(bindings, CachedChannelBindings):',
+    '        return bindings.borrow()',
+    '',
+    '    return bindings.__cvalue__()',
+]
+
+GSS_BUFFER_VIEW_SUPPORT = [
+    'def _gss_release_view(value, length):',
+    "    buff = ffi.new('gss_buffer_desc *',",
+    "                   {'length': length, 'value': value})",
+    "    lib.gss_release_buffer(ffi.new('OM_uint32 *'), buff)",
+    '',
+    '',
+    'def gss_buffer_view(buff):',
+    '    """Expose a buffer allocated by GSSAPI without copying',
+    '',
+    '    This takes ownership of the contents of buff, leaving it empty.  The',
+    '    returned buffer supports the buffer protocol, so it may be passed',
+    '    directly to socket.send, memoryview, bytes, etc.  The GSSAPI buffer',
+    "    is released once it is no longer referenced (or right away, giving",
+    "    b'', if it is empty).",
+    '    """',
+    '',
+    '    length = buff.length',
+    '    if not length:',
+    '        if buff.value != ffi.NULL:',
+    "            lib.gss_release_buffer(ffi.new('OM_uint32 *'), buff)",
+    "        return b''",
+    '',
+    "    value = ffi.gc(ffi.cast('char *', buff.value),",
+    '                   lambda value: _gss_release_view(value, length))',
+    '    buff.length = 0',
+    '    buff.value = ffi.NULL',
+    '    return ffi.buffer(value, length)',
+]
+
+NAMEDTUPLE_SUPPORT = ['import collections']
+
+GSS_ERROR_CLASS_SUPPORT = [
+    '# exception classes by routine error (bits 16-23 of a major status),',
+    '# filled in below for the errors listed in the "Raises:" sections',
+    '_gss_routine_errors = [GSSError] * 256',
+    '',
+    '',
+    'def gss_error_class(maj_stat):',
+    '    # calling errors (bits 24-31) mean that the call itself was bad',
+    '    if maj_stat & 0xff000000:',
+    '        return GSSError',
+    '',
+    '    return _gss_routine_errors[(maj_stat >> 16) & 0xff]',
+]
+
+GSS_EXECUTOR_SUPPORT = [
+    'import asyncio',
+    'import concurrent.futures',
+    'import functools',
+    '',
+    '',
+    '# the number of threads in the default executor for *_async functions',
+    'GSS_EXECUTOR_MAX_WORKERS = 4',
+    '',
+    '_gss_executor = None',
+    '',
+    '',
+    'def set_gss_executor(executor):',
+    '    """Set the executor which *_async functions make their calls on',
+    '',
+    '    By default, a thread pool with GSS_EXECUTOR_MAX_WORKERS threads is',
+    '    created when first needed.  Passing None restores the default.',
+    '    """',
+    '',
+    '    global _gss_executor',
+    '    _gss_executor = executor',
+    '',
+    '',
+    'def gss_executor():',
+    '    global _gss_executor',
+    '    if _gss_executor is None:',
+    '        _gss_executor = concurrent.futures.ThreadPoolExecutor(',
+    '            max_workers=GSS_EXECUTOR_MAX_WORKERS,',
+    "            thread_name_prefix='gssapi')",
+    '',
+    '    return _gss_executor',
+]
+
+
+# declarations for the ffi builder (see CffiCodeGenerator.builder_source),
+# which leave the exact integer types and struct layouts to the compiler
+CDEF_TYPES = [
+    'typedef int... OM_uint32;',
+    'typedef int... gss_qop_t;',
+    'typedef int... gss_cred_usage_t;',
+    '',
+    'typedef struct { size_t length; void *value; ...; } gss_buffer_desc;',
+    'typedef gss_buffer_desc *gss_buffer_t;',
+    'typedef struct { OM_uint32 length; void *elements; ...; } gss_OID_desc;',
+    'typedef gss_OID_desc *gss_OID;',
+    'typedef struct {',
+    '    size_t count; gss_OID elements; ...;',
+    '} gss_OID_set_desc;',
+    'typedef gss_OID_set_desc *gss_OID_set;',
+    '',
+    'typedef ... *gss_name_t;',
+    'typedef ... *gss_cred_id_t;',
+    'typedef ... *gss_ctx_id_t;',
+    'typedef ... *gss_channel_bindings_t;',
+]
+
+# the C declarations of the RFC 2744 routines, by name
+ROUTINE_DECLARATIONS = {
+    'gss_acquire_cred': [
+        'OM_uint32 gss_acquire_cred(OM_uint32 *, gss_name_t, OM_uint32,',
+        '                           gss_OID_set, gss_cred_usage_t,',
+        '                           gss_cred_id_t *, gss_OID_set *,',
+        '                           OM_uint32 *);'],
+    'gss_release_cred': [
+        'OM_uint32 gss_release_cred(OM_uint32 *, gss_cred_id_t *);'],
+    'gss_inquire_cred': [
+        'OM_uint32 gss_inquire_cred(OM_uint32 *, gss_cred_id_t, gss_name_t *,',
+        '                           OM_uint32 *, gss_cred_usage_t *,',
+        '                           gss_OID_set *);'],
+    'gss_init_sec_context': [
+        'OM_uint32 gss_init_sec_context(OM_uint32 *, gss_cred_id_t,',
+        '                               gss_ctx_id_t *, gss_name_t, gss_OID,',
+        '                               OM_uint32, OM_uint32,',
+        '                               gss_channel_bindings_t, gss_buffer_t,',
+        '                               gss_OID *, gss_buffer_t, OM_uint32 *,',
+        '                               OM_uint32 *);'],
+    'gss_accept_sec_context': [
+        'OM_uint32 gss_accept_sec_context(OM_uint32 *, gss_ctx_id_t *,',
+        '                                 gss_cred_id_t, gss_buffer_t,',
+        '                                 gss_channel_bindings_t,',
+        '                                 gss_name_t *, gss_OID *,',
+        '                                 gss_buffer_t, OM_uint32 *,',
+        '                                 OM_uint32 *, gss_cred_id_t *);'],
+    'gss_process_context_token': [
+        'OM_uint32 gss_process_context_token(OM_uint32 *, gss_ctx_id_t,',
+        '                                    gss_buffer_t);'],
+    'gss_delete_sec_context': [
+        'OM_uint32 gss_delete_sec_context(OM_uint32 *, gss_ctx_id_t *,',
+        '                                 gss_buffer_t);'],
+    'gss_context_time': [
+        'OM_uint32 gss_context_time(OM_uint32 *, gss_ctx_id_t, OM_uint32 *);'],
+    'gss_inquire_context': [
+        'OM_uint32 gss_inquire_context(OM_uint32 *, gss_ctx_id_t,',
+        '                              gss_name_t *, gss_name_t *,',
+        '                              OM_uint32 *, gss_OID *,',
+        '                              OM_uint32 *, int *, int *);'],
+    'gss_wrap_size_limit': [
+        'OM_uint32 gss_wrap_size_limit(OM_uint32 *, gss_ctx_id_t, int,',
+        '                              gss_qop_t, OM_uint32, OM_uint32 *);'],
+    'gss_export_sec_context': [
+        'OM_uint32 gss_export_sec_context(OM_uint32 *, gss_ctx_id_t *,',
+        '                                 gss_buffer_t);'],
+    'gss_import_sec_context': [
+        'OM_uint32 gss_import_sec_context(OM_uint32 *, gss_buffer_t,',
+        '                                 gss_ctx_id_t *);'],
+    'gss_get_mic': [
+        'OM_uint32 gss_get_mic(OM_uint32 *, gss_ctx_id_t, gss_qop_t,',
+        '                      gss_buffer_t, gss_buffer_t);'],
+    'gss_verify_mic': [
+        'OM_uint32 gss_verify_mic(OM_uint32 *, gss_ctx_id_t, gss_buffer_t,',
+        '                         gss_buffer_t, gss_qop_t *);'],
+    'gss_wrap': [
+        'OM_uint32 gss_wrap(OM_uint32 *, gss_ctx_id_t, int, gss_qop_t,',
+        '                   gss_buffer_t, int *, gss_buffer_t);'],
+    'gss_unwrap': [
+        'OM_uint32 gss_unwrap(OM_uint32 *, gss_ctx_id_t, gss_buffer_t,',
+        '                     gss_buffer_t, int *, gss_qop_t *);'],
+    'gss_import_name': [
+        'OM_uint32 gss_import_name(OM_uint32 *, gss_buffer_t, gss_OID,',
+        '                          gss_name_t *);'],
+    'gss_display_name': [
+        'OM_uint32 gss_display_name(OM_uint32 *, gss_name_t, gss_buffer_t,',
+        '                           gss_OID *);'],
+    'gss_compare_name': [
+        'OM_uint32 gss_compare_name(OM_uint32 *, gss_name_t, gss_name_t,',
+        '                           int *);'],
+    'gss_duplicate_name': [
+        'OM_uint32 gss_duplicate_name(OM_uint32 *, gss_name_t,',
+        '                             gss_name_t *);'],
+    'gss_canonicalize_name': [
+        'OM_uint32 gss_canonicalize_name(OM_uint32 *, gss_name_t, gss_OID,',
+        '                                gss_name_t *);'],
+    'gss_export_name': [
+        'OM_uint32 gss_export_name(OM_uint32 *, gss_name_t, gss_buffer_t);'],
+    'gss_release_name': [
+        'OM_uint32 gss_release_name(OM_uint32 *, gss_name_t *);'],
+    'gss_display_status': [
+        'OM_uint32 gss_display_status(OM_uint32 *, OM_uint32, int, gss_OID,',
+        '                             OM_uint32 *, gss_buffer_t);'],
+    'gss_indicate_mechs': [
+        'OM_uint32 gss_indicate_mechs(OM_uint32 *, gss_OID_set *);'],
+    'gss_release_buffer': [
+        'OM_uint32 gss_release_buffer(OM_uint32 *, gss_buffer_t);'],
+    'gss_release_oid_set': [
+        'OM_uint32 gss_release_oid_set(OM_uint32 *, gss_OID_set *);'],
+}
+
+BUILDER_TEMPLATE = '''\
+import os
+
+import cffi
+
+
+# the libraries to link against, separated by spaces
+GSSAPI_LIBRARIES = os.environ.get('GSSAPI_LIBRARIES', 'gssapi_krb5').split()
+
+ffibuilder = cffi.FFI()
+ffibuilder.cdef("""
+%(cdef)s
+""")
+ffibuilder.set_source(%(module)r, '#include <gssapi/gssapi.h>',
+                      libraries=GSSAPI_LIBRARIES)
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
+'''
+
+
+class CffiLookup(CodeLookup):
+    # default output_initval: PYTHON_NAME.__new__(PYTHON_NAME)
+    #   (which skips __init__, so wrapper types must set up their C
+    #   handles in __new__)
+    # default output_initializer: cdef PYTHON_NAME $o = $initval
+    # default output_transformer: None
+    # default return_expression: $o
+
+    HOOKS = {'output_token': OutputTokenHook,
+             'output_token_view': OutputTokenViewHook}
+    TYPES = {
+        'Name': {
+            'c_type': 'gss_name_t',
+            'input_transformer': 'inplace($.raw_name)',
+            'output_transformer': ['$o.raw_name = $i'],
+            'sample_value': 'Name()'
+        },
+        'Creds': {
+            'c_type': 'gss_cred_id_t',
+            'input_transformer': 'inplace($.raw_cred)',
+            'output_transformer': ['$o.raw_cred = $i'],
+            'sample_value': 'Creds()'
+        },
+        'ChannelBindings': {
+            'c_type': 'gss_channel_bindings_t',
+            'input_transformer': 'borrow_channel_bindings($)',
+            'sample_value': 'ChannelBindings()'
+        },
+        'SecurityContext': {
+            'c_type': 'gss_ctx_id_t',
+            'input_transformer': 'inplace($.raw_ctx)',
+            'output_transformer': ['$o.raw_ctx = $i'],
+            'sample_value': 'SecurityContext()'
+        },
+        'OID': {
+            'c_type': 'gss_OID',
+            'input_transformer': 'inplace(&$.raw_oid)',
+            'output_transformer': 'oid_to_py($)',
+            'sample_value': 'OID()'
+        },
+        'bytes': {
+            'c_type': 'gss_buffer_desc',
+            'input_transformer': 'bytes_to_buffer($)',
+            'output_initval': None,
+            'output_transformer': 'buffer_to_bytes($)',
+            'sample_value': "b'gss-stub-token'"
+        },
+        # anything supporting the buffer protocol, passed without copying
+        'buffer': {
+            'c_type': 'gss_buffer_desc',
+            'input_transformer': 'pybuffer_to_buffer($)',
+            'input_only': True,
+            'sample_value': "bytearray(b'gss-stub-token')"
+        }
+    }
+    INVERSE_TYPES = {type_info['c_type']: type_name for
+                     type_name, type_info in TYPES.items()
+                     if not type_info.get('input_only', False)}
+    # Python types which may appear in cdef statements, besides TYPES
+    PYTHON_TYPES = frozenset(['bytes', 'object'])
+    # C types spelled differently in Cython-flavored code
+    C_TYPE_ALIASES = {'bint': 'int'}
+    # constants which are null pointers, rather than integers
+    NULL_CONSTANTS = frozenset([
+        'GSS_C_NO_NAME',
+        'GSS_C_NO_BUFFER',
+        'GSS_C_NO_OID',
+        'GSS_C_NO_OID_SET',
+        'GSS_C_NO_CONTEXT',
+        'GSS_C_NO_CREDENTIAL',
+        'GSS_C_NO_CHANNEL_BINDINGS',
+    ])
+    # there are no CHEAP_CALLS, since CFFI always releases the GIL around
+    # calls, and no inline converters, since PyPy's JIT inlines the
+    # Python-level helpers instead
+
+    TRANSFORMERS = CffiTransformers()
+    INVERSE_TRANSFORMERS = CffiInverseTransformers()
+    CLEANUP_EXPRS = {
+        # C values are owned by their cdata, and freed along with it
+        'free_non_default': [],
+        'free_buffer': ['cdef OM_uint32 min_stat_$i',
+                        'lib.gss_release_buffer(&min_stat_$i, $i)']
+    }
+    # module-level code needed by generated functions which reference it
+    # (by name), written out once after the functions
+    SUPPORT_CODE = {
+        'gss_buffer_view': GSS_BUFFER_VIEW_SUPPORT,
+        'namedtuple': NAMEDTUPLE_SUPPORT,
+        'gss_error_class': GSS_ERROR_CLASS_SUPPORT,
+        'gss_executor': GSS_EXECUTOR_SUPPORT,
+        'gss_intern_oid': GSS_INTERN_OID_SUPPORT,
+        'gss_cached_channel_bindings': GSS_CACHED_CHANNEL_BINDINGS_SUPPORT,
+        'gss_borrow_channel_bindings': GSS_CHANNEL_BINDINGS_SUPPORT
+    }
+
+    def is_python_type(self, type_name):
+        return type_name in self.TYPES or type_name in self.PYTHON_TYPES
+
+    def cdef_type(self, c_type):
+        return self.C_TYPE_ALIASES.get(c_type, c_type)
+
+    def is_null_constant(self, name):
+        return name == 'NULL' or name in self.NULL_CONSTANTS
+
+    def param_type(self, python_type):
+        # parameters of generated Python functions aren't typed
+        return None
+
+    def routine_declaration(self, routine):
+        try:
+            return ROUTINE_DECLARATIONS[routine]
+        except KeyError:
+            raise ValueError("No C declaration is known for the GSSAPI "
+                             "routine '%s'" % routine)
+
+    def fingerprint_tables(self):
+        return super(CffiLookup, self).fingerprint_tables() + [
+            self.C_TYPE_ALIASES, self.PYTHON_TYPES, self.NULL_CONSTANTS]
+
+
+class CffiCodeGenerator(CodeGenerator):
+    LOOKUP_CLS = CffiLookup
+
+    ASYNC_DOCS = """
+    Call %(name)s from a coroutine, without blocking the event loop.
+
+    The whole call (including converting the arguments) is made on the
+    executor set with set_gss_executor.  Cancelling the coroutine does
+    not stop the call, whose results are then lost.
+"""
+
+    # freelist_size is ignored, since the generated code has no classes of
+    # its own allocated per call
+    def __init__(self, processor_cls, **kwargs):
+        super(CffiCodeGenerator, self).__init__(processor_cls, **kwargs)
+
+        if self.free_threaded:
+            raise ValueError('The CFFI backend cannot generate free-threaded '
+                             'code')
+
+    # cdef TYPE NAME[ = VALUE]
+    _CDEF_RE = re.compile(r'^(\s*)cdef (\w+) (\w+)(?: = (.*))?$')
+    # a string literal, which is left untouched by the translation
+    _STRING_RE = re.compile(r'''('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")''')
+    # a (possibly dotted) name, along with a preceding '&', and whether it
+    # is indexed or called
+    _NAME_RE = re.compile(r'(?<![\w.)\]])(&?)([A-Za-z_]\w*(?:\.\w+)*)([\[(]?)')
+    # a cast of a (possibly dotted) name
+    _CAST_RE = re.compile(r'<(\w+) ?\**>(&?[A-Za-z_][\w.]*)')
+    _CONSTANT_RE = re.compile(r'GSS_[A-Z0-9_]+$')
+    _NULL_CHECK_RE = re.compile(r' is (not )?NULL\b')
+
+    def _translate_name(self, match):
+        address, name, following = match.groups()
+        if address:
+            # the one-item array is the pointer to its value
+            return name + following
+        elif self._lookup.is_null_constant(name):
+            return 'ffi.NULL' + following
+        elif self._CONSTANT_RE.match(name):
+            return 'lib.%s%s' % (name, following)
+        elif not following and name.rpartition('.')[2].startswith('raw_'):
+            return name + '[0]'
+        else:
+            return match.group()
+
+    def _translate_cast(self, match):
+        cast_type, name = match.groups()
+        if cast_type == 'bint':
+            return 'bool(%s)' % name
+        else:
+            return name
+
+    def _translate_code(self, code):
+        code = self._NULL_CHECK_RE.sub(
+            lambda match: ' != NULL' if match.group(1) else ' == NULL', code)
+        code = self._CAST_RE.sub(self._translate_cast, code)
+        return self._NAME_RE.sub(self._translate_name, code)
+
+    def _translate_expr(self, code):
+        # split gives [code, string, code, string, ...]
+        pieces = self._STRING_RE.split(code)
+        pieces[::2] = [self._translate_code(piece) for piece in pieces[::2]]
+        return ''.join(pieces)
+
+    def translate(self, lines):
+        """Translate C-flavored code lines into Python (see above)"""
+
+        python_lines = []
+        for line in lines:
+            match = self._CDEF_RE.match(line)
+            if match is None:
+                python_lines.append(self._translate_expr(line))
+                continue
+
+            indent, decl_type, name, value = match.groups()
+            if value is not None:
+                if value.startswith(decl_type + '(') and value.endswith(')'):
+                    # a struct, like gss_buffer_desc(0, NULL), which CFFI
+                    # initializes from a list of its fields
+                    value = '[%s]' % value[len(decl_type) + 1:-1]
+
+                value = self._translate_expr(value)
+
+            if self._lookup.is_python_type(decl_type):
+                python_lines.append('%s%s = %s' % (
+                    indent, name, 'None' if value is None else value))
+            else:
+                new_args = "'%s *'" % self._lookup.cdef_type(decl_type)
+                if value is not None:
+                    new_args += ', %s' % value
+
+                python_lines.append('%s%s = ffi.new(%s)' % (indent, name,
+                                                            new_args))
+
+        return python_lines
+
+    def _output_argspec_to_code(self, argname, argspec):
+        if argspec['hook'] is not None:
+            return (None, None, None, None, None, argspec['hook'])
+
+        if not isinstance(argname, str):
+            # purely computed output arg
+            return (None, None, None, None, argspec['return_expr'], None)
+
+        input_name = 'raw_%s' % argname
+        tags = argspec['tags']
+
+        prep_lines = []
+        if argspec['temporary_type'] is not None:
+            prep_line = 'cdef %s %s' % (argspec['temporary_type'], input_name)
+            if argspec['initial_value'] is not None:
+                prep_line += ' = %s' % argspec['initial_value']
+
+            prep_lines.append(prep_line)
+
+        null_conditions = []
+        if 'optional' in tags:
+            # with output args tagged 'optional', a func parameter with the
+            # same name specifies whether or not the value should be
+            # fetched, so it's passed by address, or as NULL
+            prep_lines.append('%s_ptr = &%s if %s else NULL' % (
+                argname, input_name, argname))
+            c_arg_expr = '%s_ptr' % argname
+            output_name = 'output_%s' % argname
+            null_conditions.append(argname)
+        else:
+            c_arg_expr = argspec['c_arg_expr']
+            if c_arg_expr is not None:
+                c_arg_expr = self._replace_vars(c_arg_expr, i=input_name)
+
+            output_name = argname
+
+        if 'nullable' in tags:
+            null_conditions.append('$i is not NULL')
+
+        return_expr = self._replace_vars(argspec['return_expr'],
+                                         o=output_name, i=input_name)
+
+        if argspec['transformer'] is not None:
+            base_initval, initializer, transformer = argspec['transformer']
+
+            if null_conditions:
+                initval = 'None'
+            else:
+                initval = base_initval
+
+            if initializer is not None:
+                initializer = self._replace_vars(initializer, initval=initval,
+                                                 o=output_name, i=input_name)
+
+            if transformer is not None:
+                if null_conditions:
+                    # (transformers which start from None assign the output
+                    # themselves)
+                    guarded = ['if %s:' % ' and '.join(null_conditions)]
+                    if base_initval != 'None':
+                        guarded.append('    $o = %s' % base_initval)
+
+                    transformer = guarded + ['    ' + line
+                                             for line in transformer]
+
+                transformer = self._replace_vars(transformer, o=output_name,
+                                                 i=input_name)
+        elif null_conditions:
+            # tagged arguments require a transformer
+            transformer = self._replace_vars([
+                '$o = None',
+                'if %s:' % ' and '.join(null_conditions),
+                '    $o = %s' % return_expr
+            ], o=output_name, i=input_name)
+            initializer = None
+            return_expr = output_name
+        else:
+            initializer = None
+            transformer = None
+
+        return (prep_lines, c_arg_expr, initializer, transformer,
+                return_expr, None)
+
+    def code_lines(self, target_func, argspecs):
+        sig = inspect.signature(target_func)
+
+        code_lines = []
+        for param_name, param in sig.parameters.items():
+            if isinstance(param.annotation, NotNone):
+                code_lines.append('if %s is None:' % param_name)
+                code_lines.append("    raise TypeError(\"Argument '%s' must "
+                                  "not be None\")" % param_name)
+
+        arg_code = self.argument_code(argspecs)
+        code_lines.extend(arg_code.code)
+
+        code_lines.append('')
+        code_lines.append('cdef OM_uint32 min_stat')
+        code_lines.append('maj_stat = lib.gss_%s(%s)' % (
+            target_func.__name__,
+            ', '.join(['&min_stat'] + arg_code.c_args)))
+        code_lines.append('')
+
+        if arg_code.cleanup:
+            code_lines.extend(arg_code.cleanup)
+
+        if arg_code.initializers:
+            code_lines.append('')
+            code_lines.extend(arg_code.initializers)
+
+        # min_stat is a one-item array here
+        code_lines.extend(self.status_check_lines(target_func, argspecs,
+                                                  arg_code,
+                                                  min_stat='min_stat[0]'))
+
+        return self.translate(code_lines)
+
+    def _call_args(self, target_func):
+        # passes each parameter of target_func on by name
+        return ', '.join('%s=%s' % (param_name, param_name) for param_name
+                         in inspect.signature(target_func).parameters)
+
+    def batched_code_lines(self, target_func, argspecs, batched):
+        # CFFI releases the GIL around each call anyway, so the batched
+        # variant just calls the function once per item
+        batched_names = list(batched.values())
+
+        code_lines = []
+        if len(batched_names) > 1:
+            code_lines.extend('%s = list(%s)' % (batched_name, batched_name)
+                              for batched_name in batched_names)
+            code_lines.append('if %s:' % ' or '.join(
+                'len(%s) != len(%s)' % (batched_name, batched_names[0])
+                for batched_name in batched_names[1:]))
+            code_lines.append("    raise ValueError('%s must all have the "
+                              "same length')" % ', '.join(batched_names))
+
+        code_lines.append('')
+        code_lines.append('results = []')
+        if len(batched_names) > 1:
+            code_lines.append('for %s in zip(%s):' % (
+                ', '.join(batched), ', '.join(batched_names)))
+        else:
+            code_lines.append('for %s in %s:' % (list(batched)[0],
+                                                 batched_names[0]))
+
+        code_lines.extend([
+            '    try:',
+            '        results.append(%s(%s))' % (target_func.__name__,
+                                                self._call_args(target_func)),
+            '    except GSSError as e:',
+            '        results.append(e)',
+            '',
+            'return results'
+        ])
+
+        return code_lines
+
+    def async_code_lines(self, target_func, argspecs):
+        return ([], [
+            'loop = asyncio.get_running_loop()',
+            'return await loop.run_in_executor(',
+            '    gss_executor(),',
+            '    functools.partial(%s, %s))' % (target_func.__name__,
+                                               self._call_args(target_func))
+        ])
+
+    def result_constructor(self, result_type):
+        return result_type
+
+    def cached_channel_bindings_lines(self, defining):
+        if defining:
+            return GSS_CACHED_CHANNEL_BINDINGS_SUPPORT
+        else:
+            return ['from %s import CachedChannelBindings'
+                    % self.channel_bindings_module]
+
+    def support_for_function(self, target_func, argspecs):
+        support = collections.OrderedDict()
+
+        # each error listed in the "Raises:" section gets its entry in the
+        # module's table of exception classes (errors which don't correspond
+        # to a routine error, like supplementary info, are just documented)
+        for error_name in self.raised_errors(argspecs.func_docs):
+            routine_error = self._lookup.routine_error(error_name)
+            if routine_error is not None:
+                support['gss_error_class.%s' % error_name] = [
+                    '_gss_routine_errors[lib.%s >> 16] = %s' % (
+                        routine_error, error_name)]
+
+        # functions returning tuples (annotated with a string) return a
+        # namedtuple, in which positional outputs get fields named after
+        # their index
+        result_type = inspect.signature(target_func).return_annotation
+        if isinstance(result_type, str):
+            fields = [argname if isinstance(argname, str) else '_%d' % index
+                      for index, argname
+                      in enumerate(argspecs.output_args)]
+
+            support['namedtuple'] = self._lookup.support_code('namedtuple')
+            support[result_type] = [
+                '%s = collections.namedtuple(' % result_type,
+                '    %r, %r,' % (result_type, fields),
+                '    rename=True)']
+
+        return support
+
+    _LIB_NAME_RE = re.compile(r'(?<![\w.])lib\.(\w+)(\()?')
+
+    def builder_source(self, code, module_name):
+        """Generate an ffi builder script for the given generated code
+
+        The script declares the GSSAPI routines and constants used by the
+        code (through lib), and builds them into a module named
+        module_name.
+        """
+
+        routines = set()
+        constants = set()
+        for name, call in self._LIB_NAME_RE.findall(code):
+            if call:
+                routines.add(name)
+            else:
+                constants.add(name)
+
+        cdef_lines = list(CDEF_TYPES)
+        cdef_lines.append('')
+        cdef_lines.extend('#define %s ...' % constant
+                          for constant in sorted(constants))
+        for routine in sorted(routines):
+            cdef_lines.append('')
+            cdef_lines.extend(self._lookup.routine_declaration(routine))
+
+        return BUILDER_TEMPLATE % {'cdef': '\n'.join(cdef_lines),
+                                   'module': module_name}
+
+    def wrap_doc_lines(self, lines):
+        return ['"""' + lines[0]] + lines[1:] + ['"""']
+
+    def preamble(self):
+        return '# gssapi-gen-code:begin\n\n\n'
+
+    def postamble(self):
+        return '# gssapi-gen-code:end\n'
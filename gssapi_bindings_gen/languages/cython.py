@@ -1,7 +1,10 @@
+import collections
 import inspect
+import re
 
 from gssapi_bindings_gen.languages.base import CodeLookup, BaseHook
-from gssapi_bindings_gen.languages.base import CodeGenerator, replace_vars
+from gssapi_bindings_gen.languages.base import needs_support
+from gssapi_bindings_gen.languages.base import CodeGenerator
 from gssapi_bindings_gen.utils import NotNone
 
 class OutputTokenHook(BaseHook):
@@ -18,7 +21,7 @@ class OutputTokenHook(BaseHook):
             'if raw_{0}.length:',
             '    {0} = raw_{0}.value[:raw_{0}.length]',
             'cdef OM_uint32 tmp_min_stat',
-            'gss_release_buffer(&tmp_min_stat, raw_{0})',
+            'gss_release_buffer(&tmp_min_stat, &raw_{0})',
             ''
         ])
 
@@ -29,6 +32,26 @@ class OutputTokenHook(BaseHook):
         return ['token={0}'.format(self.arg_name)]
 
 
+class OutputTokenViewHook(OutputTokenHook):
+    SUPPORT = ('gss_buffer_view',)
+
+    # like OutputTokenHook, but hands out the GSSAPI buffer itself (wrapped
+    # in a GSSBufferView) instead of copying it into a bytes object
+    def before_call(self):
+        return (super(OutputTokenViewHook, self).before_call() +
+                ['cdef OM_uint32 min_stat_raw_%s' % self.arg_name])
+
+    def after_call(self):
+        return (line.format(self.arg_name) for line in [
+            '',
+            '{0} = None',
+            'if raw_{0}.length:',
+            '    {0} = gss_buffer_view(&raw_{0})',
+            'gss_release_buffer(&min_stat_raw_{0}, &raw_{0})',
+            ''
+        ])
+
+
 class CythonTransformers(object):
     def default(self, def_val, otherwise):
         if isinstance(otherwise, str):
@@ -61,6 +84,50 @@ class CythonTransformers(object):
                 'cdef gss_buffer_desc $o = gss_buffer_desc(len({0}), {0})'.format(input_expr)
             ], '&$o', None)
 
+    def pybuffer_to_buffer(self, input_expr, nullable=False):
+        # points the gss_buffer_desc at any C-contiguous buffer (bytes,
+        # bytearray, memoryview, mmap, array, ...) without copying -- casting
+        # to bytes first lets buffers of any item size or shape through, and
+        # the typed memoryview holds the buffer until the cleanup (or until
+        # the function exits, if something raises first)
+        view_expr = "memoryview(%s).cast('B')" % input_expr
+        view_lines = [
+            '$o.length = $o_view.shape[0]',
+            'if $o.length:',
+            '    $o.value = <void *>&$o_view[0]'
+        ]
+
+        if nullable:
+            return ([
+                'cdef const unsigned char[::1] $o_view = None',
+                'cdef gss_buffer_desc $o = gss_buffer_desc(0, NULL)',
+                'if $i is not None:',
+                '    $o_view = %s' % view_expr
+            ] + ['    ' + line for line in view_lines],
+            '&$o', ['$o_view = None'])
+        else:
+            return ([
+                'cdef const unsigned char[::1] $o_view = %s' % view_expr,
+                'cdef gss_buffer_desc $o = gss_buffer_desc(0, NULL)'
+            ] + view_lines, '&$o', ['$o_view = None'])
+
+    @needs_support('gss_cached_channel_bindings',
+                   'gss_borrow_channel_bindings')
+    def borrow_channel_bindings(self, input_expr, nullable=False):
+        # CachedChannelBindings lend out the C value they keep (see
+        # gss_borrow_channel_bindings), so only other bindings get freed
+        borrow_line = ('$o = gss_borrow_channel_bindings(%s, &$o_owned)'
+                       % input_expr)
+
+        lines = ['$typedecl = GSS_C_NO_CHANNEL_BINDINGS',
+                 'cdef bint $o_owned = False']
+        if nullable:
+            lines.extend(['if $i is not None:', '    ' + borrow_line])
+        else:
+            lines.append(borrow_line)
+
+        return (lines, '$o', ['if $o_owned:', '    free($o)'])
+
     def default_assign(self, def_val):
         return ([
             'if $i is None:',
@@ -69,57 +136,494 @@ class CythonTransformers(object):
 
 
 class CythonInverseTransformers(object):
+    # inverse transformers return ((initval, initializer, transformer),
+    # return_expr), just like CodeLookup.inverse_transformer_for_type
+
     def buffer_to_bytes(self, input_expr):
-        return ([
+        return (('None', ['cdef bytes $o = $initval',
+                          'cdef OM_uint32 min_stat_$i'], [
             '$o = $i.value[:$i.length]',
-            'cdef OM_uint32 min_stat_$i',
-            'gss_release_buffer(&min_stat_$i, $i)'
-        ], '$o')
+            'gss_release_buffer(&min_stat_$i, &$i)'
+        ]), '$o')
+
+    @needs_support('gss_buffer_view')
+    def buffer_to_view(self, input_expr):
+        # zero-copy: the view takes ownership of the GSSAPI buffer
+        return (('None', '$o = $initval', [
+            '$o = gss_buffer_view(&$i)'
+        ]), '$o')
+
+    @needs_support('gss_intern_oid')
+    def oid_to_py(self, input_expr):
+        # OIDs are interned, so that known mechanisms aren't reallocated
+        return (('None', 'cdef OID $o = $initval', [
+            '$o = gss_intern_oid($i)'
+        ]), '$o')
+
+
+GSS_INTERN_OID_SUPPORT = [
+    'from libc.stdlib cimport malloc',
+    'from libc.string cimport memcmp, memcpy',
+    '',
+    '',
+    '# OIDs returned by GSSAPI calls -- only a handful of mechanisms are',
+    '# ever in use, so each gets one shared OID object.  They are found by',
+    '# comparing DER bytes, since scanning a short list is cheaper than',
+    '# allocating a bytes key to hash.',
+    'cdef enum:',
+    '    GSS_OID_CACHE_SIZE = 32',
+    '',
+    'cdef list _gss_oids = []',
+    '',
+    '',
+    'cdef OID gss_intern_oid(gss_OID oid):',
+    '    if oid == NULL:',
+    '        return None',
+    '',
+    '    # on free-threaded builds, this holds the lock of the list, so that',
+    '    # concurrent calls never intern the same OID twice (with the GIL,',
+    '    # it does nothing)',
+    '    with cython.critical_section(_gss_oids):',
+    '        return _gss_intern_oid_locked(oid)',
+    '',
+    '',
+    'cdef OID _gss_intern_oid_locked(gss_OID oid):',
+    '    cdef OID known',
+    '    for known in _gss_oids:',
+    '        if (known.raw_oid.length == oid.length and',
+    '                memcmp(known.raw_oid.elements, oid.elements,',
+    '                       oid.length) == 0):',
+    '            return known',
+    '',
+    '    cdef OID result = OID.__new__(OID)',
+    '    if len(_gss_oids) >= GSS_OID_CACHE_SIZE:',
+    '        result.raw_oid = oid[0]',
+    '        return result',
+    '',
+    '    # interned OIDs are never freed, so they get their own copy of the',
+    "    # DER bytes, instead of pointing into GSSAPI's memory",
+    '    cdef void *elements = malloc(oid.length)',
+    '    if elements == NULL:',
+    '        raise MemoryError()',
+    '',
+    '    memcpy(elements, oid.elements, oid.length)',
+    '    result.raw_oid.length = oid.length',
+    '    result.raw_oid.elements = elements',
+    '    _gss_oids.append(result)',
+    '',
+    '    return result',
+]
+
+CACHED_CHANNEL_BINDINGS_HEADER = [
+    'cdef class CachedChannelBindings(ChannelBindings):',
+    '    """Channel bindings which keep their C value between calls',
+    '',
+    '    When the same bindings are passed to several calls (like each step',
+    '    of a handshake), the C value is only built once.  Setting any',
+    '    attribute discards it, so it must not be done while a call using',
+    '    the bindings is in progress.',
+    '    """',
+    '',
+]
+
+# a module defining CachedChannelBindings for others to cimport declares
+# its attributes and C methods in its .pxd instead
+CACHED_CHANNEL_BINDINGS_PXD = [
+    'cdef class CachedChannelBindings(ChannelBindings):',
+    '    cdef gss_channel_bindings_t _cached_cvalue',
+    '',
+    '    cdef gss_channel_bindings_t borrow(self) except NULL',
+    '    cdef void _discard_cvalue(self) noexcept',
+]
+
+CACHED_CHANNEL_BINDINGS_METHODS = [
+    '    def __setattr__(self, name, value):',
+    '        self._discard_cvalue()',
+    '        super(CachedChannelBindings, self).__setattr__(name, value)',
+    '',
+    '    def __dealloc__(self):',
+    '        self._discard_cvalue()',
+    '',
+    '    cdef gss_channel_bindings_t borrow(self) except NULL:',
+    '        if self._cached_cvalue == NULL:',
+    '            self._cached_cvalue = self.__cvalue__()',
+    '',
+    '        return self._cached_cvalue',
+    '',
+    '    cdef void _discard_cvalue(self) noexcept:',
+    '        if self._cached_cvalue != NULL:',
+    '            free(self._cached_cvalue)',
+    '            self._cached_cvalue = NULL',
+]
+
+GSS_CACHED_CHANNEL_BINDINGS_SUPPORT = (
+    ['from libc.stdlib cimport free', '', ''] +
+    CACHED_CHANNEL_BINDINGS_HEADER +
+    ['    cdef gss_channel_bindings_t _cached_cvalue', ''] +
+    CACHED_CHANNEL_BINDINGS_METHODS)
+
+GSS_CHANNEL_BINDINGS_SUPPORT = [
+    'cdef inline gss_channel_bindings_t gss_borrow_channel_bindings(',
+    '        ChannelBindings bindings, bint *owned) except NULL:',
+    '    # other channel bindings get a new C value, which the caller frees',
+    '    if isinstance(bindings, CachedChannelBindings):',
+    '        owned[0] = False',
+    '        return (<CachedChannelBindings>bindings).borrow()',
+    '',
+    '    owned[0] = True',
+    '    return bindings.__cvalue__()',
+]
+
+GSS_BUFFER_VIEW_SUPPORT = [
+    'from cpython.buffer cimport PyBuffer_FillInfo',
+    '',
+    '',
+    '$freelist',
+    'cdef class GSSBufferView:',
+    '    """A buffer allocated by GSSAPI, exposed without copying',
+    '',
+    '    This supports the buffer protocol, so it may be passed directly to',
+    '    socket.send, memoryview, bytes, etc.  The GSSAPI buffer is released',
+    '    once the view is no longer referenced.',
+    '    """',
+    '',
+    '    cdef gss_buffer_desc buff',
+    '',
+    '    def __cinit__(self):',
+    '        self.buff = gss_buffer_desc(0, NULL)',
+    '',
+    '    def __dealloc__(self):',
+    '        cdef OM_uint32 min_stat',
+    '        if self.buff.value != NULL:',
+    '            gss_release_buffer(&min_stat, &self.buff)',
+    '',
+    '    def __getbuffer__(self, Py_buffer *view, int flags):',
+    '        PyBuffer_FillInfo(view, self, self.buff.value, self.buff.length,',
+    '                          1, flags)',
+    '',
+    '    def __releasebuffer__(self, Py_buffer *view):',
+    '        pass',
+    '',
+    '    def __len__(self):',
+    '        return self.buff.length',
+    '',
+    '    def __bytes__(self):',
+    '        if not self.buff.length:',
+    "            return b''",
+    '',
+    '        return (<char *>self.buff.value)[:self.buff.length]',
+    '',
+    '',
+    'cdef object gss_buffer_view(gss_buffer_desc *buff):',
+    '    # takes ownership of the contents of buff, leaving it empty -- empty',
+    "    # buffers give b'' (released right away), rather than a view",
+    '    cdef OM_uint32 min_stat',
+    '    if not buff.length:',
+    '        if buff.value != NULL:',
+    '            gss_release_buffer(&min_stat, buff)',
+    "        return b''",
+    '',
+    '    cdef GSSBufferView view = GSSBufferView.__new__(GSSBufferView)',
+    '    view.buff = buff[0]',
+    '    buff.length = 0',
+    '    buff.value = NULL',
+    '    return view',
+]
+
+
+PY_STRUCT_SEQUENCE_SUPPORT = [
+    'from cpython.object cimport PyObject, PyTypeObject',
+    'from cpython.ref cimport Py_INCREF',
+    '',
+    '',
+    'cdef extern from "Python.h":',
+    '    ctypedef struct PyStructSequence_Field:',
+    '        const char *name',
+    '        const char *doc',
+    '',
+    '    ctypedef struct PyStructSequence_Desc:',
+    '        const char *name',
+    '        const char *doc',
+    '        PyStructSequence_Field *fields',
+    '        int n_in_sequence',
+    '',
+    '    const char *PyStructSequence_UnnamedField',
+    '',
+    '    PyTypeObject *PyStructSequence_NewType(',
+    '        PyStructSequence_Desc *desc) except NULL',
+    '    object PyStructSequence_New(PyTypeObject *seq_type)',
+    '    # steals the reference to value',
+    '    void PyStructSequence_SET_ITEM(object seq, Py_ssize_t pos,',
+    '                                   PyObject *value)',
+]
+
+
+GSS_ERROR_CLASS_SUPPORT = [
+    '# exception classes by routine error (bits 16-23 of a major status),',
+    '# filled in below for the errors listed in the "Raises:" sections',
+    'cdef list _gss_routine_errors = [GSSError] * 256',
+    '',
+    '',
+    '@cython.boundscheck(False)',
+    '@cython.wraparound(False)',
+    'cdef inline object gss_error_class(OM_uint32 maj_stat):',
+    '    # calling errors (bits 24-31) mean that the call itself was bad',
+    '    if maj_stat & 0xff000000:',
+    '        return GSSError',
+    '',
+    '    return _gss_routine_errors[(maj_stat >> 16) & 0xff]',
+]
+
+
+GSS_EXECUTOR_SUPPORT = [
+    'import asyncio',
+    'import concurrent.futures',
+    '',
+    '',
+    '# the number of threads in the default executor for *_async functions',
+    'GSS_EXECUTOR_MAX_WORKERS = 4',
+    '',
+    'cdef object _gss_executor = None',
+    '',
+    '',
+    'def set_gss_executor(executor):',
+    '    """Set the executor which *_async functions make their C calls on',
+    '',
+    '    By default, a thread pool with GSS_EXECUTOR_MAX_WORKERS threads is',
+    '    created when first needed.  Passing None restores the default.',
+    '    """',
+    '',
+    '    global _gss_executor',
+    '    _gss_executor = executor',
+    '',
+    '',
+    'cdef object gss_executor():',
+    '    global _gss_executor',
+    '    if _gss_executor is None:',
+    '        _gss_executor = concurrent.futures.ThreadPoolExecutor(',
+    '            max_workers=GSS_EXECUTOR_MAX_WORKERS,',
+    "            thread_name_prefix='gssapi')",
+    '',
+    '    return _gss_executor',
+]
+
+
+GSS_OBJECT_LOCKS_SUPPORT = [
+    'from cpython.pythread cimport PyThread_type_lock',
+    'from cpython.pythread cimport WAIT_LOCK, NOWAIT_LOCK',
+    'from cpython.pythread cimport PyThread_allocate_lock',
+    'from cpython.pythread cimport PyThread_acquire_lock, PyThread_release_lock',
+    '',
+    '',
+    '# wrapper objects whose handles get changed by GSSAPI calls (like',
+    '# security contexts) are locked around those calls, using one of a',
+    "# fixed set of locks picked by the object's address",
+    'cdef enum:',
+    '    GSS_OBJECT_LOCK_COUNT = 64',
+    '',
+    'cdef PyThread_type_lock _gss_object_locks[GSS_OBJECT_LOCK_COUNT]',
+    'cdef int _gss_lock_index',
+    'for _gss_lock_index in range(GSS_OBJECT_LOCK_COUNT):',
+    '    _gss_object_locks[_gss_lock_index] = PyThread_allocate_lock()',
+    '    if _gss_object_locks[_gss_lock_index] == NULL:',
+    '        raise MemoryError()',
+    '',
+    '',
+    'cdef inline PyThread_type_lock gss_object_lock(object obj):',
+    '    # objects are (at least) 16-byte aligned',
+    '    return _gss_object_locks[',
+    '        (<size_t><void *>obj >> 4) % GSS_OBJECT_LOCK_COUNT]',
+    '',
+    '',
+    'cdef inline void gss_sort_locks(PyThread_type_lock *locks,',
+    '                                int count) noexcept nogil:',
+    '    # locks are taken in address order, and only once each, so that',
+    '    # calls which lock several objects cannot deadlock',
+    '    cdef int i, j',
+    '    cdef PyThread_type_lock lock',
+    '    for i in range(1, count):',
+    '        lock = locks[i]',
+    '        j = i',
+    '        while j > 0 and <size_t>locks[j - 1] > <size_t>lock:',
+    '            locks[j] = locks[j - 1]',
+    '            j -= 1',
+    '',
+    '        locks[j] = lock',
+    '',
+    '',
+    'cdef inline void gss_acquire_locks(PyThread_type_lock *locks,',
+    '                                   int count) noexcept nogil:',
+    '    cdef int i',
+    '    gss_sort_locks(locks, count)',
+    '    for i in range(count):',
+    '        if i == 0 or locks[i] != locks[i - 1]:',
+    '            PyThread_acquire_lock(locks[i], WAIT_LOCK)',
+    '',
+    '',
+    'cdef inline void gss_release_locks(PyThread_type_lock *locks,',
+    '                                   int count) noexcept nogil:',
+    '    # (locks is sorted by gss_acquire_locks)',
+    '    cdef int i',
+    '    for i in range(count):',
+    '        if i == 0 or locks[i] != locks[i - 1]:',
+    '            PyThread_release_lock(locks[i])',
+    '',
+    '',
+    'cdef inline void gss_acquire_locks_with_gil(PyThread_type_lock *locks,',
+    '                                            int count) noexcept:',
+    '    # for calls made with the GIL held: another thread may hold one of',
+    '    # the locks during a slow call (like one waiting on a KDC), so',
+    '    # unless all of them are free, the GIL is released while waiting',
+    '    cdef int i',
+    '    gss_sort_locks(locks, count)',
+    '    for i in range(count):',
+    '        if i == 0 or locks[i] != locks[i - 1]:',
+    '            if not PyThread_acquire_lock(locks[i], NOWAIT_LOCK):',
+    '                # (releasing the ones taken so far)',
+    '                gss_release_locks(locks, i)',
+    '                with nogil:',
+    '                    gss_acquire_locks(locks, count)',
+    '',
+    '                return',
+]
+
+
+GSS_FLAGS_TO_PY_SUPPORT = [
+    'class _SharedIntEnumFlagSet(IntEnumFlagSet):',
+    '    # flag sets are cached and shared between calls (see',
+    '    # gss_flags_to_py), so they must not be changed once shared',
+    '    _shared = False',
+    '',
+    '    def add(self, flag):',
+    '        if self._shared:',
+    "            raise TypeError('Flag sets returned by GSSAPI calls are '",
+    "                            'shared, and cannot be modified')",
+    '',
+    '        super(_SharedIntEnumFlagSet, self).add(flag)',
+    '',
+    '    def discard(self, flag):',
+    '        if self._shared:',
+    "            raise TypeError('Flag sets returned by GSSAPI calls are '",
+    "                            'shared, and cannot be modified')",
+    '',
+    '        super(_SharedIntEnumFlagSet, self).discard(flag)',
+    '',
+    '',
+    '# flag sets by enum, and then by value -- only a handful of distinct',
+    '# combinations of flags ever show up, so the caches stay small',
+    'cdef enum:',
+    '    GSS_FLAG_SET_CACHE_SIZE = 128',
+    '',
+    'cdef dict _gss_flag_sets = {}',
+    '',
+    '',
+    'cdef inline object gss_flags_to_py(object enum, OM_uint32 flags):',
+    '    # no lock is needed on free-threaded builds: dict operations are',
+    '    # atomic, and setdefault makes concurrent misses share the set which',
+    '    # got cached first (the size limit may be overshot by a few entries,',
+    '    # which is harmless)',
+    '    cdef dict cache = _gss_flag_sets.get(enum)',
+    '    if cache is None:',
+    '        cache = _gss_flag_sets.setdefault(enum, {})',
+    '',
+    '    flag_set = cache.get(flags)',
+    '    if flag_set is None:',
+    '        flag_set = _SharedIntEnumFlagSet(enum, flags)',
+    '        flag_set._shared = True',
+    '        if len(cache) < GSS_FLAG_SET_CACHE_SIZE:',
+    '            flag_set = cache.setdefault(flags, flag_set)',
+    '',
+    '    return flag_set',
+]
+
+GSS_FLAGS_TO_C_SUPPORT = [
+    'cdef inline OM_uint32 gss_flags_to_c(object enum, object flags) except? 0:',
+    '    # plain ints are already flags',
+    '    if type(flags) is int:',
+    '        return flags',
+    '',
+    '    return IntEnumFlagSet(enum, flags)',
+]
+
+GSS_TTL_TO_PY_SUPPORT = [
+    'cdef inline object gss_ttl_to_py(OM_uint32 ttl):',
+    '    if ttl == GSS_C_INDEFINITE:',
+    '        return None',
+    '',
+    '    return ttl',
+]
+
+GSS_TTL_TO_C_SUPPORT = [
+    'cdef inline OM_uint32 gss_ttl_to_c(object ttl) except? 0:',
+    '    if ttl is None:',
+    '        return GSS_C_INDEFINITE',
+    '',
+    '    return ttl',
+]
 
 
 class CythonLookup(CodeLookup):
-    # default output_initval: PYTHON_NAME()
+    # default output_initval: PYTHON_NAME.__new__(PYTHON_NAME)
+    #   (which skips __init__, so wrapper types must set up their C
+    #   handles in __cinit__)
     # default output_initializer: cdef PYTHON_NAME $o = $initval
     # default output_transformer: None
     # default return_expression: $o
 
-    HOOKS = {'output_token': OutputTokenHook}
+    HOOKS = {'output_token': OutputTokenHook,
+             'output_token_view': OutputTokenViewHook}
     TYPES = {
         'Name': {
             'c_type': 'gss_name_t',
             'input_transformer': 'inplace($.raw_name)',
-            'output_transformer': ['$o.raw_name = $i']
+            'output_transformer': ['$o.raw_name = $i'],
+            'sample_value': 'Name()'
         },
         'Creds': {
             'c_type': 'gss_cred_id_t',
             'input_transformer': 'inplace($.raw_cred)',
-            'output_transformer': ['$o.raw_cred = $i']
+            'output_transformer': ['$o.raw_cred = $i'],
+            'sample_value': 'Creds()'
         },
         'ChannelBindings': {
             'c_type': 'gss_channel_bindings_t',
-            'input_transformer': ('default(GSS_C_NO_CHANNEL_BINDINGS; '
-                                  '$.__cvalue__()); '
-                                  'cleanup(free_non_default)'),
+            'input_transformer': 'borrow_channel_bindings($)',
+            'sample_value': 'ChannelBindings()'
         },
+        # the handle of a security context changes with (nearly) every call
+        # using it, so calls must not use one concurrently
         'SecurityContext': {
             'c_type': 'gss_ctx_id_t',
+            'mutable': True,
             'input_transformer': 'inplace($.raw_ctx)',
-            'output_transformer': ['$o.raw_ctx = $i']
+            'output_transformer': ['$o.raw_ctx = $i'],
+            'sample_value': 'SecurityContext()'
         },
         'OID': {
             'c_type': 'gss_OID',
             'input_transformer': 'inplace(&$.raw_oid)',
-            'output_transformer': ['$o.raw_oid = $i[0]'],
+            'output_transformer': 'oid_to_py($)',
+            'sample_value': 'OID()'
         },
         'bytes': {
             'c_type': 'gss_buffer_desc',
             'input_transformer': 'bytes_to_buffer($)',
             'output_initval': None,
-            'output_transformer': 'buffer_to_bytes($)'
+            'output_transformer': 'buffer_to_bytes($)',
+            'sample_value': "b'gss-stub-token'"
+        },
+        # anything supporting the buffer protocol, passed without copying
+        'buffer': {
+            'c_type': 'gss_buffer_desc',
+            'param_type': 'object',
+            'input_transformer': 'pybuffer_to_buffer($)',
+            'input_only': True,
+            'sample_value': "bytearray(b'gss-stub-token')"
         }
     }
     INVERSE_TYPES = {type_info['c_type']: type_name for
-                     type_name, type_info in TYPES.items()}
+                     type_name, type_info in TYPES.items()
+                     if not type_info.get('input_only', False)}
 
     TRANSFORMERS = CythonTransformers()
     INVERSE_TRANSFORMERS = CythonInverseTransformers()
@@ -128,95 +632,121 @@ class CythonLookup(CodeLookup):
         'free_buffer': ['cdef OM_uint32 min_stat_$i',
                         'gss_release_buffer(&min_stat_$i, $i)']
     }
+    # for C output types allocated by GSSAPI, the empty value and the code
+    # releasing a value (if set), for batched variants, which keep the
+    # per-item outputs until each gets turned into a result
+    OUTPUT_RELEASES = {
+        'gss_buffer_desc': ('gss_buffer_desc(0, NULL)', [
+            'if $i.value != NULL:',
+            '    gss_release_buffer(&min_stat, &$i)']),
+        'gss_name_t': ('GSS_C_NO_NAME', [
+            'if $i != GSS_C_NO_NAME:',
+            '    gss_release_name(&min_stat, &$i)']),
+        'gss_cred_id_t': ('GSS_C_NO_CREDENTIAL', [
+            'if $i != GSS_C_NO_CREDENTIAL:',
+            '    gss_release_cred(&min_stat, &$i)']),
+        'gss_OID_set': ('GSS_C_NO_OID_SET', [
+            'if $i != GSS_C_NO_OID_SET:',
+            '    gss_release_oid_set(&min_stat, &$i)'])
+    }
+    # GSSAPI calls which only look at in-memory state, and never block (on
+    # a KDC, DNS, a credentials cache, ...), so that they take less time
+    # than releasing and reacquiring the GIL does (see 'nogil: auto')
+    CHEAP_CALLS = frozenset([
+        'context_time',
+        'inquire_context',
+        'compare_name',
+        'display_name',
+        'duplicate_name',
+        'export_name',
+        'display_status',
+        'wrap_size_limit',
+        'create_empty_oid_set',
+        'add_oid_set_member',
+        'test_oid_set_member',
+        'release_oid_set',
+        'release_buffer',
+    ])
+    # calls to Python-level helpers in input and output expressions which
+    # get replaced by inline cdef versions (see the support code)
+    INPUT_CONVERTERS = {
+        'IntEnumFlagSet': 'gss_flags_to_c',
+        'py_ttl_to_c': 'gss_ttl_to_c',
+    }
+    OUTPUT_CONVERTERS = {
+        'IntEnumFlagSet': 'gss_flags_to_py',
+        'c_ttl_to_py': 'gss_ttl_to_py',
+    }
+    # module-level code needed by generated functions which reference it
+    # (by name), written out once after the functions
+    SUPPORT_CODE = {
+        'gss_buffer_view': GSS_BUFFER_VIEW_SUPPORT,
+        'calloc': ['from libc.stdlib cimport calloc, free'],
+        'PyStructSequence': PY_STRUCT_SEQUENCE_SUPPORT,
+        'gss_error_class': GSS_ERROR_CLASS_SUPPORT,
+        'gss_executor': GSS_EXECUTOR_SUPPORT,
+        'gss_object_lock': GSS_OBJECT_LOCKS_SUPPORT,
+        'gss_flags_to_py': GSS_FLAGS_TO_PY_SUPPORT,
+        'gss_flags_to_c': GSS_FLAGS_TO_C_SUPPORT,
+        'gss_ttl_to_py': GSS_TTL_TO_PY_SUPPORT,
+        'gss_ttl_to_c': GSS_TTL_TO_C_SUPPORT,
+        'gss_intern_oid': GSS_INTERN_OID_SUPPORT,
+        'gss_cached_channel_bindings': GSS_CACHED_CHANNEL_BINDINGS_SUPPORT,
+        'gss_borrow_channel_bindings': GSS_CHANNEL_BINDINGS_SUPPORT
+    }
 
-    def is_known_type(self, python_type):
-        return python_type in self.TYPES
-
-    def as_c_type(self, python_type):
-        return self.TYPES[python_type]['c_type']
-
-    def transformer_for_type(self, python_type):
-        return self.TYPES[python_type]['input_transformer']
-
-    def inverse_transformer_for_type(self, c_type):
-        python_type = self.INVERSE_TYPES[c_type]
-        info = self.TYPES[python_type]
-
-        initval = info.get('output_initval', '%s()' % python_type)
-        initializer = info.get('output_initializer',
-                               'cdef %s $o = $initval' % python_type)
-        return_expr = info.get('return_expression', '$o')
-        transformer = info.get('output_transformer')
-        return ((initval, initializer, transformer), return_expr)
-
-    def _get_transformer(self, func_name):
-        return getattr(self.TRANSFORMERS, func_name)
 
-    def transformer(self, func_name, *args, **kwargs):
-        # (transformer, c_arg_expr, cleanup)
-        return self._get_transformer(func_name)(*args, **kwargs)
+class CythonCodeGenerator(CodeGenerator):
+    LOOKUP_CLS = CythonLookup
 
-    def make_transformer_args(self, func_name, args, param_type, can_be_none):
-        argspec = inspect.getfullargspec(self._get_transformer(func_name))
+    BATCHED_SUPPORT = ('calloc',)
 
-        if 'nullable' in argspec.args:
-            kwargs = {'nullable': can_be_none}
-        else:
-            kwargs = {}
+    BATCHED_NOGIL_DOCS = """
+    Call %(name)s once for each item, releasing the GIL only once.
 
-        info = self.TYPES.get(param_type)
-        if not info or not info['input_transformer'].startswith('inplace('):
-            return (args, kwargs)
+    Returns a list with one entry per item: either what %(name)s
+    would have returned for it, or the GSSError explaining why the
+    call failed for it.
+"""
 
-        transformer_expr = info['input_transformer'][8:-1]
+    # a call to a function (which isn't a method)
+    _CALL_RE = re.compile(r'(?<![.\w])(\w+)\(')
 
+    def _use_inline_converters(self, code, is_input):
+        # replace calls to Python-level conversion helpers with calls to the
+        # lookup's inline versions
+        def replace_call(match):
+            converter = self._lookup.inline_converter(match.group(1),
+                                                      is_input)
+            if converter is None:
+                return match.group()
 
-        if argspec.varargs is not None:
-            return (args, kwargs)
+            return '%s(' % converter
 
-        # we want to compare against len(args) - 1 b/c args[0] == 'self'
-        if len(argspec.args) - len(argspec.defaults or []) - 1 > len(args):
-            return (args + [transformer_expr], kwargs)
+        if isinstance(code, str):
+            return self._CALL_RE.sub(replace_call, code)
         else:
-            return (args, kwargs)
-
-    def has_transformer(self, func_name):
-        return hasattr(self.TRANSFORMERS, func_name)
-
-    def inverse_transformer(self, func_name, *args):
-        # (transformer, return_expr)
-        return getattr(self.INVERSE_TRANSFORMERS, func_name)(*args)
-
-    def has_inverse_transformer(self, func_name):
-        return hasattr(self.INVERSE_TRANSFORMERS, func_name)
+            return [self._CALL_RE.sub(replace_call, line) for line in code]
 
-    def cleanup_expression(self, cleanup_type):
-        return self.CLEANUP_EXPRS[cleanup_type]
+    def _inline_converters_for(self, code, is_input):
+        # the inline converters which _use_inline_converters would use
+        if code is None:
+            return []
+        elif isinstance(code, str):
+            code = [code]
 
-    def hook(self, hook_name, arg_name):
-        return self.HOOKS[hook_name](arg_name)
-
-
-class CythonCodeGenerator(CodeGenerator):
-    LOOKUP_CLS = CythonLookup
+        return [converter for line in code
+                for converter in (self._lookup.inline_converter(func_name,
+                                                                is_input)
+                                  for func_name in self._CALL_RE.findall(line))
+                if converter is not None]
 
     def _input_argspec_to_code(self, argname, argspec):
-        transformer = argspec['transformer']
-        c_arg_expr = argspec['c_arg_expr']
+        transformer, c_arg_expr, cleanup_code = super(
+            CythonCodeGenerator, self)._input_argspec_to_code(argname, argspec)
 
-        output_name = 'raw_%s' % argname
-        arg_replacements = {'i': argname, 'o': output_name}
         if transformer is not None:
-            type_decl = 'cdef %s %s' % (argspec['temporary_type'], output_name)
-
-            transformer = replace_vars(transformer, typedecl=type_decl,
-                                       **arg_replacements)
-
-        c_arg_expr = replace_vars(c_arg_expr, **arg_replacements)
-
-        cleanup_code = argspec['cleanup']
-        if cleanup_code is not None:
-            cleanup_code = replace_vars(cleanup_code, **arg_replacements)
+            transformer = self._use_inline_converters(transformer, True)
 
         return (transformer, c_arg_expr, cleanup_code)
 
@@ -249,12 +779,13 @@ class CythonCodeGenerator(CodeGenerator):
                         prep_lines.append(prep_line)
 
                 if c_arg_expr is not None:
-                    c_arg_expr = replace_vars(c_arg_expr, i=input_name)
+                    c_arg_expr = self._replace_vars(c_arg_expr, i=input_name)
 
                 output_name = argname
 
-                return_expr = replace_vars(argspec['return_expr'],
-                                           o=output_name, i=input_name)
+                return_expr = self._replace_vars(argspec['return_expr'],
+                                                 o=output_name, i=input_name)
+                return_expr = self._use_inline_converters(return_expr, False)
 
                 null_conditions = []
                 if 'optional' in argspec['tags']:
@@ -278,28 +809,35 @@ class CythonCodeGenerator(CodeGenerator):
                         output_name = 'output_%s' % argname
 
                     if initializer is not None:
-                        initializer = replace_vars(initializer,
-                                                   initval=initval,
-                                                   o=output_name, i=input_name)
+                        initializer = self._replace_vars(initializer,
+                                                         initval=initval,
+                                                         o=output_name,
+                                                         i=input_name)
 
                     if transformer is not None:
                         transformer_indented = ['    ' + line for
                                                 line in transformer]
 
                         if null_conditions:
+                            # (transformers which start from None assign
+                            # the output themselves)
                             transformer = [
-                                'if %s:' % ' and '.join(null_conditions),
-                                '    $o = %s' % base_initval
-                            ] + transformer_indented
-
-                        transformer = replace_vars(transformer, o=output_name,
-                                                   i=input_name)
+                                'if %s:' % ' and '.join(null_conditions)
+                            ]
+                            if base_initval != 'None':
+                                transformer.append('    $o = %s'
+                                                   % base_initval)
+                            transformer.extend(transformer_indented)
+
+                        transformer = self._replace_vars(transformer,
+                                                         o=output_name,
+                                                         i=input_name)
                 elif null_conditions:
                     if 'optional' in argspec['tags']:
                         output_name = 'output_%s' % argname
 
                     # tagged arguments require a transformer
-                    transformer = replace_vars([
+                    transformer = self._replace_vars([
                         '$o = None',
                         'if %s:' % ' and '.join(null_conditions),
                         '   $o = %s' % return_expr
@@ -315,155 +853,744 @@ class CythonCodeGenerator(CodeGenerator):
                         transformer, return_expr, None)
 
     def code_lines(self, target_func, argspecs):
-        code_lines = []
-        c_func_args = []
-        cleanup_lines = []
+        return self._code_lines(target_func, argspecs)[1]
 
-        for argname, argspec in argspecs.input_args.items():
-            transformer_code, c_arg_code, cleanup_code = (
-                self._input_argspec_to_code(argname, argspec))
+    def async_code_lines(self, target_func, argspecs):
+        return self._code_lines(target_func, argspecs, is_async=True)
 
-            if transformer_code is not None:
-                code_lines.append('')
-                code_lines.append('# convert %s to a C value' % argname)
-                code_lines.extend(transformer_code)
+    def _code_lines(self, target_func, argspecs, is_async=False):
+        # returns (call class lines, code lines), where the call class is
+        # only needed for async functions
+        arg_code = self.argument_code(argspecs)
+        code_lines = arg_code.code
+        c_func_args = arg_code.c_args
+        cleanup_lines = arg_code.cleanup
 
-            if cleanup_code is not None:
-                cleanup_lines.append('')
-                cleanup_lines.extend(cleanup_code)
+        code_lines.append('')
+        code_lines.append('cdef OM_uint32 maj_stat, min_stat')
 
-            c_func_args.append(c_arg_code)
+        code_lines.append('')
+        if is_async:
+            # the call object does the cleanup once it goes away, since the
+            # code after the await doesn't run if the coroutine gets cancelled
+            call_class_lines, call_lines = self._async_call_lines(
+                target_func, argspecs, c_func_args, code_lines, cleanup_lines)
+            code_lines.extend(call_lines)
+            cleanup_lines = []
+        else:
+            call_class_lines = None
+            func_line = 'maj_stat = gss_%s(&min_stat, %s)' % (
+                target_func.__name__, ', '.join(c_func_args))
+
+            locked = self.locked_objects(target_func, argspecs)
+            if locked:
+                code_lines.append(self._locks_decl(locked))
+                code_lines.extend(self._lock_lookup_lines(locked))
+                code_lines.append('')
 
-        initializer_lines = []
-        success_lines = []
-        return_args = []
-        error_args = []
+            code_lines.extend(self._call_lines(
+                [func_line], locked, self.releases_gil(target_func, argspecs)))
 
         code_lines.append('')
 
+        if cleanup_lines:
+            code_lines.extend(cleanup_lines)
+
+        if arg_code.initializers:
+            code_lines.append('')
+            code_lines.extend(arg_code.initializers)
+
+        code_lines.extend(self.status_check_lines(target_func, argspecs,
+                                                  arg_code))
+
+        return (call_class_lines, code_lines)
+
+    # a name which isn't an attribute
+    _NAME_RE = re.compile(r'(?<![.\w])[A-Za-z_]\w*')
+
+    def _async_call_lines(self, target_func, argspecs, c_func_args,
+                          code_lines, cleanup_lines):
+        # The C call is made by the run method of a per-function "call"
+        # object, which gets passed to the executor (so that no closure is
+        # needed).  It holds copies of the C values passed to the call (which
+        # get copied back afterwards, for the outputs), as well as the
+        # parameters and memoryviews, which must stay alive until the call is
+        # done, even if the caller goes away.  Its __dealloc__ runs the
+        # cleanup for the inputs, and releases any outputs allocated by
+        # GSSAPI which were never copied back (when the coroutine was
+        # cancelled, or the await raised).
+        sig = inspect.signature(target_func)
+        call_class = '_%s_call' % target_func.__name__
+
+        decls = collections.OrderedDict()
+        for line in code_lines:
+            match = self._CDEF_RE.match(line)
+            if match is not None:
+                decls[match.group(2)] = match.group(1)
+
+        fields = collections.OrderedDict([('maj_stat', 'OM_uint32'),
+                                          ('min_stat', 'OM_uint32')])
+        copied_back = ['maj_stat', 'min_stat']
+
+        # parameters passed to the call directly (like context.raw_ctx) need
+        # their declared type, while the rest just need to be kept alive
+        c_arg_names = set()
+        for c_arg in c_func_args:
+            c_arg_names.update(self._NAME_RE.findall(c_arg))
+
+        for param_name, param in sig.parameters.items():
+            param_type, not_none = self._param_type(param.annotation)
+            if param_name not in c_arg_names or param_type is None:
+                param_type = 'object'
+
+            fields[param_name] = param_type
+
+        for c_arg in c_func_args:
+            for name in self._NAME_RE.findall(c_arg):
+                if name in decls and name not in fields:
+                    fields[name] = decls[name]
+                    copied_back.append(name)
+
+        for decl_name, decl_type in decls.items():
+            if '[' in decl_type:
+                fields.setdefault(decl_name, decl_type)
+
+        # the cleanup needs whatever it refers to (like whether the value
+        # of an input is owned)
+        for line in cleanup_lines:
+            for name in self._NAME_RE.findall(line):
+                if name in decls and name not in fields:
+                    fields[name] = decls[name]
+
+        # outputs allocated by GSSAPI start out empty (as the call object is
+        # zeroed), and are owned by the call object until copied back
+        released = collections.OrderedDict()
         for argname, argspec in argspecs.output_args.items():
-            (prep_code, c_arg_code, initializer_code,
-             success_code, return_code, hook) =  self._output_argspec_to_code(
-                argname, argspec)
+            field_name = 'raw_%s' % argname
+            if field_name in copied_back:
+                release = self._lookup.output_release(fields[field_name])
+                if release is not None:
+                    released[field_name] = release
+
+        def field_code(code):
+            return self._NAME_RE.sub(
+                lambda match: ('self.%s' % match.group()
+                               if match.group() in fields else match.group()),
+                code)
+
+        call_args = [field_code(c_arg)
+                     for c_arg in ['&min_stat'] + c_func_args]
+
+        call_line = 'self.maj_stat = gss_%s(%s)' % (target_func.__name__,
+                                                    ', '.join(call_args))
+
+        class_lines = self._freelist_lines()
+        class_lines.append('cdef class %s:' % call_class)
+        class_lines.extend('    cdef %s %s' % (field_type, field_name)
+                           for field_name, field_type in fields.items())
+        class_lines.append('')
+        class_lines.append('    def run(self):')
+
+        locked = self.locked_objects(target_func, argspecs)
+        run_lines = []
+        if locked:
+            run_lines.append(self._locks_decl(locked))
+            run_lines.extend(self._lock_lookup_lines(
+                ['self.%s' % argname for argname in locked]))
+            run_lines.append('')
+
+        run_lines.extend(self._call_lines(
+            [call_line], locked,
+            self.releases_gil(target_func, argspecs, is_async=True)))
+        class_lines.extend('        ' + line for line in run_lines)
+
+        dealloc_lines = []
+        for field_name, release in released.items():
+            dealloc_lines.extend(self._replace_vars(
+                release[1], i='self.%s' % field_name))
+
+        dealloc_lines.extend(field_code(line) for line in cleanup_lines)
+
+        if dealloc_lines:
+            class_lines.append('')
+            class_lines.append('    def __dealloc__(self):')
+            if released:
+                class_lines.append('        cdef OM_uint32 min_stat')
+            class_lines.extend(('        ' + line).rstrip()
+                               for line in dealloc_lines)
+
+        call_lines = ['cdef %s call = %s.__new__(%s)' % (call_class,
+                                                         call_class,
+                                                         call_class)]
+        call_lines.extend('call.%s = %s' % (field_name, field_name)
+                          for field_name in fields
+                          if field_name not in ('maj_stat', 'min_stat') and
+                          field_name not in released)
+        call_lines.append('')
+        call_lines.append('await asyncio.get_running_loop().run_in_executor(')
+        call_lines.append('    gss_executor(), call.run)')
+        call_lines.append('')
+        call_lines.extend('%s = call.%s' % (field_name, field_name)
+                          for field_name in copied_back)
+
+        # the outputs are now released by the code below
+        call_lines.extend('call.%s = %s' % (field_name, release[0])
+                          for field_name, release in released.items())
+
+        return (class_lines, call_lines)
+
+    # a (top-level) cdef statement, with an optional initial value
+    _CDEF_RE = re.compile(r'^cdef (.+?) (\w+)(?: = (.*))?$')
+
+    def _hoist_declarations(self, lines, decls):
+        # cdef statements may not appear inside loops, so move them into
+        # decls as (type, name) pairs, leaving any initial value behind as an
+        # assignment
+        body = []
+        for line in lines:
+            match = self._CDEF_RE.match(line)
+            if match is None:
+                body.append(line)
+                continue
+
+            decl = match.group(1, 2)
+            if decl not in decls:
+                decls.append(decl)
+
+            if match.group(3) is not None:
+                body.append('%s = %s' % match.group(2, 3))
+
+        return body
+
+    def _freelist_lines(self):
+        # a freelist for a generated cdef class, which gets allocated on
+        # every call
+        if self.freelist_size:
+            return ['@cython.freelist(%d)' % self.freelist_size]
+        else:
+            return []
+
+    def support_names_for_function(self, target_func, argspecs):
+        names = super(CythonCodeGenerator, self).support_names_for_function(
+            target_func, argspecs)
+
+        # the inline versions of conversion helpers are support code too
+        for argspec in argspecs.input_args.values():
+            names.update(self._inline_converters_for(argspec['transformer'],
+                                                     True))
+
+        for argname, argspec in argspecs.output_args.items():
+            if argspec['hook'] is None and isinstance(argname, str):
+                names.update(self._inline_converters_for(
+                    argspec['return_expr'], False))
+
+        if self.locked_objects(target_func, argspecs):
+            names.add('gss_object_lock')
+
+        return names
+
+    def support_for_names(self, names):
+        # lookup support code marks where freelists go with a '$freelist'
+        # line
+        support = super(CythonCodeGenerator, self).support_for_names(names)
+        for name, lines in support.items():
+            if '$freelist' in lines:
+                support[name] = [
+                    freelist_line for line in lines
+                    for freelist_line in (self._freelist_lines()
+                                          if line == '$freelist' else [line])]
+
+        return support
+
+    def cached_channel_bindings_lines(self, defining):
+        if not defining:
+            return ['from %s cimport CachedChannelBindings'
+                    % self.channel_bindings_module]
+
+        # other modules cimport it, so its C members go in the .pxd
+        return (['from libc.stdlib cimport free', '', '',
+                 '# the .pxd of %s must declare this as:'
+                 % self.channel_bindings_module,
+                 '#'] +
+                ['#     ' + line if line else '#'
+                 for line in CACHED_CHANNEL_BINDINGS_PXD] +
+                CACHED_CHANNEL_BINDINGS_HEADER +
+                CACHED_CHANNEL_BINDINGS_METHODS)
+
+    def result_constructor(self, result_type):
+        return '_new_%s' % result_type
+
+    def support_for_function(self, target_func, argspecs):
+        support = collections.OrderedDict()
+
+        # each error listed in the "Raises:" section gets its entry in the
+        # module's table of exception classes (errors which don't correspond
+        # to a routine error, like supplementary info, are just documented)
+        for error_name in self.raised_errors(argspecs.func_docs):
+            routine_error = self._lookup.routine_error(error_name)
+            if routine_error is not None:
+                support['gss_error_class.%s' % error_name] = [
+                    '_gss_routine_errors[%s >> 16] = %s' % (routine_error,
+                                                            error_name)]
+
+        # functions returning tuples (annotated with a string) return
+        # a PyStructSequence, which is a tuple with named fields that we can
+        # fill in directly from C, unlike a namedtuple
+        result_type = inspect.signature(target_func).return_annotation
+        if isinstance(result_type, str):
+            # positional outputs become unnamed fields (only accessible
+            # by index)
+            fields = [argname if isinstance(argname, str) else None
+                      for argname in argspecs.output_args]
+
+            support['PyStructSequence'] = self._lookup.support_code(
+                'PyStructSequence')
+            support[result_type] = self._result_type_lines(
+                result_type, fields, self.module_name_for(target_func))
+
+        return support
+
+    def _result_type_lines(self, result_type, fields, module_name):
+        fields_name = '_%s_fields' % result_type
+        desc_name = '_%s_desc' % result_type
+        type_name = '_%s_type' % result_type
+
+        lines = ['cdef PyStructSequence_Field %s[%d]' % (fields_name,
+                                                         len(fields) + 1)]
+        for index, field in enumerate(fields):
+            if field is None:
+                field_name = 'PyStructSequence_UnnamedField'
+            else:
+                field_name = "b'%s'" % field
+
+            lines.append('%s[%d].name = %s' % (fields_name, index, field_name))
+            lines.append('%s[%d].doc = NULL' % (fields_name, index))
 
-            if hook is not None:
-                prep_code = hook.before_call()
+        lines.extend([
+            '%s[%d].name = NULL' % (fields_name, len(fields)),
+            '',
+            'cdef PyStructSequence_Desc %s' % desc_name,
+            # the module part of the name becomes the type's __module__, so
+            # that results can be pickled
+            "%s.name = b'%s.%s'" % (desc_name, module_name, result_type),
+            '%s.doc = NULL' % desc_name,
+            '%s.fields = %s' % (desc_name, fields_name),
+            '%s.n_in_sequence = %d' % (desc_name, len(fields)),
+            '',
+            'cdef PyTypeObject *%s = PyStructSequence_NewType(&%s)' % (
+                type_name, desc_name),
+            '%s = <object>%s' % (result_type, type_name),
+            '',
+            '',
+            'cdef inline object %s(%s):' % (
+                self.result_constructor(result_type),
+                ', '.join('object f%d' % index
+                          for index in range(len(fields)))),
+            '    cdef object result = PyStructSequence_New(%s)' % type_name,
+        ])
 
-                after_lines = hook.after_call()
-                if after_lines is not None:
-                    initializer_lines.extend(after_lines)
+        for index in range(len(fields)):
+            lines.append('    Py_INCREF(f%d)' % index)
+            lines.append('    PyStructSequence_SET_ITEM(result, %d, '
+                         '<PyObject *>f%d)' % (index, index))
 
-                initializer_code = None
+        lines.append('    return result')
 
-                c_arg_code = hook.for_call()
-                success_code, return_code = hook.for_success()
+        return lines
 
-                err_args = hook.for_error()
-                if err_args is not None:
-                    error_args.extend(err_args)
+    def locked_objects(self, target_func, argspecs, batched=()):
+        """List the arguments to lock around the C call(s) for a function
 
-            if prep_code is not None:
-                code_lines.extend(prep_code)
+        When generating free-threaded code, wrapper objects of a mutable type
+        (like SecurityContext) whose handles are passed to the C function
+        in place get locked, so that concurrent calls using the same object
+        are serialized.
+        """
 
-            if initializer_code is not None:
-                initializer_lines.append(initializer_code)
+        if not self.free_threaded:
+            return []
 
-            if success_code is not None:
-                success_lines.extend(success_code)
-                success_lines.append('')
+        sig = inspect.signature(target_func)
 
-            if c_arg_code is not None:
-                c_func_args.append(c_arg_code)
+        locked = []
+        for argname, argspec in argspecs.input_args.items():
+            if argname in batched:
+                continue
 
-            return_args.append(return_code)
+            arg_type = sig.parameters[argname].annotation
+            if isinstance(arg_type, NotNone):
+                arg_type = arg_type.type
 
-        code_lines.append('')
-        code_lines.append('cdef OM_uint32 maj_stat, min_stat')
+            if not self._lookup.is_mutable_type(arg_type):
+                continue
 
-        code_lines.append('')
-        # TODO(directxman12): support for not using nogil
-        code_lines.append('with nogil:')
+            c_arg_code = self._replace_vars(argspec['c_arg_expr'], i=argname,
+                                            o='raw_%s' % argname)
+            if argname in self._NAME_RE.findall(c_arg_code):
+                locked.append(argname)
 
-        func_line = '    maj_stat = gss_%s(&min_stat, %s)' % (
-            target_func.__name__, ', '.join(c_func_args))
+        return locked
 
-        code_lines.append(func_line)
-        code_lines.append('')
+    def _locks_decl(self, locked):
+        return 'cdef PyThread_type_lock object_locks[%d]' % len(locked)
 
-        if cleanup_lines:
-            code_lines.extend(cleanup_lines)
+    def _lock_lookup_lines(self, objects):
+        return ['object_locks[%d] = gss_object_lock(%s)' % (index, obj)
+                for index, obj in enumerate(objects)]
 
-        if initializer_lines:
-            code_lines.append('')
-            code_lines.extend(initializer_lines)
+    def _call_lines(self, call_lines, locked, releases_gil):
+        if releases_gil:
+            acquire_func = 'gss_acquire_locks'
+        else:
+            # which never waits for a lock while holding the GIL
+            acquire_func = 'gss_acquire_locks_with_gil'
+
+        if locked:
+            call_lines = (
+                ['%s(object_locks, %d)' % (acquire_func, len(locked))] +
+                call_lines +
+                ['gss_release_locks(object_locks, %d)' % len(locked)])
 
+        if releases_gil:
+            return ['with nogil:'] + ['    ' + line for line in call_lines]
+        else:
+            return call_lines
+
+    def releases_gil(self, target_func, argspecs, batched=False,
+                     is_async=False):
+        """Whether to release the GIL around the C call(s) for a function
+
+        This follows the 'nogil' option (always, never or auto).  With auto,
+        the GIL is released unless the call is known to be cheap (in which
+        case releasing and reacquiring the GIL would cost more than it
+        saves), or the function is a batched or async variant.
+        """
+
+        policy = argspecs.options.get('nogil', 'auto')
+        if policy == 'auto':
+            return batched or is_async or not self._lookup.is_cheap_call(
+                target_func.__name__)
+        else:
+            return policy == 'always'
+
+    def batched_docs(self, target_func, argspecs):
+        if self.releases_gil(target_func, argspecs, batched=True):
+            return self.BATCHED_NOGIL_DOCS % {'name': target_func.__name__}
+        else:
+            return super(CythonCodeGenerator, self).batched_docs(
+                target_func, argspecs)
+
+    def batched_code_lines(self, target_func, argspecs, batched):
         sig = inspect.signature(target_func)
+
+        code_lines = []
+        decls = []
+        # C arrays holding a value per item, as (type, name) pairs
+        arrays = [('OM_uint32', 'maj_stats'), ('OM_uint32', 'min_stats')]
+        c_func_args = []
+        cleanup_lines = []
+        item_lines = []
+        item_cleanup_lines = []
+        result_lines = []
+        # outputs allocated by GSSAPI, as (type, temporary name) pairs
+        released = []
+        has_views = False
+
+        for argname, argspec in argspecs.input_args.items():
+            transformer_code, c_arg_code, cleanup_code = (
+                self._input_argspec_to_code(argname, argspec))
+
+            if argname not in batched:
+                # shared between all items, so converted just once
+                if transformer_code is not None:
+                    code_lines.append('')
+                    code_lines.append('# convert %s to a C value' % argname)
+                    code_lines.extend(transformer_code)
+
+                if cleanup_code is not None:
+                    cleanup_lines.append('')
+                    cleanup_lines.extend(cleanup_code)
+
+                c_func_args.append(c_arg_code)
+                continue
+
+            if transformer_code is None:
+                raise ValueError("Input argument '%s' cannot be batched, "
+                                 "since it has no C temporary" % argname)
+
+            param_type, not_none = self._param_type(
+                sig.parameters[argname].annotation)
+            decls.append((param_type or 'object', argname))
+
+            items_name = 'raw_%s_items' % argname
+            arrays.append((argspec['temporary_type'], items_name))
+
+            item_lines.append('%s = %s[i]' % (argname, batched[argname]))
+            if not_none:
+                item_lines.append('if %s is None:' % argname)
+                item_lines.append('    raise TypeError("Items of \'%s\' '
+                                  'must not be None")' % batched[argname])
+            num_decls = len(decls)
+            item_lines.extend(self._hoist_declarations(transformer_code,
+                                                       decls))
+            item_lines.append('%s[i] = raw_%s' % (items_name, argname))
+
+            # memoryviews must stay alive until the calls are done, so they
+            # get collected in a list, which replaces releasing them one by
+            # one in the cleanup
+            view_names = [decl_name for decl_type, decl_name
+                          in decls[num_decls:] if '[' in decl_type]
+            for view_name in view_names:
+                item_lines.append('item_views.append(%s)' % view_name)
+                has_views = True
+
+            if cleanup_code is not None:
+                cleanup_code = [line for line in cleanup_code
+                                if line.split(' = ')[0] not in view_names]
+
+            if cleanup_code:
+                item_cleanup_lines.append('%s = %s[i]' % (
+                    argname, batched[argname]))
+                item_cleanup_lines.append('raw_%s = %s[i]' % (argname,
+                                                               items_name))
+                item_cleanup_lines.extend(self._hoist_declarations(
+                    cleanup_code, decls))
+
+            c_func_args.append(self._replace_vars(
+                argspec['c_arg_expr'], i=argname, o='%s[i]' % items_name))
+
+        # outputs referring to batched inputs refer to the current item
+        for argname, batched_name in batched.items():
+            result_lines.append('%s = %s[i]' % (argname, batched_name))
+
+        success_lines = []
+        return_args = []
+        for argname, argspec in argspecs.output_args.items():
+            if argspec['hook'] is not None:
+                raise ValueError("Output argument '%s' uses a hook, which "
+                                 "batched variants do not support" % argname)
+
+            if 'optional' in argspec['tags']:
+                raise ValueError("Output argument '%s' is optional, which "
+                                 "batched variants do not support" % argname)
+
+            (prep_code, c_arg_code, initializer_code,
+             success_code, return_code, hook) = self._output_argspec_to_code(
+                argname, argspec)
+
+            release = None
+            if prep_code:
+                # the per-item values are copied into the usual temporary
+                # before building each result
+                items_name = 'raw_%s_items' % argname
+                arrays.append((argspec['temporary_type'], items_name))
+                self._hoist_declarations(prep_code, decls)
+
+                if argspec['initial_value'] is not None:
+                    item_lines.append('%s[i] = %s' % (
+                        items_name, argspec['initial_value']))
+
+                result_lines.append('raw_%s = %s[i]' % (argname, items_name))
+                c_func_args.append(self._replace_vars(
+                    argspec['c_arg_expr'], i='%s[i]' % items_name))
+
+                # the temporary takes over values allocated by GSSAPI, until
+                # they get released or handed to a Python object
+                release = self._lookup.output_release(
+                    argspec['temporary_type'])
+                if release is not None:
+                    released.append((release, 'raw_%s' % argname,
+                                     items_name))
+                    result_lines.append('%s[i] = %s' % (items_name,
+                                                        release[0]))
+
+            if isinstance(initializer_code, str):
+                initializer_code = [initializer_code]
+
+            if initializer_code is not None:
+                result_lines.extend(self._hoist_declarations(
+                    initializer_code, decls))
+
+            if success_code is not None:
+                success_lines.extend(self._hoist_declarations(
+                    success_code, decls))
+
+            if release is not None:
+                # by now, the value has been released or handed over
+                success_lines.append('raw_%s = %s' % (argname, release[0]))
+
+            if success_code is not None or release is not None:
+                success_lines.append('')
+
+            return_args.append(return_code)
+
         if isinstance(sig.return_annotation, str):
-            return_line = '    return %s(%s)' % (sig.return_annotation,
-                                                 ', '.join(return_args))
+            result_expr = '%s(%s)' % (
+                self.result_constructor(sig.return_annotation),
+                ', '.join(return_args))
         elif sig.return_annotation is not inspect.Signature.empty:
-            return_line = '    return %s' % return_args[0]
+            result_expr = return_args[0]
         else:
-            return_line = None
+            result_expr = 'None'
 
-        success_on = argspecs.success_on
-        if return_line is not None:
-            if len(success_on) == 1:
-                code_lines.append('if maj_stat == %s:' % success_on[0])
-            else:
-                code_lines.append('if maj_stat in (%s):' % ', '.join(success_on))
+        batched_names = list(batched.values())
 
-            code_lines.extend(['    ' + line for line in success_lines])
-            if code_lines:
-                code_lines.extend('')
+        code_lines.append('')
+        code_lines.extend('cdef %s %s' % decl for decl in decls)
+        # only the shared arguments can be locked (batched arguments always
+        # have a C temporary), so all the calls are made under one lock
+        locked = self.locked_objects(target_func, argspecs, batched)
+        if locked:
+            code_lines.append(self._locks_decl(locked))
+        code_lines.append('cdef Py_ssize_t count, i')
+        code_lines.append('cdef OM_uint32 maj_stat, min_stat')
+        code_lines.extend('cdef %s *%s = NULL' % array for array in arrays)
 
-            code_lines.append(return_line)
+        code_lines.append('')
+        code_lines.extend('%s = list(%s)' % (batched_name, batched_name)
+                          for batched_name in batched_names)
+        code_lines.append('count = len(%s)' % batched_names[0])
+        if len(batched_names) > 1:
+            code_lines.append('if %s:' % ' or '.join(
+                'len(%s) != count' % batched_name
+                for batched_name in batched_names[1:]))
+            code_lines.append("    raise ValueError('%s must all have the "
+                              "same length')" % ', '.join(batched_names))
+
+        if has_views:
+            code_lines.append('item_views = []')
+
+        code_lines.extend('%s = %s' % (temp_name, release[0])
+                          for release, temp_name, items_name in released)
+
+        try_lines = []
+        for array_type, array_name in arrays:
+            try_lines.append('%s = <%s *>calloc(count + 1, sizeof(%s))' % (
+                array_name, array_type, array_type))
+
+        try_lines.append('if %s:' % ' or '.join(
+            '%s == NULL' % array_name for array_type, array_name in arrays))
+        try_lines.append('    raise MemoryError()')
+
+        try_lines.append('')
+        try_lines.append('# convert each item to C values')
+        try_lines.append('for i in range(count):')
+        try_lines.extend('    ' + line for line in item_lines)
+
+        call_lines = [
+            'for i in range(count):',
+            '    maj_stats[i] = gss_%s(&min_stats[i], %s)' % (
+                target_func.__name__, ', '.join(c_func_args))
+        ]
+
+        if locked:
+            try_lines.append('')
+            try_lines.extend(self._lock_lookup_lines(locked))
+
+        try_lines.append('')
+        try_lines.extend(self._call_lines(
+            call_lines, locked,
+            self.releases_gil(target_func, argspecs, batched=True)))
+
+        if has_views:
+            try_lines.append('')
+            try_lines.append('item_views = None')
+
+        if item_cleanup_lines:
+            try_lines.append('')
+            try_lines.append('for i in range(count):')
+            try_lines.extend('    ' + line for line in item_cleanup_lines)
+
+        try_lines.extend(cleanup_lines)
 
-            code_lines.append('else:')
+        success_on = argspecs.success_on
+        if len(success_on) == 1:
+            success_cond = 'maj_stat == %s' % success_on[0]
         else:
-            if len(success_on) == 1:
-                code_lines.append('if maj_stat != %s:' % success_on[0])
-            else:
-                code_lines.append('if maj_stat not in (%s):' % ', '.join(success_on))
+            success_cond = 'maj_stat in (%s)' % ', '.join(success_on)
+
+        try_lines.append('')
+        try_lines.append('results = []')
+        try_lines.append('for i in range(count):')
+        try_lines.append('    maj_stat = maj_stats[i]')
+        try_lines.append('    min_stat = min_stats[i]')
+        try_lines.extend('    ' + line for line in result_lines)
+        try_lines.append('')
+        try_lines.append('    if %s:' % success_cond)
+        try_lines.extend('        ' + line for line in success_lines)
+        try_lines.append('        results.append(%s)' % result_expr)
+        try_lines.append('    else:')
+        try_lines.append('        results.append('
+                         'gss_error_class(maj_stat)(maj_stat, min_stat))')
+        for release, temp_name, items_name in released:
+            try_lines.extend('        ' + line for line in self._replace_vars(
+                release[1], i=temp_name))
+        try_lines.append('')
+        try_lines.append('return results')
 
-        code_lines.append('    raise GSSError(maj_stat, min_stat%s)' % (
-            ', '.join([''] + error_args)))
-
-        return code_lines
-
-    def generate_func_line(self, target_func):
-        sig = inspect.signature(target_func)
+        code_lines.append('')
+        code_lines.append('try:')
+        code_lines.extend('    ' + line for line in try_lines)
+        code_lines.append('finally:')
+        if released:
+            # release whatever outputs didn't make it into a result (if
+            # something raised while building them)
+            for release, temp_name, items_name in released:
+                code_lines.extend('    ' + line for line in self._replace_vars(
+                    release[1], i=temp_name))
+
+            for release, temp_name, items_name in released:
+                code_lines.append('    if %s != NULL:' % items_name)
+                code_lines.append('        for i in range(count):')
+                code_lines.extend('            ' + line
+                                  for line in self._replace_vars(
+                                      release[1], i='%s[i]' % items_name))
 
-        param_parts = []
-        for param_name, param in sig.parameters.items():
-            # TODO(directxman12): deal with kw-only args, variadic args, etc
-            if param.annotation is not inspect.Parameter.empty:
-                if isinstance(param.annotation, NotNone):
-                    param_part = '%s %s not None'
-                    param_type = param.annotation.type
-                else:
-                    param_type = param.annotation
-                    param_part = '%s %s'
+            code_lines.append('')
 
-                if isinstance(param_type, type):
-                    param_part = param_part % (param_type.__name__, param_name)
-                else:
-                    param_part = param_part % (param_type, param_name)
-            else:
-                param_part = param_name
+        code_lines.extend('    free(%s)' % array_name
+                          for array_type, array_name in arrays)
 
-            if param.default is not inspect.Parameter.empty:
-                param_part += '=%s' % repr(param.default)
+        return code_lines
 
-            param_parts.append(param_part)
+    def _param_type(self, annotation):
+        # (type to declare a parameter as, whether it was NotNone)
+        if isinstance(annotation, NotNone):
+            annotation = annotation.type
+            not_none = True
+        else:
+            not_none = False
 
-        return 'def %s(%s):' % (target_func.__name__, ', '.join(param_parts))
+        if annotation is inspect.Parameter.empty:
+            return (None, not_none)
+        elif isinstance(annotation, type):
+            return (annotation.__name__, not_none)
+        else:
+            return (self._lookup.param_type(annotation), not_none)
+
+    def param_declaration(self, param_name, annotation):
+        param_type, not_none = self._param_type(annotation)
+        if param_type is None:
+            return param_name
+        elif not_none:
+            return '%s %s not None' % (param_type, param_name)
+        else:
+            return '%s %s' % (param_type, param_name)
 
     def wrap_doc_lines(self, lines):
         return ['"""' + lines[0]] + lines[1:] + ['"""']
 
     def preamble(self):
-        return '# gssapi-gen-code:begin\n\n\n'
+        # the cython module provides the decorators and directives used by
+        # both the generated functions and the support code
+        if self.free_threaded:
+            # this only takes effect when the generated code is at the top of
+            # the file (with nothing but comments before it)
+            return ('# gssapi-gen-code:begin\n'
+                    '# cython: freethreading_compatible=True\n\n'
+                    'cimport cython\n\n\n')
+
+        return '# gssapi-gen-code:begin\n\ncimport cython\n\n\n'
 
     def postamble(self):
-        return '$ gssapi-gen-code:end\n'
+        return '# gssapi-gen-code:end\n'
@@ -0,0 +1,149 @@
+import ast
+import builtins
+import importlib.util
+import inspect
+import types
+
+from gssapi_bindings_gen.utils import NotNone, stub_function
+
+
+# Spec modules only need to be read, not run, so the static loader parses
+# their source and rebuilds each top-level function as a stub carrying the
+# same name, docstring and signature as the real function.  Annotations may
+# be strings, builtin names (like bool or int), None or NotNone(...), and
+# defaults must be literals.
+
+_PARAM_KINDS = [
+    ('posonlyargs', inspect.Parameter.POSITIONAL_ONLY),
+    ('args', inspect.Parameter.POSITIONAL_OR_KEYWORD),
+    ('kwonlyargs', inspect.Parameter.KEYWORD_ONLY),
+]
+
+
+class _Evaluator(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+    def error(self, node, msg, *args):
+        return ValueError('%s:%s: %s' % (self.filename, node.lineno,
+                                         msg % args))
+
+    def annotation(self, node):
+        if node is None:
+            return inspect.Parameter.empty
+
+        if isinstance(node, ast.Constant):
+            if node.value is None or isinstance(node.value, str):
+                return node.value
+
+        elif isinstance(node, ast.Name):
+            try:
+                return getattr(builtins, node.id)
+            except AttributeError:
+                pass
+
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Name):
+                func_name = node.func.id
+            elif isinstance(node.func, ast.Attribute):
+                func_name = node.func.attr
+            else:
+                func_name = None
+
+            if (func_name == 'NotNone' and len(node.args) == 1 and
+                    not node.keywords):
+                return NotNone(self.annotation(node.args[0]))
+
+        raise self.error(node, 'unsupported annotation "%s"',
+                         ast.unparse(node))
+
+    def default(self, node, param_name):
+        if node is None:
+            return inspect.Parameter.empty
+
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise self.error(node, 'the default value for %s must be '
+                             'a literal (got "%s")', param_name,
+                             ast.unparse(node))
+
+    def signature(self, func_node):
+        args_node = func_node.args
+
+        # defaults line up with the end of the positional parameters
+        positional = args_node.posonlyargs + args_node.args
+        defaults = ([None] * (len(positional) - len(args_node.defaults)) +
+                    args_node.defaults)
+        defaults = dict(zip((arg.arg for arg in positional), defaults))
+        defaults.update((arg.arg, default) for arg, default
+                        in zip(args_node.kwonlyargs, args_node.kw_defaults))
+
+        params = []
+        for attr_name, kind in _PARAM_KINDS:
+            # *args goes between the positional and keyword-only parameters
+            if kind is inspect.Parameter.KEYWORD_ONLY and args_node.vararg:
+                params.append(self.parameter(
+                    args_node.vararg, inspect.Parameter.VAR_POSITIONAL))
+
+            for arg in getattr(args_node, attr_name):
+                params.append(self.parameter(arg, kind, defaults[arg.arg]))
+
+        if args_node.kwarg:
+            params.append(self.parameter(args_node.kwarg,
+                                         inspect.Parameter.VAR_KEYWORD))
+
+        return inspect.Signature(
+            params, return_annotation=self.annotation(func_node.returns))
+
+    def parameter(self, arg, kind, default=None):
+        return inspect.Parameter(arg.arg, kind,
+                                 default=self.default(default, arg.arg),
+                                 annotation=self.annotation(arg.annotation))
+
+
+def _make_function(func_node, module_name, evaluator):
+    # __doc__ is the raw docstring, just like for an imported function
+    return stub_function(func_node.name, evaluator.signature(func_node),
+                         ast.get_docstring(func_node, clean=False),
+                         module_name)
+
+
+def load_source(source, module_name, filename='<string>'):
+    """Build a stand-in module for the given spec source, without running it
+
+    The returned module contains a stub for each top-level function,
+    suitable for passing to a FuncProcessor or a CodeGenerator.
+    """
+
+    module_node = ast.parse(source, filename)
+    evaluator = _Evaluator(filename)
+
+    module = types.ModuleType(module_name, ast.get_docstring(module_node))
+    module.__file__ = filename
+
+    for node in module_node.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            setattr(module, node.name,
+                    _make_function(node, module_name, evaluator))
+
+    return module
+
+
+def find_source(module_name):
+    """Find the path of a spec module's source (without importing it)"""
+
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or spec.origin is None or not spec.origin.endswith('.py'):
+        raise ValueError("Cannot find the source for module '%s'"
+                         % module_name)
+
+    return spec.origin
+
+
+def load_module(module_name):
+    path = find_source(module_name)
+    with open(path, 'rb') as source_file:
+        source = source_file.read()
+
+    return load_source(source, module_name, path)
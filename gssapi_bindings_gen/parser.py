@@ -0,0 +1,317 @@
+import collections
+import functools
+import re
+
+from gssapi_bindings_gen.profiling import NULL_PROFILER
+
+
+# the parse tree for a spec docstring
+SpecTree = collections.namedtuple(
+    'SpecTree', ['func_docs', 'input_args', 'output_args', 'success_on',
+                 'options'])
+
+# name [-> [C type] $-expression] [# doc]
+InputArgNode = collections.namedtuple(
+    'InputArgNode', ['name', 'transform', 'doc'])
+
+# [C type] $-expression
+TransformNode = collections.namedtuple(
+    'TransformNode', ['temporary_type', 'expr', 'call'])
+
+# func($-expression; ...)[; inplace($-expression)][; cleanup(name)]
+CallNode = collections.namedtuple(
+    'CallNode', ['func', 'args', 'inplace', 'cleanup'])
+
+# name [tags: C type; [initial value;] $-expression] [-> $-expression]
+# ; -> literal expression
+# name -> ; hook(hook_name)
+OutputArgNode = collections.namedtuple(
+    'OutputArgNode', ['name', 'tags', 'temporary_type', 'initial_value',
+                      'c_arg_expr', 'expr', 'call', 'hook'])
+
+
+INPUT_ARGS = 'Input Args'
+OUTPUT_ARGS = 'Output Args'
+SUCCESS_ON = 'Success On'
+OPTIONS = 'Options'
+
+_SECTION_HEADERS = {'%s:' % header: header for header
+                    in (INPUT_ARGS, OUTPUT_ARGS, SUCCESS_ON, OPTIONS)}
+
+_CALL_START_RE = re.compile(r'(\w+)\(')
+_CALL_CLAUSES = (('inplace', '; inplace('), ('cleanup', '; cleanup('))
+_PAREN_RE = re.compile(r'[()]')
+
+
+def _match_paren(text, open_pos):
+    # most calls have no nested parens, so try the first closing paren
+    close_pos = text.find(')', open_pos)
+    if close_pos == -1:
+        return None
+    elif text.find('(', open_pos + 1, close_pos) == -1:
+        return close_pos
+
+    depth = 0
+    for paren in _PAREN_RE.finditer(text, open_pos):
+        if paren.group() == '(':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return paren.start()
+
+    return None
+
+
+def _split_args(args_raw):
+    # split on semicolons that aren't nested inside a call
+    if '(' not in args_raw:
+        return tuple(arg.strip() for arg in args_raw.split(';'))
+
+    args = []
+    depth = 0
+    last_split = 0
+    for pos, char in enumerate(args_raw):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ';' and depth == 0:
+            args.append(args_raw[last_split:pos].strip())
+            last_split = pos + 1
+
+    args.append(args_raw[last_split:].strip())
+    return tuple(args)
+
+
+def _call_body(expr, open_pos):
+    # returns the text inside the parens starting at open_pos, and
+    # the position just after the closing paren
+    close_pos = _match_paren(expr, open_pos)
+    if close_pos is None or close_pos == open_pos + 1:
+        return None, None
+
+    return expr[open_pos + 1:close_pos], close_pos + 1
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_call(expr):
+    """Parse a function-style $-expression
+
+    Returns a CallNode, or None if the expression is not a call of the form
+    func(args)[; inplace(expr)][; cleanup(name)].
+    """
+
+    func_match = _CALL_START_RE.match(expr)
+    if func_match is None:
+        return None
+
+    args_raw, pos = _call_body(expr, func_match.end() - 1)
+    if args_raw is None:
+        return None
+
+    clauses = {}
+    for clause, prefix in _CALL_CLAUSES:
+        if expr.startswith(prefix, pos):
+            clauses[clause], pos = _call_body(expr, pos + len(prefix) - 1)
+            if clauses[clause] is None:
+                return None
+
+    if pos != len(expr):
+        return None
+
+    return CallNode(func_match.group(1), _split_args(args_raw),
+                    clauses.get('inplace'), clauses.get('cleanup'))
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_transform(text):
+    """Parse an input transformation of the form [C type] $-expression"""
+
+    if text.startswith('['):
+        temp_type_end = text.index(']')
+        temporary_type = text[1:temp_type_end]
+        expr = text[temp_type_end + 1:].strip()
+    else:
+        temporary_type = None
+        expr = text
+
+    return TransformNode(temporary_type, expr, parse_call(expr))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_input_line(line):
+    """Parse a single (stripped) line from the Input Args section
+
+    Returns a string for doc-only lines, and an InputArgNode otherwise.
+    """
+
+    if line.startswith('# '):  # just doc
+        return line[2:].strip()
+
+    arg_name, sep, expr = line.partition(' -> ')
+    if ' -> ' in expr:
+        raise ValueError('Input argspecs have at most two parts '
+                         '(got spec "%s")' % line)
+
+    last_part = expr if sep else arg_name
+    doc_index = last_part.find(' # ')
+    if doc_index != -1:
+        doc = last_part[doc_index + 3:].strip()
+        last_part = last_part[:doc_index].rstrip()
+    else:
+        doc = ''
+
+    if sep:
+        return InputArgNode(arg_name, parse_transform(last_part), doc)
+    else:
+        return InputArgNode(last_part, None, doc)
+
+
+def _parse_type_annotation(annotation_expr):
+    annotation_parts = annotation_expr.split('; ')
+
+    temporary_type = annotation_parts[0]
+    tags = frozenset()
+    if ': ' in temporary_type:
+        tags_raw, temporary_type = temporary_type.split(': ', 1)
+        tags = frozenset(tags_raw.split(', '))
+
+    if len(annotation_parts) == 2:
+        initial_value = None
+        c_arg_expr = annotation_parts[1]
+    elif len(annotation_parts) == 3:
+        initial_value = annotation_parts[1]
+        c_arg_expr = annotation_parts[2]
+    else:
+        raise ValueError('Output arg type annotations must have '
+                         'either 2 or 3 parts (got type annotation '
+                         '"[%s]")' % annotation_expr)
+
+    return (tags, temporary_type, initial_value, c_arg_expr)
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_output_line(line):
+    """Parse a single (stripped) line from the Output Args section"""
+
+    # TODO(directxman12): support docs on output args
+    name_spec, sep, expr = line.partition(' -> ')
+    if ' -> ' in expr:
+        raise ValueError('Output argspecs have at most two parts')
+
+    if name_spec == ';':
+        return OutputArgNode(None, frozenset(), None, None, None,
+                             expr, None, None)
+
+    if name_spec.endswith(']'):
+        temp_type_start = name_spec.index('[')
+        arg_name = name_spec[:temp_type_start].rstrip()
+        tags, temporary_type, initial_value, c_arg_expr = (
+            _parse_type_annotation(name_spec[temp_type_start + 1:-1]))
+    elif not sep or expr.startswith('; hook('):
+        # a lone name means an input parameter (or a hooked output)
+        arg_name = name_spec
+        tags = frozenset()
+        temporary_type = initial_value = c_arg_expr = None
+    else:
+        raise ValueError('Output arg specs with more than one part '
+                         'must have a type annotation (got spec '
+                         '"%s")' % line)
+
+    hook = None
+    call = None
+    if not sep:
+        expr = None
+    elif expr.startswith('; hook('):
+        hook = expr[7:-1]
+        expr = None
+    else:
+        call = parse_call(expr)
+
+    return OutputArgNode(arg_name, tags, temporary_type, initial_value,
+                         c_arg_expr, expr, call, hook)
+
+
+def parse_option_line(line):
+    """Parse a single (stripped) line of the form 'name: value'"""
+
+    name, sep, value = line.partition(': ')
+    if not sep or not value.strip():
+        raise ValueError('Options must be of the form "name: value" '
+                         '(got "%s")' % line)
+
+    return (name.strip(), value.strip())
+
+
+def parse_spec(doc_str, profiler=NULL_PROFILER):
+    """Parse a spec docstring into a SpecTree in a single scan"""
+
+    parse_input = profiler.wrap('parse_input_line', parse_input_line)
+    parse_output = profiler.wrap('parse_output_line', parse_output_line)
+
+    # the free-form docs make up the bulk of most docstrings, so skip over
+    # them in one go instead of examining them line by line
+    input_header = '%s:\n' % INPUT_ARGS
+    header_pos = doc_str.find(input_header)
+    if header_pos == -1:
+        raise ValueError('Expected to find "%s", but it was missing'
+                         % INPUT_ARGS)
+
+    docs_end = doc_str.rfind('\n', 0, header_pos) + 1
+    func_docs = doc_str[:docs_end]
+
+    section = INPUT_ARGS
+    input_args = []
+    input_docs = []
+    output_args = []
+    success_on = None
+    options = collections.OrderedDict()
+
+    spec_lines = doc_str[header_pos + len(input_header):].splitlines()
+    for line in map(str.strip, spec_lines):
+        if not line:
+            continue
+
+        header = _SECTION_HEADERS.get(line)
+        if header is not None:
+            if header == INPUT_ARGS:
+                raise ValueError('Found more than one "%s" section'
+                                 % INPUT_ARGS)
+
+            section = header
+            if section == SUCCESS_ON:
+                success_on = []
+
+        elif section == INPUT_ARGS:
+            node = parse_input(line)
+            if isinstance(node, str):
+                # doc lines continue the docs of the last argument (the
+                # node gets rebuilt with them once the section is done)
+                if input_args:
+                    input_docs[-1].append(node)
+            else:
+                input_args.append(node)
+                input_docs.append([])
+
+        elif section == OUTPUT_ARGS:
+            output_args.append(parse_output(line))
+
+        elif section == OPTIONS:
+            name, value = parse_option_line(line)
+            if name in options:
+                raise ValueError('Option "%s" was specified more than once'
+                                 % name)
+
+            options[name] = value
+
+        else:
+            success_on.append(line)
+
+    for index, extra_docs in enumerate(input_docs):
+        if extra_docs:
+            arg = input_args[index]
+            input_args[index] = arg._replace(
+                doc=arg.doc + ''.join(extra_docs))
+
+    return SpecTree(func_docs, input_args, output_args, success_on, options)
@@ -0,0 +1,195 @@
+import collections
+import contextlib
+import functools
+import time
+
+
+class PhaseStats(object):
+    __slots__ = ('calls', 'total', 'own')
+
+    def __init__(self):
+        self.calls = 0
+        # total includes time spent in nested phases, own does not
+        self.total = 0.0
+        self.own = 0.0
+
+    def add(self, other):
+        self.calls += other.calls
+        self.total += other.total
+        self.own += other.own
+
+    def as_dict(self):
+        return {'calls': self.calls, 'total': self.total, 'own': self.own}
+
+
+class _Phase(object):
+    __slots__ = ('_profiler', '_name', '_start', 'child_time')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self.child_time = 0.0
+        self._profiler._stack.append(self)
+        self._start = time.perf_counter()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.perf_counter() - self._start
+        stack = self._profiler._stack
+        stack.pop()
+        if stack:
+            stack[-1].child_time += elapsed
+
+        stats = self._profiler._stats_for(self._name)
+        stats.calls += 1
+        stats.total += elapsed
+        stats.own += elapsed - self.child_time
+
+
+class _ProfiledObject(object):
+    # wraps every method call on an object in a profiler phase
+
+    def __init__(self, obj, phase_name, profiler):
+        self._obj = obj
+        self._phase_name = phase_name
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if callable(attr):
+            attr = self._profiler.wrap(self._phase_name, attr)
+
+        setattr(self, name, attr)
+        return attr
+
+
+class NullProfiler(object):
+    """A profiler which records nothing (and costs next to nothing)"""
+
+    _NULL_CONTEXT = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._NULL_CONTEXT
+
+    def function(self, func_name):
+        return self._NULL_CONTEXT
+
+    def wrap(self, phase_name, func):
+        return func
+
+    def wrap_object(self, obj, phase_name):
+        return obj
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class Profiler(NullProfiler):
+    """Records time and call counts per generation phase and function
+
+    Time spent in a phase nested inside another phase only counts towards
+    the own time of the innermost phase.
+    """
+
+    def __init__(self):
+        # function name -> phase name -> stats
+        self._stats = collections.OrderedDict()
+        self._stack = []
+        self._current_function = None
+
+    def _stats_for(self, phase_name):
+        func_stats = self._stats.setdefault(self._current_function,
+                                            collections.OrderedDict())
+        try:
+            return func_stats[phase_name]
+        except KeyError:
+            stats = func_stats[phase_name] = PhaseStats()
+            return stats
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    @contextlib.contextmanager
+    def function(self, func_name):
+        old_function = self._current_function
+        self._current_function = func_name
+        try:
+            with self.phase('total'):
+                yield
+        finally:
+            self._current_function = old_function
+
+    def wrap(self, phase_name, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.phase(phase_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    def wrap_object(self, obj, phase_name):
+        return _ProfiledObject(obj, phase_name, self)
+
+    def phase_totals(self):
+        totals = collections.OrderedDict()
+        for func_stats in self._stats.values():
+            for phase_name, stats in func_stats.items():
+                totals.setdefault(phase_name, PhaseStats()).add(stats)
+
+        return totals
+
+    def as_dict(self):
+        return {
+            'phases': {phase_name: stats.as_dict() for phase_name, stats
+                       in self.phase_totals().items()},
+            'functions': {
+                func_name: {phase_name: stats.as_dict()
+                            for phase_name, stats in func_stats.items()}
+                for func_name, func_stats in self._stats.items()
+                if func_name is not None
+            }
+        }
+
+    def report(self, top_functions=10):
+        lines = ['%-24s %8s %12s %12s' % ('phase', 'calls', 'own (ms)',
+                                          'total (ms)')]
+
+        totals = self.phase_totals()
+        # time spent in functions, but outside of any particular phase
+        other_stats = totals.pop('total', None)
+
+        phases = sorted(totals.items(), key=lambda item: -item[1].own)
+        if other_stats is not None:
+            phases.append(('(other)', other_stats))
+
+        for phase_name, stats in phases:
+            lines.append('%-24s %8d %12.3f %12.3f' % (
+                phase_name, stats.calls, stats.own * 1e3, stats.total * 1e3))
+
+        func_totals = [(func_name, func_stats['total'])
+                       for func_name, func_stats in self._stats.items()
+                       if 'total' in func_stats]
+        func_totals.sort(key=lambda item: -item[1].total)
+
+        if func_totals:
+            lines.append('')
+            lines.append('%-24s %12s  %s' % ('function', 'total (ms)',
+                                             'slowest phase'))
+
+        for func_name, total_stats in func_totals[:top_functions]:
+            phases = [(phase_name, stats) for phase_name, stats
+                      in self._stats[func_name].items()
+                      if phase_name != 'total']
+            if phases:
+                slowest_name, slowest = max(phases,
+                                            key=lambda item: item[1].own)
+                slowest_text = '%s (%.3f ms)' % (slowest_name,
+                                                 slowest.own * 1e3)
+            else:
+                slowest_text = '-'
+
+            lines.append('%-24s %12.3f  %s' % (
+                func_name, total_stats.total * 1e3, slowest_text))
+
+        return lines
@@ -0,0 +1,74 @@
+import re
+
+from gssapi_bindings_gen.emitter import atomic_output
+
+
+BEGIN_MARKER = '# gssapi-gen-code:begin'
+END_MARKER = '# gssapi-gen-code:end'
+
+_BEGIN_RE = re.compile(r'^%s$' % re.escape(BEGIN_MARKER), re.MULTILINE)
+# older versions of the generator wrote the end marker with a '$'
+_END_RE = re.compile(r'^[#$]%s$\n?' % re.escape(END_MARKER[1:]),
+                     re.MULTILINE)
+_FUNC_RE = re.compile(r'^def (\w+)\(', re.MULTILINE)
+
+
+def find_region(content):
+    """Find the generated region (markers included) in the given content
+
+    Returns the (start, end) offsets of the region.
+    """
+
+    begin_match = _BEGIN_RE.search(content)
+    if begin_match is None:
+        raise ValueError('Could not find the "%s" marker' % BEGIN_MARKER)
+
+    end_match = _END_RE.search(content, begin_match.end())
+    if end_match is None:
+        raise ValueError('Could not find the "%s" marker after the "%s" '
+                         'marker' % (END_MARKER, BEGIN_MARKER))
+
+    return (begin_match.start(), end_match.end())
+
+
+def _functions_in(region):
+    starts = list(_FUNC_RE.finditer(region))
+    ends = [func_match.start() for func_match in starts[1:]] + [len(region)]
+
+    return {func_match.group(1): region[func_match.start():end]
+            for func_match, end in zip(starts, ends)}
+
+
+def changed_functions(old_region, new_region):
+    """List the functions that were added, removed or changed"""
+
+    old_funcs = _functions_in(old_region)
+    new_funcs = _functions_in(new_region)
+
+    return sorted(name for name in set(old_funcs) | set(new_funcs)
+                  if old_funcs.get(name) != new_funcs.get(name))
+
+
+def splice_file(path, generated):
+    """Replace the generated region of the file at path
+
+    The file is only rewritten if its contents would actually change, so
+    that its mtime (and thus anything built from it) is left alone
+    otherwise.  Returns None if the file was left alone, and the names of
+    the changed functions if it was rewritten.
+    """
+
+    with open(path, 'rb') as existing_file:
+        existing_raw = existing_file.read()
+
+    existing = existing_raw.decode('utf-8')
+    start, end = find_region(existing)
+
+    new_raw = (existing[:start] + generated + existing[end:]).encode('utf-8')
+    if new_raw == existing_raw:
+        return None
+
+    with atomic_output(path, 'wb') as output_file:
+        output_file.write(new_raw)
+
+    return changed_functions(existing[start:end], generated)
@@ -2,3 +2,21 @@ from collections import namedtuple
 
 NotNone = namedtuple('NotNone', ['type'])
 
+
+def stub_function(name, signature, doc=None, module=None):
+    """Make a stand-in for a spec function which was never defined as such
+
+    The stub has the given name, signature and docstring, as far as
+    inspect (and thus the processor and generators) are concerned.
+    """
+
+    def stub(*args, **kwargs):
+        raise TypeError('%s is a stub, and cannot be called' % name)
+
+    stub.__name__ = name
+    stub.__qualname__ = name
+    stub.__module__ = module
+    stub.__doc__ = doc
+    stub.__signature__ = signature
+
+    return stub
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import traceback
+
+from gssapi_bindings_gen.cache import cache_key
+
+
+class FileWatcher(object):
+    """Polls a set of files for changes
+
+    A file counts as changed when its modification time or size differs
+    from when it was last polled (or when it appears or disappears).
+    """
+
+    def __init__(self, paths, interval=0.5):
+        self.paths = list(paths)
+        self.interval = interval
+        self._stamps = {path: self._stamp(path) for path in self.paths}
+
+    def _stamp(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def poll(self):
+        changed = []
+        for path in self.paths:
+            stamp = self._stamp(path)
+            if stamp != self._stamps[path]:
+                self._stamps[path] = stamp
+                changed.append(path)
+
+        return changed
+
+    def wait(self):
+        """Block until at least one file has changed, returning those files"""
+
+        while True:
+            changed = self.poll()
+            if changed:
+                return changed
+
+            time.sleep(self.interval)
+
+
+class FunctionTracker(object):
+    """Tracks which functions changed between generations
+
+    A function has changed when its name, signature or docstring (and
+    thus its cache key) differ from the previous generation.
+    """
+
+    def __init__(self, gen):
+        self._gen = gen
+        self._keys = {}
+
+    def update(self, funcs):
+        fingerprint = self._gen.fingerprint()
+        keys = {func.__name__: cache_key(func, fingerprint) for func in funcs}
+
+        changed = [func_name for func_name, key in keys.items()
+                   if self._keys.get(func_name) != key]
+        self._keys = keys
+
+        return changed
+
+
+def watch(paths, regenerate, interval=0.5):
+    """Call regenerate now, and again whenever one of the files changes
+
+    Errors raised by regenerate (such as a syntax error in a half-edited
+    spec) are printed, and watching continues.  This only returns by way
+    of an exception, such as KeyboardInterrupt.
+    """
+
+    watcher = FileWatcher(paths, interval)
+
+    while True:
+        try:
+            regenerate()
+        except Exception:
+            traceback.print_exc()
+
+        print('watching %s for changes...' % ', '.join(paths),
+              file=sys.stderr)
+        watcher.wait()
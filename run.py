@@ -1,28 +1,288 @@
+import argparse
+import importlib
+import io
+import json
+import os
+import sys
+
+from gssapi_bindings_gen import batch
+from gssapi_bindings_gen import harness
+from gssapi_bindings_gen import loader
+from gssapi_bindings_gen import watch
+from gssapi_bindings_gen.cache import MemoryCache, ResultCache
+from gssapi_bindings_gen.emitter import atomic_output, CodeEmitter
 from gssapi_bindings_gen.processor import FuncProcessor
+from gssapi_bindings_gen.profiling import NULL_PROFILER, Profiler
+from gssapi_bindings_gen.splice import splice_file
+from gssapi_bindings_gen.languages.cffi import CffiCodeGenerator
 from gssapi_bindings_gen.languages.cython import CythonCodeGenerator
 
-gen = CythonCodeGenerator(FuncProcessor)
 
-if __name__ == '__main__':
-    import sys
+LANGUAGES = {'cython': CythonCodeGenerator,
+             'cffi': CffiCodeGenerator}
+
+
+def report_splice(path, changed):
+    if changed is None:
+        print('%s: unchanged' % path, file=sys.stderr)
+    elif changed:
+        print('%s: updated %s' % (path, ', '.join(changed)), file=sys.stderr)
+    else:
+        print('%s: updated' % path, file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate GSSAPI bindings from spec modules')
+    parser.add_argument('target', metavar='module[#func]', nargs='?',
+                        help='the spec module (or single function in it) '
+                             'to generate code for')
+    parser.add_argument('--cache-dir',
+                        help='reuse results for unchanged functions from '
+                             'this directory')
+    parser.add_argument('-o', '--output',
+                        help='write the generated code to this file instead '
+                             'of stdout (the file is replaced atomically)')
+    parser.add_argument('--splice', metavar='FILE',
+                        help='replace the generated region of an existing '
+                             'file, leaving it untouched if nothing changed')
+    parser.add_argument('--static', action='store_true',
+                        help='read spec modules by parsing their source, '
+                             'instead of importing them')
+    parser.add_argument('--language', choices=sorted(LANGUAGES),
+                        default='cython',
+                        help='the kind of bindings to generate (cffi '
+                             'generates Python code for out-of-line API-mode '
+                             'CFFI modules)')
+    parser.add_argument('--cffi-builder', metavar='FILE',
+                        help='with --language cffi, also write a script '
+                             'building the CFFI module used by the generated '
+                             'code to this file')
+    parser.add_argument('--cffi-module', default='_gssapi_cffi',
+                        metavar='NAME',
+                        help='the name of the CFFI module built by the '
+                             '--cffi-builder script')
+    parser.add_argument('--free-threaded', action='store_true',
+                        help='generate code for free-threaded Python, which '
+                             'locks wrapper objects (like security contexts) '
+                             'around the calls which change them')
+    parser.add_argument('--freelist-size', type=int, default=8,
+                        metavar='N',
+                        help='keep up to N freed objects of each generated '
+                             'class for reuse (0 disables freelists)')
+    parser.add_argument('--module-name', metavar='NAME',
+                        help='the dotted name of the module the generated '
+                             'code gets imported as, which result types are '
+                             'defined in (defaults to the spec module\'s '
+                             'name)')
+    parser.add_argument('--channel-bindings-module', metavar='NAME',
+                        help='the dotted name of the module which defines '
+                             'CachedChannelBindings, so that the code '
+                             'generated for other modules imports it '
+                             '(defaults to defining it wherever it is used)')
+    parser.add_argument('--harness', metavar='DIR',
+                        help='also write a benchmark harness for the '
+                             'generated functions, along with a stub GSSAPI '
+                             'library to run it against, to this directory')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, and regenerate the output '
+                             'whenever the spec module changes')
+    parser.add_argument('--watch-interval', type=float, default=0.5,
+                        metavar='SECONDS',
+                        help='how often to check the spec module for '
+                             'changes with --watch')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each phase of '
+                             'generation (per function) to stderr')
+    parser.add_argument('--profile-json', metavar='FILE',
+                        help='write the profiling data as JSON to this file '
+                             '(implies --profile)')
+    parser.add_argument('--manifest',
+                        help='generate every module listed in this manifest '
+                             'using a pool of worker processes')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='the number of worker processes to use with '
+                             '--manifest (defaults to the number of CPUs)')
+    args = parser.parse_args(argv)
+
+    if args.profile_json is not None:
+        args.profile = True
+
+    if args.freelist_size < 0:
+        parser.error('--freelist-size may not be negative')
+
+    if args.language == 'cffi' and args.free_threaded:
+        parser.error('--free-threaded may not be used with --language cffi')
+    if args.cffi_builder is not None and args.language != 'cffi':
+        parser.error('--cffi-builder requires --language cffi')
+
+    generator_cls = LANGUAGES[args.language]
+
+    if args.manifest is not None:
+        if args.target is not None:
+            parser.error('a target may not be specified with --manifest')
+        if args.profile:
+            parser.error('--profile may not be used with --manifest')
+        if args.watch:
+            parser.error('--watch may not be used with --manifest')
+        if args.harness is not None:
+            parser.error('--harness may not be used with --manifest (set '
+                         '"harness" in the manifest instead)')
+        if args.cffi_builder is not None:
+            parser.error('--cffi-builder may not be used with --manifest')
+        if args.module_name is not None:
+            parser.error('--module-name may not be used with --manifest')
+
+        splice_results = batch.run_batch(
+            batch.load_manifest(args.manifest), generator_cls,
+            FuncProcessor, cache_dir=args.cache_dir, jobs=args.jobs,
+            static=args.static, free_threaded=args.free_threaded,
+            freelist_size=args.freelist_size,
+            channel_bindings_module=args.channel_bindings_module)
+
+        for path, changed in splice_results:
+            report_splice(path, changed)
+
+        return
+    elif args.target is None:
+        parser.error('you must supply a package or a method')
+    elif args.splice is not None and (args.output is not None or
+                                      '#' in args.target):
+        parser.error('--splice may only be used with a whole module, and '
+                     'not with --output')
+    elif args.watch and args.output is None and args.splice is None:
+        parser.error('--watch requires --output or --splice')
+    elif args.watch and args.profile:
+        parser.error('--profile may not be used with --watch')
+    elif args.watch and args.harness is not None:
+        parser.error('--harness may not be used with --watch')
+    elif args.watch and args.cffi_builder is not None:
+        parser.error('--cffi-builder may not be used with --watch')
+
+    if args.cache_dir is not None:
+        cache = ResultCache(args.cache_dir)
+    else:
+        cache = None
+
+    if args.watch:
+        # keep results in memory between generations, so that only
+        # changed functions get processed again
+        cache = MemoryCache(cache)
+
+    if args.profile:
+        profiler = Profiler()
+    else:
+        profiler = NULL_PROFILER
+
+    gen = generator_cls(FuncProcessor, cache=cache, profiler=profiler,
+                        free_threaded=args.free_threaded,
+                        freelist_size=args.freelist_size,
+                        module_name=args.module_name,
+                        channel_bindings_module=args.channel_bindings_module)
+
+    if '#' in args.target:
+        import_path, import_func = args.target.split('#')
+    else:
+        import_path = args.target
+        import_func = None
 
-    if len(sys.argv) == 2:
-        raw_import_path = sys.argv[1]
-        if '#' in raw_import_path:
-            import_path, import_func = raw_import_path.split('#')
+    def load_module():
+        if args.static:
+            return loader.load_module(import_path)
+        elif args.watch and import_path in sys.modules:
+            return importlib.reload(sys.modules[import_path])
         else:
-            import_path = raw_import_path
-            import_func = None
+            __import__(import_path)
+            return sys.modules[import_path]
 
-        __import__(import_path)
+    def write_code(stream, module):
+        out = CodeEmitter(stream)
+        if import_func is not None:
+            gen.write_function(getattr(module, import_func), out)
+        else:
+            gen.write_module(module, out)
+
+    def generate(module):
+        emit_code = write_code
+        if args.cffi_builder is not None:
+            # the builder declares whatever the generated code uses from the
+            # CFFI module, so the code has to be generated first
+            code_buff = io.StringIO()
+            write_code(code_buff, module)
+            code = code_buff.getvalue()
+
+            with atomic_output(args.cffi_builder) as builder_file:
+                builder_file.write(gen.builder_source(code, args.cffi_module))
+
+            def emit_code(stream, module):
+                stream.write(code)
+
+        if args.output is not None:
+            with atomic_output(args.output) as output_file:
+                emit_code(output_file, module)
+        elif args.splice is not None:
+            code_buff = io.StringIO()
+            emit_code(code_buff, module)
+
+            changed = splice_file(args.splice, code_buff.getvalue())
+            report_splice(args.splice, changed)
+        else:
+            emit_code(sys.stdout, module)
+
+    if args.watch:
+        tracker = watch.FunctionTracker(gen)
+
+        def regenerate():
+            module = load_module()
+            if import_func is not None:
+                funcs = [getattr(module, import_func)]
+            else:
+                funcs = gen.functions_for_module(module)
+
+            changed = tracker.update(funcs)
+            generate(module)
+            cache.prune()
+
+            if changed:
+                print('regenerated %s' % ', '.join(changed), file=sys.stderr)
+            else:
+                print('no functions changed', file=sys.stderr)
 
-        module = sys.modules[import_path]
+        try:
+            watch.watch([loader.find_source(import_path)], regenerate,
+                        args.watch_interval)
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    module = load_module()
+    generate(module)
+
+    if args.harness is not None:
         if import_func is not None:
-            func = getattr(module, import_func)
-            code = gen.code_for_function(func)
+            funcs = [getattr(module, import_func)]
         else:
-            code = gen.code_for_module(module)
+            funcs = gen.functions_for_module(module)
 
-        print(code)
-    else:
-        sys.exit("You must supply a package or a method")
+        # the compiled module is named after the generated file
+        target_path = args.output or args.splice
+        if target_path is not None:
+            bindings_module = os.path.splitext(
+                os.path.basename(target_path))[0]
+        else:
+            bindings_module = import_path
+
+        harness.write_harness(gen, import_path, funcs, args.harness,
+                              bindings_module=bindings_module)
+
+    if args.profile:
+        print('\n'.join(profiler.report()), file=sys.stderr)
+
+        if args.profile_json is not None:
+            with open(args.profile_json, 'w') as profile_file:
+                json.dump(profiler.as_dict(), profile_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,7 +36,14 @@
 # use the form
 #   c_param_name [C type; $-expression] -> $-expression
 #
-# When a function outputs a tuple, list the arguments in order of the tuple
+# When a function outputs a tuple, list the arguments in order of the tuple.  The
+# tuple type named in the return annotation is generated alongside the function as a
+# struct sequence (a tuple with named fields, like os.stat_result), so functions
+# returning the same type must list the same output args.  Literal outputs (see below)
+# become unnamed fields, which are only accessible by index.  Unlike namedtuples, struct
+# sequences have no _asdict, _replace or _fields.  Result types are named after the module
+# given with --module-name (the spec module by default), which has to be the module the
+# generated code is imported as for results to be picklable.
 #
 # If an input argument is also an output argument, the type expression,
 #   [C type; $-expression]
@@ -58,6 +65,62 @@
 #   ; -> literal expression
 # which causes the literal expression to be inserted as the appropriate tuple item
 
+# general rules for conversion helpers:
+# calls to IntEnumFlagSet, py_ttl_to_c and c_ttl_to_py in input and output
+# $-expressions are replaced by inline cdef versions written alongside the generated
+# code.  Flag sets returned this way are cached by value and shared between calls,
+# so they cannot be modified (adding or discarding flags raises a TypeError).
+
+# ChannelBindings inputs use the borrow_channel_bindings transformer.  A
+# CachedChannelBindings (a ChannelBindings subclass written alongside the generated code)
+# keeps its C value between calls, and rebuilds it after being modified, so passing one
+# avoids building and freeing the C value on every call.  When several modules are
+# generated, pass --channel-bindings-module to have only that module define the class,
+# and the others import it (with Cython, its .pxd must then declare the class, as noted
+# in the generated code), so that instances work with the functions of every module.
+
+# 'buffer' inputs use the pybuffer_to_buffer transformer, which passes any C-contiguous
+# object supporting the buffer protocol (of any item size or shape) to GSSAPI as its raw
+# bytes, without copying it.  Non-contiguous buffers (like memoryview slices with a step)
+# are rejected, since they can't be passed without copying.
+
+# general rules for options:
+# an optional "Options:" section holds lines of the form
+#   option_name: value
+#
+# The 'many' option generates an additional batched variant, named func_name_many,
+# which takes a list of values for the given input args, and makes all of the C
+# calls in a single nogil block:
+#   many: input_name -> batched_name[, input_name -> batched_name...]
+# It returns a list with one entry per item, holding either the normal result, or
+# the error for that item.  Batched variants do not support hooks or optional
+# output args.
+#
+# The 'nogil' option controls whether the GIL is released around the C call:
+#   nogil: always | never | auto
+# 'auto' (the default) releases it, unless the call is one of the generator's known
+# cheap calls (like context_time), which take less time than releasing and
+# reacquiring the GIL would.  Batched variants release it unless 'never' is given.
+#
+# The 'async' option generates an additional coroutine variant, named func_name_async,
+# which converts its arguments in the calling thread, and then makes the C call on an
+# executor (a bounded thread pool, unless another executor is set with set_gss_executor):
+#   async: yes | no
+# Like batched variants, it releases the GIL unless 'never' is given.
+
+# general rules for errors:
+# the errors listed in the docs' "Raises:" section (one per line) are raised directly
+# for the corresponding GSSAPI routine errors, via a table indexed by routine error.
+# Other failures (and errors with no routine error, like ExpiredTokenError) raise a
+# plain GSSError.  The table is shared by the whole module.
+
+# general rules for other languages:
+# with --language cffi, the same specs generate plain Python for out-of-line API-mode
+# CFFI bindings (see --cffi-builder), with $-expressions written as for Cython.  There,
+# the 'nogil' option has no effect (CFFI releases the GIL around every call), batched
+# variants loop over the single-item function, and async variants make the whole call
+# (including converting the arguments) on the executor.
+
 # Not yet implemented/on hold
 #  If an if statement is desired, use the form
 #   value => $-expression; ...; otherwise-$-expression
@@ -99,7 +162,7 @@ def init_sec_context(target_name: NotNone('Name'), creds: 'Creds' = None,
     Input Args:
         creds -> [gss_cred_id_t] default(GSS_C_NO_CREDENTIAL)
             # the credenitals to use to initiate the context, or None to use the default credentials
-        context -> [SecurityContext] default_assign(SecurityContext()); inplace(&$.raw_ctx)
+        context -> [SecurityContext] default_assign(SecurityContext.__new__(SecurityContext)); inplace(&$.raw_ctx)
             # the security context to update, or None to create a new context
         target_name  # the target for the security context
         mech -> [gss_OID] default(GSS_C_NO_OID; &$.raw_oid)
@@ -124,6 +187,8 @@ def init_sec_context(target_name: NotNone('Name'), creds: 'Creds' = None,
     Success On:
         GSS_S_COMPLETE
         GSS_S_CONTINUE_NEEDED
+    Options:
+        async: yes
     """
 
 
@@ -155,7 +220,7 @@ def accept_sec_context(input_token: NotNone('bytes'),
         BadMechanismError
 
     Input Args:
-        context -> [SecurityContext] default_assign(SecurityContext()); inplace(&$.raw_ctx)
+        context -> [SecurityContext] default_assign(SecurityContext.__new__(SecurityContext)); inplace(&$.raw_ctx)
             # the security context to update
         acceptor_creds -> default(GSS_C_NO_CREDENTIAL)
             # the creds to use to accept the context
@@ -250,3 +315,31 @@ def process_context_token(context: NotNone('SecurityContext'), token: 'bytes'):
         context  # the security context to update
         token -> bytes_to_buffer($)  # the token to use to update the context
     """
+
+
+def get_mic(context: NotNone('SecurityContext'), message: NotNone('buffer'),
+            qop=None) -> bytes:
+    """
+    Generate a MIC for a message.
+
+    This method generates a Message Integrity Check token for the
+    given message.  The message may be any object supporting the
+    buffer protocol (such as bytes, a bytearray, a memoryview, or an
+    array), which is passed to GSSAPI without being copied, so it must
+    be C-contiguous (non-contiguous views, like slices with a step,
+    are rejected).
+
+    Raises:
+        ExpiredContextError
+        MissingContextError
+        BadQoPError
+
+    Input Args:
+        context  # the current security context
+        qop -> [gss_qop_t] default(GSS_C_QOP_DEFAULT; $)
+            # the desired Quality of Protection (or None for the default QoP)
+        message  # the message for which to generate the MIC
+
+    Output Args:
+        token [gss_buffer_desc; &$]
+    """
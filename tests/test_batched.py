@@ -0,0 +1,48 @@
+import pytest
+
+from gssapi_bindings_gen.languages.cffi import CffiCodeGenerator
+from gssapi_bindings_gen.languages.cython import CythonCodeGenerator
+from gssapi_bindings_gen.processor import FuncProcessor
+from gssapi_bindings_gen.utils import NotNone
+
+
+def _spec(nogil):
+    def context_time(context: NotNone('SecurityContext')) -> int:
+        pass
+
+    context_time.__doc__ = """
+    Get the time for which a context remains valid.
+
+    Input Args:
+        context  # the context
+
+    Output Args:
+        ttl [OM_uint32; &$] -> c_ttl_to_py($)
+
+    Options:
+        many: context -> contexts
+        nogil: %s
+    """ % nogil
+    return context_time
+
+
+@pytest.mark.parametrize('nogil, releases', [
+    ('always', True),
+    ('auto', True),
+    ('never', False),
+])
+def test_cython_batched_docs_follow_nogil(nogil, releases):
+    generator = CythonCodeGenerator(FuncProcessor)
+    func = _spec(nogil)
+    docs = generator.batched_docs(func, generator.processor.process(func))
+
+    assert docs.startswith('\n    Call context_time once for each item')
+    assert ('releasing the GIL' in docs) == releases
+
+
+def test_cffi_batched_docs_never_mention_the_gil():
+    generator = CffiCodeGenerator(FuncProcessor)
+    func = _spec('auto')
+    docs = generator.batched_docs(func, generator.processor.process(func))
+
+    assert 'GIL' not in docs
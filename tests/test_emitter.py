@@ -0,0 +1,26 @@
+import pytest
+
+from gssapi_bindings_gen.emitter import atomic_output
+
+
+def test_atomic_output_creates_missing_directories(tmp_path):
+    path = tmp_path / 'missing' / 'dir' / 'out.pyx'
+
+    with atomic_output(str(path)) as output_file:
+        output_file.write('generated\n')
+
+    assert path.read_text() == 'generated\n'
+    assert [p.name for p in path.parent.iterdir()] == ['out.pyx']
+
+
+def test_atomic_output_leaves_path_alone_on_error(tmp_path):
+    path = tmp_path / 'out.pyx'
+    path.write_text('old\n')
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(str(path)) as output_file:
+            output_file.write('partial')
+            raise RuntimeError('failed')
+
+    assert path.read_text() == 'old\n'
+    assert [p.name for p in tmp_path.iterdir()] == ['out.pyx']
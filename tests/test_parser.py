@@ -0,0 +1,264 @@
+import inspect
+import re
+
+import pytest
+
+import sample_methods
+from gssapi_bindings_gen import parser
+
+
+# the docstring handling of the processor before the single-pass parser,
+# without the lookups, to check that the parser still reads the sample
+# specs the same way
+
+_TRANSFORMER_RE = re.compile(r'^(?P<func>\w+)\((?P<args>.+?)\)'
+                             r'(; inplace\((?P<inline>.+)\))?'
+                             r'(; cleanup\((?P<cleanup>.+)\))?$')
+
+
+def _find_start(content, header, mandatory=False, offset=0):
+    full_header = '%s:\n' % header
+    content_partial = content[offset:]
+    if full_header in content:
+        return content_partial.index(full_header) + len(full_header) + offset
+    elif not mandatory:
+        return None
+    else:
+        raise ValueError('Expected to find "%s", but it was missing' % header)
+
+
+def _baseline_call(expr):
+    func_match = _TRANSFORMER_RE.match(expr)
+    if func_match is None:
+        return None
+
+    return (func_match.group('func'),
+            tuple(p.strip() for p in func_match.group('args').split(';')),
+            func_match.group('inline'), func_match.group('cleanup'))
+
+
+def _baseline_input_line(line):
+    if line.startswith('# '):
+        return (True, line[2:].strip())
+
+    parts = line.split(' -> ')
+    if ' # ' in parts[-1]:
+        doc_index = parts[-1].index(' # ')
+        doc_str = parts[-1][doc_index + 3:].strip()
+        parts[-1] = parts[-1][:doc_index].rstrip()
+    else:
+        doc_str = None
+
+    if len(parts) == 1:
+        return (False, doc_str, parts[0], None)
+
+    trans_raw = parts[1]
+    if trans_raw.startswith('['):
+        temp_type_end = trans_raw.index(']')
+        temporary_type = trans_raw[1:temp_type_end]
+        dollar_expr = trans_raw[temp_type_end + 1:].strip()
+    else:
+        temporary_type = None
+        dollar_expr = trans_raw
+
+    return (False, doc_str, parts[0],
+            (temporary_type, dollar_expr, _baseline_call(dollar_expr)))
+
+
+def _baseline_output_line(line):
+    parts = line.split(' -> ')
+    name_spec = parts[0]
+
+    tags = set()
+    temporary_type = initial_value = c_arg_expr = None
+    if name_spec.endswith(']'):
+        temp_type_start = name_spec.index('[')
+        arg_name = name_spec[:temp_type_start - 1]
+        annotation_parts = name_spec[temp_type_start + 1:-1].split('; ')
+        temporary_type = annotation_parts[0]
+        if ': ' in temporary_type:
+            tags_raw, temporary_type = temporary_type.split(': ', 1)
+            tags = set(tags_raw.split(', '))
+
+        if len(annotation_parts) == 2:
+            c_arg_expr = annotation_parts[1]
+        else:
+            initial_value, c_arg_expr = annotation_parts[1:]
+    elif name_spec == ';':
+        arg_name = None
+    else:
+        arg_name = name_spec
+
+    hook = expr = call = None
+    if len(parts) == 2:
+        if parts[1].startswith('; hook('):
+            hook = parts[1][7:-1]
+        else:
+            expr = parts[1]
+            if arg_name is not None:
+                call = _baseline_call(expr)
+
+    return (arg_name, tags, temporary_type, initial_value, c_arg_expr,
+            expr, call, hook)
+
+
+def _baseline_parse(doc_str):
+    # the old processor predates the "Options:" section
+    options_pos = doc_str.find('    Options:\n')
+    if options_pos != -1:
+        doc_str = doc_str[:options_pos]
+
+    input_args_start = _find_start(doc_str, 'Input Args', mandatory=True)
+    output_args_start = _find_start(doc_str, 'Output Args',
+                                    offset=input_args_start)
+    success_on_start = _find_start(doc_str, 'Success On',
+                                   offset=output_args_start or
+                                   input_args_start)
+
+    if output_args_start is not None:
+        input_args_end = output_args_start - 13
+    elif success_on_start is not None:
+        input_args_end = success_on_start - 12
+    else:
+        input_args_end = len(doc_str) + 1
+
+    if success_on_start is not None:
+        output_args_end = success_on_start - 12
+    else:
+        output_args_end = len(doc_str) + 1
+
+    input_args = []
+    last_arg = None
+    for line in doc_str[input_args_start:input_args_end].splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        info = _baseline_input_line(line)
+        if info[0]:
+            if last_arg is not None:
+                last_arg[1] += info[1]
+        else:
+            last_arg = [info[2], info[1] or '', info[3]]
+            input_args.append(last_arg)
+
+    output_args = []
+    if output_args_start is not None:
+        for line in doc_str[output_args_start:output_args_end].splitlines():
+            line = line.strip()
+            if line:
+                output_args.append(_baseline_output_line(line))
+
+    if success_on_start is not None:
+        success_on = [line.strip() for line
+                      in doc_str[success_on_start:].splitlines()
+                      if line and not line.isspace()]
+    else:
+        success_on = None
+
+    return (doc_str[:input_args_start - 12],
+            [tuple(arg) for arg in input_args], output_args, success_on)
+
+
+def _sample_specs():
+    return [func for name, func
+            in inspect.getmembers(sample_methods, inspect.isfunction)
+            if func.__module__ == sample_methods.__name__]
+
+
+def _call_tuple(call):
+    if call is None:
+        return None
+
+    return (call.func, call.args, call.inplace, call.cleanup)
+
+
+@pytest.mark.parametrize('func', _sample_specs(),
+                         ids=lambda func: func.__name__)
+def test_parse_spec_matches_baseline(func):
+    func_docs, input_args, output_args, success_on = (
+        _baseline_parse(func.__doc__))
+    spec = parser.parse_spec(func.__doc__)
+
+    # the old processor kept the indentation before "Input Args:"
+    assert spec.func_docs == func_docs.rstrip(' ')
+
+    assert [(arg.name, arg.doc,
+             arg.transform and (arg.transform.temporary_type,
+                                arg.transform.expr,
+                                _call_tuple(arg.transform.call)))
+            for arg in spec.input_args] == input_args
+
+    assert [(arg.name, set(arg.tags), arg.temporary_type, arg.initial_value,
+             arg.c_arg_expr, arg.expr, _call_tuple(arg.call), arg.hook)
+            for arg in spec.output_args] == output_args
+
+    assert spec.success_on == success_on
+
+
+def test_parse_spec_options():
+    spec = parser.parse_spec(sample_methods.init_sec_context.__doc__)
+    assert dict(spec.options) == {'async': 'yes'}
+
+
+def test_parse_spec_without_options():
+    spec = parser.parse_spec(sample_methods.context_time.__doc__)
+    assert dict(spec.options) == {}
+    assert spec.success_on is None
+    assert [arg.name for arg in spec.output_args] == ['ttl']
+
+
+def test_parse_spec_options_only():
+    spec = parser.parse_spec('\n'.join([
+        'Docs.',
+        '',
+        'Input Args:',
+        '    context',
+        'Options:',
+        '    nogil: never',
+    ]))
+
+    assert [arg.name for arg in spec.input_args] == ['context']
+    assert spec.output_args == []
+    assert spec.success_on is None
+    assert dict(spec.options) == {'nogil': 'never'}
+
+
+def test_parse_spec_rejects_missing_input_args():
+    with pytest.raises(ValueError, match='Input Args'):
+        parser.parse_spec('Docs.\n\nOutput Args:\n    token\n')
+
+
+def test_parse_spec_rejects_repeated_options():
+    with pytest.raises(ValueError, match='more than once'):
+        parser.parse_spec('Input Args:\n    context\n'
+                          'Options:\n    async: yes\n    async: no\n')
+
+
+def test_parse_call_nested_parens():
+    call = parser.parse_call(
+        'default_assign(SecurityContext.__new__(SecurityContext)); '
+        'inplace(&$.raw_ctx)')
+    assert call == parser.CallNode(
+        'default_assign', ('SecurityContext.__new__(SecurityContext)',),
+        '&$.raw_ctx', None)
+
+
+def test_parse_call_nested_args():
+    call = parser.parse_call('default(BLAH; IntEnumFlagSet(RequirementFlag, '
+                             'f($; 1))); cleanup(free_buffer)')
+    assert call == parser.CallNode(
+        'default', ('BLAH', 'IntEnumFlagSet(RequirementFlag, f($; 1))'),
+        None, 'free_buffer')
+
+
+@pytest.mark.parametrize('expr', [
+    '$',
+    'f()',
+    'f(a',
+    'f(g(a)',
+    'f(a) + 1',
+    'f(a); inplace(',
+])
+def test_parse_call_rejects_non_calls(expr):
+    assert parser.parse_call(expr) is None
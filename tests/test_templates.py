@@ -0,0 +1,81 @@
+import re
+
+import pytest
+
+import sample_methods
+from gssapi_bindings_gen.languages import base
+from gssapi_bindings_gen.languages.cffi import CffiCodeGenerator
+from gssapi_bindings_gen.languages.cython import CythonCodeGenerator
+from gssapi_bindings_gen.processor import FuncProcessor
+
+
+def _baseline_replace_vars(lines, **varspec):
+    # replace_vars before templates were compiled
+    if isinstance(lines, str):
+        lines = [lines]
+        was_str = True
+    else:
+        was_str = False
+
+    def replace_func(m):
+        return varspec.get(m.group(2), m.group(0))
+
+    for varname, varval in varspec.items():
+        replace_re = r'\$({)?([a-z]+)(?(1)})'
+        lines = [re.sub(replace_re, replace_func, line) for line in lines]
+
+    if was_str:
+        return lines[0]
+    else:
+        return lines
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    calls = []
+    render = base.Template.render
+
+    def recording_render(template, varspec):
+        result = render(template, varspec)
+        calls.append((template.text, dict(varspec), result))
+        return result
+
+    monkeypatch.setattr(base.Template, 'render', recording_render)
+    return calls
+
+
+@pytest.mark.parametrize('generator_cls', [CythonCodeGenerator,
+                                           CffiCodeGenerator])
+def test_sample_methods_render_like_baseline(generator_cls, renders):
+    generator_cls(FuncProcessor).code_for_module(sample_methods)
+    assert renders
+
+    for text, varspec, result in renders:
+        assert result == _baseline_replace_vars(text, **varspec), text
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('$o = $i', 'out = in'),
+    ('${o}_owned = ${i}', 'out_owned = in'),
+    ('$$o', '$out'),
+    ('$${i}', '$in'),
+    ('$', '$'),
+    ('$$', '$$'),
+    ('price in $US', 'price in $US'),
+    ('$unknown and ${unknown}', '$unknown and ${unknown}'),
+    ('${o', '${o'),
+    ('', ''),
+])
+def test_template_placeholders(text, expected):
+    assert base.Template(text).render({'o': 'out', 'i': 'in'}) == expected
+    assert base.replace_vars(text, o='out', i='in') == expected
+    assert _baseline_replace_vars(text, o='out', i='in') == expected
+
+
+def test_template_renders_values_once():
+    # unlike the old replace_vars, values aren't searched for placeholders
+    assert base.replace_vars('$a', a='$b', b='x') == '$b'
+
+
+def test_replace_vars_lines():
+    assert base.replace_vars(['$a', 'b', '${a}c'], a='x') == ['x', 'b', 'xc']